@@ -1,193 +1,125 @@
-import importlib.util
-import subprocess
-import sys
-import os
-
-def check_and_install_packages():
-    required = {
-        'flask': 'flask',
-        'flask_cors': 'flask-cors',
-        'psycopg2': 'psycopg2-binary',
-        'numpy': 'numpy',
-        'fuzzywuzzy': 'fuzzywuzzy',
-        'dotenv': 'python-dotenv',
-        'requests': 'requests',
-        'waitress': 'waitress'
-    }
-    
-    for lib, pkg in required.items():
-        if not importlib.util.find_spec(lib):
-            print(f"🚨 Oh shit, a package is missing, installing {pkg}...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
-
-check_and_install_packages()
+if __name__ == '__main__':
+    # Only when run as a script: probing and pip-installing on every import
+    # slowed down restarts and worker spawns
+    import dependencies
+    dependencies.check_and_install_packages()
 
-from flask import Flask, jsonify, request, abort, Response
+from flask import Flask, jsonify, request, abort, Response, g, has_app_context, stream_with_context
+from flask.json import JSONEncoder
 from flask_cors import CORS
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import requests
 import logging
-import numpy as np
 import re
 import csv
+import base64
+import binascii
+import threading
+import time
+import atexit
+import queue
 import json
 import xml.etree.ElementTree as ET
-from io import StringIO
+from datetime import date
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener
 import os
-from fuzzywuzzy import process 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+import barcode_cache
+import bulk_import
+import compression
+import db
+import export_stream
+import fast_json
+import jobs
+import metrics
+import migrations
+import price_refresh
+import profiling
+import title_index
+import tmdb_cache
+import upstream
 
 load_dotenv()  # Load environment variables
 
+class CollectFlixJSONEncoder(JSONEncoder):
+    def default(self, o):
+        # NUMERIC columns (average_price, rating) come back from psycopg2 as Decimal
+        if isinstance(o, Decimal):
+            return str(o)
+        return super().default(o)
+
+
 app = Flask(__name__)
+app.json_encoder = CollectFlixJSONEncoder
 
 # Allow all origins with credentials
 CORS(app, resources={r"/*": {"origins": ["http://localhost:3000", "http://collectflix.local"]}})
 
 API_KEY = os.getenv('TMDB_API_KEY')
 EBAY_APP_ID = os.getenv('EBAY_APP_ID')
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', 2000))
+MAX_PAGE_SIZE = 1000
+# Barcode scans: parallel TMDB searches and the fuzzy score that ends them early
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', 8))
+SCAN_RESULTS_PER_QUERY = 3
+SCAN_CONFIDENT_SCORE = int(os.getenv('SCAN_CONFIDENT_SCORE', 90))
+METADATA_REFRESH_WORKERS = int(os.getenv('METADATA_REFRESH_WORKERS', 4))
+METADATA_BATCH_SIZE = 200
+# waitress settings for `python app.py` and the launcher; size them with benchmarks/loadtest.py
+WAITRESS_THREADS = int(os.getenv('WAITRESS_THREADS', 4))
+WAITRESS_CONNECTION_LIMIT = int(os.getenv('WAITRESS_CONNECTION_LIMIT', 100))
+
+
+def configure_logging():
+    """Log through a queue so request threads never block on handler I/O."""
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    if root.handlers:
+        # Someone (uvicorn, a test runner) already configured logging
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(QueueHandler(log_queue))
+
+
+configure_logging()
+db.add_statement_listener(metrics.observe_statement)
+db.add_statement_listener(profiling.log_slow_statement)
 
 
 
-def ensure_db_constraints():
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            # Check and add the unique constraint on tmdb_id
-            cursor.execute("""
-                SELECT conname
-                FROM pg_constraint
-                WHERE conrelid = 'dvds'::regclass AND contype = 'u';
-            """)
-            constraints = cursor.fetchall()
-            if not any('tmdb_id_unique' == constraint[0] for constraint in constraints):
-                cursor.execute("""
-                    ALTER TABLE dvds ADD CONSTRAINT tmdb_id_unique UNIQUE (tmdb_id);
-                """)
-                conn.commit()
-                logging.info("Unique constraint 'tmdb_id_unique' added to 'tmdb_id' column.")
-            else:
-                logging.info("Unique constraint 'tmdb_id_unique' already exists.")
-
-            # Check if the average_price column exists, if not, add it
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='dvds' AND column_name='average_price';
-            """)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    ALTER TABLE dvds ADD COLUMN average_price DECIMAL(10, 2);
-                """)
-                conn.commit()
-                logging.info("Column 'average_price' added to 'dvds' table.")
-            else:
-                logging.info("Column 'average_price' already exists.")
-
-            # Check if the total_collection_price column exists, if not, add it
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='dvds' AND column_name='total_collection_price';
-            """)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    ALTER TABLE dvds ADD COLUMN total_collection_price DECIMAL(15, 2);
-                """)
-                conn.commit()
-                logging.info("Column 'total_collection_price' added to 'dvds' table.")
-            else:
-                logging.info("Column 'total_collection_price' already exists.")
-
-            # Check if the currency column exists, if not, add it
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='dvds' AND column_name='currency';
-            """)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    ALTER TABLE dvds ADD COLUMN currency VARCHAR(10);
-                """)
-                conn.commit()
-                logging.info("Column 'currency' added to 'dvds' table.")
-            else:
-                logging.info("Column 'currency' already exists.")
-                        # Check if the borrower_name column exists, if not, add it
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='dvds' AND column_name='borrower_name';
-            """)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    ALTER TABLE dvds ADD COLUMN borrower_name VARCHAR(255);
-                """)
-                conn.commit()
-                logging.info("Column 'borrower_name' added to 'dvds' table.")
-            else:
-                logging.info("Column 'borrower_name' already exists.")
-            
-            # Check if the lend_date column exists, if not, add it
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='dvds' AND column_name='lend_date';
-            """)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    ALTER TABLE dvds ADD COLUMN lend_date DATE;
-                """)
-                conn.commit()
-                logging.info("Column 'lend_date' added to 'dvds' table.")
-            else:
-                logging.info("Column 'lend_date' already exists.")
-
-            # Check if the status column exists, if not, add it
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='dvds' AND column_name='status';
-            """)
-            if not cursor.fetchone():
-                cursor.execute("""
-                    ALTER TABLE dvds ADD COLUMN status VARCHAR(50) DEFAULT 'Available';
-                """)
-                conn.commit()
-                logging.info("Column 'status' added to 'dvds' table.")
-            else:
-                logging.info("Column 'status' already exists.")    
-            
-            
-
 def get_db_connection():
+    # Connections come from the shared pool; close() hands them back
     try:
-        return psycopg2.connect(
-            host=os.getenv('DB_HOST'),
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASS'),
-            port=os.getenv('DB_PORT')
-        )
+        conn = db.get_pool().getconn()
+    except db.PoolTimeout as e:
+        logging.error(f"Database pool exhausted: {e}")
+        abort(503, description="Database busy, try again shortly")
     except psycopg2.OperationalError as e:
         logging.error(f"Database connection failed: {e}")
         abort(500, description="Database connection failed")
 
-def fetch_dvd_info(title):
-    search_url = f"https://api.themoviedb.org/3/search/movie?api_key={API_KEY}&query={title}"
-    response = requests.get(search_url)
-    if response.status_code != 200:
-        return None
-    search_response = response.json()
-    if not search_response.get('results'):
-        return None
+    # Remember it so teardown can return it if a handler bails out early
+    if has_app_context():
+        g.setdefault('db_connections', []).append(conn)
+    return conn
 
-    first_result = search_response['results'][0]
-    details_url = f"https://api.themoviedb.org/3/movie/{first_result['id']}?api_key={API_KEY}"
-    details_response = requests.get(details_url).json()
 
+@app.teardown_appcontext
+def release_db_connections(exc):
+    for conn in g.pop('db_connections', []):
+        if not conn.released:
+            logging.warning("Returning leaked database connection to the pool")
+            conn.close()
+
+def movie_info_from_details(details_response):
     return {
         'title': details_response.get('title', 'N/A'),
         'genre': ', '.join(g['name'] for g in details_response.get('genres', [])),
@@ -201,51 +133,80 @@ def fetch_dvd_info(title):
         'media_type': None  # Set later
     }
 
+def fetch_dvd_info(title):
+    # Search results and movie details are both served from the TMDB cache
+    results = tmdb_cache.search(title)
+    if not results:
+        return None
+
+    details_response = tmdb_cache.details(results[0]['id'])
+    if not details_response:
+        return None
+    return movie_info_from_details(details_response)
+
+
+
+# The collection as users see it; search_vector and the price bookkeeping stay internal
+EXPORT_COLUMNS = """
+    id,
+    title,
+    genre,
+    tmdb_id,
+    rating,
+    cover_url,
+    release_date,
+    description,
+    runtime,
+    media_type,
+    added_date,
+    average_price,
+    currency,
+    borrower_name,
+    lend_date,
+    status
+"""
 
 
 # Export movies endpoint
 @app.route('/export_movies', methods=['GET'])
 def export_movies():
     format = request.args.get('format', 'json').lower()
+    if format not in export_stream.FORMATS:
+        abort(400, description="Unsupported format. Use 'json', 'ndjson', 'csv', or 'xml'.")
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM dvds")
-        movies = cursor.fetchall()
-
-        if not movies:
-            return jsonify({"message": "No movies found"}), 404
-
-        if format == 'json':
-            return jsonify(movies)
-
-        elif format == 'csv':
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=movies[0].keys())
-            writer.writeheader()
-            writer.writerows(movies)
-            output.seek(0)
-            return Response(output, mimetype='text/csv', headers={"Content-Disposition": "attachment;filename=movies.csv"})
-
-        elif format == 'xml':
-            root = ET.Element("Movies")
-            for movie in movies:
-                movie_element = ET.SubElement(root, "Movie")
-                for key, value in movie.items():
-                    ET.SubElement(movie_element, key).text = str(value)
-            xml_str = ET.tostring(root, encoding='utf-8', method='xml').decode('utf-8')
-            return Response(xml_str, mimetype='application/xml', headers={"Content-Disposition": "attachment;filename=movies.xml"})
-
-        else:
-            abort(400, description="Unsupported format. Use 'json', 'csv', or 'xml'.")
+    conn = get_db_connection()
+    # Named cursor: rows stay on the server and arrive EXPORT_FETCH_SIZE at a time
+    cursor = conn.cursor(name='export_movies', cursor_factory=RealDictCursor)
 
+    try:
+        cursor.execute(f"SELECT {EXPORT_COLUMNS} FROM dvds ORDER BY id")
+        first_chunk = cursor.fetchmany(EXPORT_FETCH_SIZE)
     except psycopg2.Error as e:
+        cursor.close()
+        conn.close()
         logging.error(f"Database query failed: {e}")
         abort(500, description="Failed to retrieve movies from the database")
-    finally:
+
+    if not first_chunk:
         cursor.close()
         conn.close()
+        return jsonify({"message": "No movies found"}), 404
+
+    def rows():
+        try:
+            yield from first_chunk
+            while True:
+                chunk = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not chunk:
+                    break
+                yield from chunk
+        finally:
+            cursor.close()
+            conn.close()
+
+    encoder, mimetype, filename = export_stream.FORMATS[format]
+    headers = {} if format == 'json' else {"Content-Disposition": f"attachment;filename={filename}"}
+    return Response(stream_with_context(encoder(rows())), mimetype=mimetype, headers=headers)
 
 # Import movies endpoint
 @app.route('/import_movies', methods=['POST'])
@@ -254,254 +215,276 @@ def import_movies():
     if format not in ['json', 'csv', 'xml']:
         abort(400, description="Unsupported format. Use 'json', 'csv', or 'xml'.")
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
+    if format == 'json':
+        movies = (request.json or {}).get('movies')
+        if not movies or not isinstance(movies, list):
+            abort(400, description="Invalid JSON input data")
+
+    elif format == 'csv':
+        file = request.files.get('file')
+        if not file:
+            abort(400, description="CSV file is required")
+        movies = bulk_import.iter_csv_movies(file.stream)
+
+    elif format == 'xml':
+        file = request.files.get('file')
+        if not file:
+            abort(400, description="XML file is required")
+        movies = bulk_import.iter_xml_movies(file.stream)
+
+    if request.args.get('background', '').lower() in ('1', 'true', 'yes'):
+        # Spool the upload and let a job worker import it
+        path = jobs.spool_path(f'.{format}')
         if format == 'json':
-            movies = request.json.get('movies')
-            if not movies or not isinstance(movies, list):
-                abort(400, description="Invalid JSON input data")
-
-        elif format == 'csv':
-            file = request.files.get('file')
-            if not file:
-                abort(400, description="CSV file is required")
-            file_data = file.stream.read().decode("UTF-8")
-            csv_data = csv.DictReader(StringIO(file_data))
-            movies = list(csv_data)
-
-        elif format == 'xml':
-            file = request.files.get('file')
-            if not file:
-                abort(400, description="XML file is required")
-            xml_data = ET.parse(file.stream)
-            root = xml_data.getroot()
-            movies = []
-            for movie_element in root.findall('Movie'):
-                movie = {elem.tag: elem.text for elem in movie_element}
-                movies.append(movie)
-
-        # Validate and insert movies into the database
-        for movie in movies:
-            if not movie.get('title') or not movie.get('tmdb_id'):
-                logging.warning(f"Skipping movie with incomplete data: {movie}")
-                continue  # Skip invalid entries
-
-            cursor.execute("""
-                INSERT INTO dvds (title, genre, tmdb_id, rating, cover_url, release_date, description, runtime, status, media_type)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (tmdb_id) DO UPDATE SET
-                    title = EXCLUDED.title,
-                    genre = EXCLUDED.genre,
-                    rating = EXCLUDED.rating,
-                    cover_url = EXCLUDED.cover_url,
-                    release_date = EXCLUDED.release_date,
-                    description = EXCLUDED.description,
-                    runtime = EXCLUDED.runtime,
-                    status = EXCLUDED.status,
-                    media_type = EXCLUDED.media_type;
-            """, (
-                movie.get('title'),
-                movie.get('genre', 'Unknown'),
-                movie.get('tmdb_id'),
-                float(movie.get('rating', 0.0)),
-                movie.get('cover_url', ''),
-                movie.get('release_date', 'Unknown'),
-                movie.get('description', 'No description available.'),
-                int(movie.get('runtime', 0)),
-                movie.get('status', 'Available'),
-                movie.get('media_type', 'DVD')
-            ))
+            with open(path, 'w', encoding='utf-8') as spool:
+                json.dump(movies, spool)
+        else:
+            file.save(path)
+        job_id = jobs.submit('import', {'format': format, 'path': path})
+        return jsonify({"message": "Import queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
 
-        conn.commit()
-        return jsonify({"message": "Movies imported successfully"}), 201
+    conn = get_db_connection()
 
+    try:
+        # Uploads are parsed as a stream; rows are validated and COPYed in
+        # fixed-size batches, then merged with one upsert
+        importer = bulk_import.BulkImporter(conn)
+        importer.add_many(movies)
+        report = importer.finish()
+        conn.commit()
+        title_index.index.add_many(importer.merged)
+    except (ET.ParseError, UnicodeDecodeError, csv.Error) as e:
+        conn.rollback()
+        abort(400, description=f"Could not parse {format.upper()} file: {e}")
     except psycopg2.Error as e:
+        conn.rollback()
         logging.error(f"Failed to import movies: {e}")
         abort(500, description="Failed to import movies")
     finally:
-        cursor.close()
         conn.close()
 
+    logging.info(f"Imported {report['imported']} movies, rejected {report['rejected']}")
+    return jsonify({"message": "Movies imported successfully", **report}), 201
+
+
+@jobs.handler('import')
+def import_job(context):
+    """Import a spooled upload; progress counts records (JSON) or bytes read (CSV/XML)."""
+    format, path = context.params['format'], context.params['path']
+    try:
+        with open(path, 'rb') as upload:
+            if format == 'json':
+                records = json.load(upload)
+                total = len(records)
+                position = lambda done: done
+            else:
+                total = os.fstat(upload.fileno()).st_size
+                records = (bulk_import.iter_csv_movies(upload) if format == 'csv'
+                           else bulk_import.iter_xml_movies(upload))
+                position = lambda done: upload.tell()
+
+            def tracked():
+                for done, movie in enumerate(records, start=1):
+                    yield movie
+                    context.progress(position(done), total)
+                    context.check_cancelled()
+
+            with db.connection() as conn:
+                importer = bulk_import.BulkImporter(conn)
+                try:
+                    importer.add_many(tracked())
+                except (ET.ParseError, UnicodeDecodeError, csv.Error) as e:
+                    raise ValueError(f"Could not parse {format.upper()} file: {e}")
+                report = importer.finish()
+                conn.commit()
+            title_index.index.add_many(importer.merged)
+    finally:
+        jobs.remove_spooled(context.params)
+
+    context.progress(total, total)
+    logging.info(f"Imported {report['imported']} movies, rejected {report['rejected']}")
+    return report
 
 
 @app.route('/search_ebay', methods=['POST'])
 def search_dvd():
-    data = request.json
+    data = request.json or {}
     dvd_title = data.get("title")
 
+    if not dvd_title:
+        # Whole-collection and stale refreshes run as jobs; poll status_url
+        try:
+            params = price_refresh.job_params(data)
+        except ValueError as e:
+            abort(400, description=str(e))
+        job_id = jobs.submit('price_refresh', params)
+        return jsonify({"message": "Price refresh queued", "job_id": job_id,
+                        "status_url": f"/jobs/{job_id}"}), 202
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    if dvd_title:
+    try:
         # Handle single movie update
         cursor.execute("SELECT id, title, media_type FROM dvds WHERE title = %s", (dvd_title,))
         movies = cursor.fetchall()
-    else:
-        # Fetch all movies from the database
-        cursor.execute("SELECT id, title, media_type FROM dvds")
-        movies = cursor.fetchall()
-
-    for movie in movies:
-        movie_id = movie[0]
-        title = movie[1]
-        media_type = movie[2]
-
-        # Combine title and media type for more accurate search results
-        search_keywords = f"{title} {media_type}"
-
-        api_endpoint = "https://svcs.ebay.com/services/search/FindingService/v1"
-        app_id = EBAY_APP_ID
-
-        headers = {
-            "Content-Type": "application/json",
-            "X-EBAY-SOA-OPERATION-NAME": "findItemsAdvanced",
-            "X-EBAY-SOA-SECURITY-APPNAME": app_id,
-            "X-EBAY-SOA-RESPONSE-DATA-FORMAT": "JSON"
-        }
-
-        params = {
-            "keywords": search_keywords,
-            "categoryId": "617",  # Category for DVDs
-            "paginationInput.entriesPerPage": 100
-        }
-
-        try:
-            response = requests.get(api_endpoint, headers=headers, params=params)
-            response.raise_for_status()
-            response_data = response.json()
-
-            average_price_usd = calculate_average_price(response_data)
-            currency = "USD"
-
-            # Ensure that average_price_usd is properly formatted as a decimal number
-            cursor.execute("""
-                UPDATE dvds
-                SET average_price = %s, currency = %s
-                WHERE id = %s
-            """, (float(average_price_usd), currency, movie_id))
-
-            conn.commit()
-
-            logging.info(f"Updated {title} ({media_type}): ${average_price_usd} {currency}")
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request to eBay API failed for {title} ({media_type}): {e}")
-        except Exception as e:
-            logging.error(f"Failed to update price for {title} ({media_type}): {e}")
-            conn.rollback()  # Rollback the transaction in case of error
-
-    cursor.close()
-    conn.close()
-
-    return jsonify({"message": "Prices updated"}), 200
-
-
-def calculate_average_price(response_data):
-    prices = []
-    
-    search_result = response_data["findItemsAdvancedResponse"][0].get("searchResult", [{}])[0]
-    items = search_result.get("item", [])
-    
-    for item in items:
-        current_price = float(item["sellingStatus"][0]["convertedCurrentPrice"][0]["__value__"])
-        prices.append(current_price)
-    
-    if not prices:
-        return 0.0
-
-    # Convert prices list to a numpy array for easier calculation
-    prices = np.array(prices)
-
-    # Calculate the first and third quartile (Q1 and Q3)
-    Q1 = np.percentile(prices, 25)
-    Q3 = np.percentile(prices, 75)
+    except psycopg2.Error as e:
+        logging.error(f"Failed to load titles for price refresh: {e}")
+        abort(500, description="Failed to load titles for price refresh")
+    finally:
+        # Don't hold a pooled connection while eBay is being queried
+        cursor.close()
+        conn.close()
 
-    # Calculate the interquartile range (IQR)
-    IQR = Q3 - Q1
+    report = price_refresh.refresh_prices(movies, EBAY_APP_ID)
+    return jsonify({"message": "Prices updated", **report}), 200
 
-    # Determine the bounds for outliers
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
 
-    # Filter out prices that are considered outliers
-    filtered_prices = [price for price in prices if lower_bound <= price <= upper_bound]
+@jobs.handler('price_refresh')
+def price_refresh_job(context):
+    hooks = {'progress': context.progress, 'should_cancel': lambda: context.cancelled}
+    params = context.params
+    if params.get("mode") == "stale":
+        # Only re-price titles whose price is older than max_age_hours
+        return price_refresh.refresh_stale_prices(
+            EBAY_APP_ID, max_age_hours=params.get("max_age_hours"), limit=params.get("limit"), **hooks)
 
-    if filtered_prices:
-        average_price = sum(filtered_prices) / len(filtered_prices)
-    else:
-        average_price = sum(prices) / len(prices)  # Fallback to mean of all prices if all are outliers
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT id, title, media_type FROM dvds")
+        movies = cursor.fetchall()
+    return price_refresh.refresh_prices(movies, EBAY_APP_ID, **hooks)
 
-    return average_price
 
-@app.route('/calculate_total_collection_price', methods=['POST'])
+@app.route('/calculate_total_collection_price', methods=['GET', 'POST'])
 def calculate_total_collection_price():
-    try:
-        # Connect to the database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    # Totals are maintained by triggers on dvds, so this only reads the
+    # handful of (media_type, status) rows in collection_totals
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        # Calculate the total collection price by summing all average prices
+    try:
         cursor.execute("""
-            SELECT SUM(average_price) 
-            FROM dvds 
-            WHERE average_price IS NOT NULL;
+            SELECT media_type, status, movie_count, priced_count, total_value
+            FROM collection_totals
+            WHERE movie_count > 0
+            ORDER BY media_type, status;
         """)
-        total_collection_price = cursor.fetchone()[0] or 0.0  # If None, default to 0.0
-
-        # Update the total_collection_price in the database (assuming this is stored in a single row or similar)
-        cursor.execute("""
-            UPDATE dvds 
-            SET total_collection_price = %s;
-        """, (total_collection_price,))
-
-        conn.commit()
+        breakdown = cursor.fetchall()
+    except psycopg2.Error as e:
+        logging.error(f"Failed to read collection totals: {e}")
+        return jsonify({"error": "Failed to calculate total collection price"}), 500
+    finally:
         cursor.close()
         conn.close()
 
-        logging.info(f"Total collection price calculated: ${total_collection_price:.2f}")
-
-        return jsonify({"total_collection_price": total_collection_price}), 200
+    total_collection_price = sum((row['total_value'] for row in breakdown), Decimal('0.00'))
+    logging.info(f"Total collection price: ${total_collection_price:.2f}")
 
-    except Exception as e:
-        logging.error(f"Failed to calculate total collection price: {e}")
-        if conn:
-            conn.rollback()  # Rollback the transaction in case of an error
-        return jsonify({"error": "Failed to calculate total collection price"}), 500
+    return jsonify({
+        "total_collection_price": total_collection_price,
+        "movie_count": sum(row['movie_count'] for row in breakdown),
+        "priced_count": sum(row['priced_count'] for row in breakdown),
+        "breakdown": breakdown,
+    }), 200
+
+
+MOVIE_LIST_COLUMNS = """
+    id,
+    title,
+    cover_url,
+    genre,
+    description,
+    media_type,
+    rating,
+    release_date,
+    runtime,
+    status,
+    borrower_name,
+    lend_date,
+    average_price,
+    currency
+"""
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        kind, value = base64.urlsafe_b64decode(padded.encode()).decode().split(':', 1)
+        if kind != 'id':
+            raise ValueError(kind)
+        return int(value)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        abort(400, description="Invalid pagination cursor")
+
+
+def get_collection_version(cursor):
+    # Bumped by a statement-level trigger on every write to dvds
+    cursor.execute("SELECT version, updated_at FROM collection_version")
+    row = cursor.fetchone()
+    if row is None:
+        return 0, None
+    if isinstance(row, dict):
+        return row['version'], row['updated_at']
+    return row[0], row[1]
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        # Weak comparison: compressed responses carry a weak ETag
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
 
 
 @app.route('/movies', methods=['GET'])
 def get_movies():
-    page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 100, type=int)
-    offset = (page - 1) * limit
-    
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    token = request.args.get('cursor')
+    after_id = decode_cursor(token) if token else None
+
     with get_db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT 
-                    id, 
-                    title, 
-                    cover_url, 
-                    genre, 
-                    description, 
-                    media_type, 
-                    rating, 
-                    release_date, 
-                    runtime, 
-                    status, 
-                    borrower_name, 
-                    lend_date, 
-                    average_price, 
-                    currency
-                FROM dvds
-                ORDER BY id
-                LIMIT %s OFFSET %s;
-            ''', (limit, offset))
-            
-            movies = cursor.fetchall()
-            return jsonify(movies)
+            version, last_modified = get_collection_version(cursor)
+            etag = f"collection-{version}"
+            if not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                if after_id is not None or 'page' not in request.args:
+                    # Keyset pagination: deep pages cost the same as the first
+                    cursor.execute(f'''
+                        SELECT {MOVIE_LIST_COLUMNS}
+                        FROM dvds
+                        WHERE id > %s
+                        ORDER BY id
+                        LIMIT %s;
+                    ''', (after_id or 0, limit))
+                else:
+                    # Legacy page numbers still work
+                    page = max(1, request.args.get('page', 1, type=int))
+                    cursor.execute(f'''
+                        SELECT {MOVIE_LIST_COLUMNS}
+                        FROM dvds
+                        ORDER BY id
+                        LIMIT %s OFFSET %s;
+                    ''', (limit, (page - 1) * limit))
+
+                movies = cursor.fetchall()
+                response = fast_json.response(movies)
+                if len(movies) == limit:
+                    response.headers['X-Next-Cursor'] = encode_cursor(movies[-1]['id'])
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Let browsers keep the page but revalidate it on every load
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 
@@ -531,9 +514,11 @@ def add_movie():
             description = EXCLUDED.description,
             runtime = EXCLUDED.runtime,
             status = EXCLUDED.status,
-            media_type = EXCLUDED.media_type;
+            media_type = EXCLUDED.media_type
+            RETURNING id;
         """, movie_info)
         conn.commit()
+        title_index.index.add(cursor.fetchone()[0], movie_info['title'])
         return jsonify({"message": "Movie added successfully"}), 201
 
 @app.route('/update_movie/<int:movie_id>', methods=['PUT'])
@@ -563,6 +548,8 @@ def update_movie(movie_id):
         except psycopg2.Error as e:
             logging.error(f"Failed to update movie: {e}")
             abort(500, description="Failed to update movie in the database")
+        if fields['title'] is not None and cursor.rowcount:
+            title_index.index.add(movie_id, fields['title'])
         return jsonify({"message": "Movie updated successfully"}), 200
 
 
@@ -593,28 +580,24 @@ def fix_metadata(movie_id):
 
 
 def fetch_possible_matches(title):
-    # TMDB API call to search for movies by title
-    tmdb_api_key = API_KEY
-    url = f"https://api.themoviedb.org/3/search/movie?api_key={tmdb_api_key}&query={title}"
-    
-    response = requests.get(url)
-    if response.status_code != 200:
+    # TMDB search for movies by title (cached)
+    results = tmdb_cache.search(title)
+    if results is None:
         return None
-    
-    results = response.json().get('results', [])
-    matches = []
-    for result in results:
-        matches.append({
-            'tmdb_id': result['id'],
-            'title': result['title'],
-            'genre': result.get('genre_ids', []),  # You may need to map genre IDs to genre names
-            'release_date': result.get('release_date'),
-            'description': result.get('overview'),
-            'cover_url': f"https://image.tmdb.org/t/p/w500{result['poster_path']}" if result.get('poster_path') else None,
-            'rating': result.get('vote_average')
-        })
-    
-    return matches
+
+    return [match_from_search_result(result) for result in results]
+
+
+def match_from_search_result(result):
+    return {
+        'tmdb_id': result['id'],
+        'title': result['title'],
+        'genre': result.get('genre_ids', []),  # You may need to map genre IDs to genre names
+        'release_date': result.get('release_date'),
+        'description': result.get('overview'),
+        'cover_url': f"https://image.tmdb.org/t/p/w500{result['poster_path']}" if result.get('poster_path') else None,
+        'rating': result.get('vote_average')
+    }
 
 @app.route('/update_metadata/<int:movie_id>', methods=['POST'])
 def update_metadata(movie_id):
@@ -627,6 +610,7 @@ def update_metadata(movie_id):
         
         if not selected_match:
             abort(400, description="No metadata match selected")
+        title = selected_match.get('title', 'Unknown Title')
 
         # Handle the release_date to ensure it's a valid date or null
         release_date = selected_match.get('release_date')
@@ -639,7 +623,7 @@ def update_metadata(movie_id):
             SET title=%s, genre=%s, tmdb_id=%s, rating=%s, cover_url=%s, release_date=%s, description=%s, runtime=%s, status=%s
             WHERE id=%s
         """, (
-            selected_match.get('title', 'Unknown Title'),  # Fallback to 'Unknown Title'
+            title,  # Fallback to 'Unknown Title'
             selected_match.get('genre', 'Unknown Genre'),  # Fallback to 'Unknown Genre'
             selected_match.get('tmdb_id', None),  # Fallback to None
             selected_match.get('rating', 0),  # Fallback to 0
@@ -650,7 +634,10 @@ def update_metadata(movie_id):
             selected_match.get('status', 'Available'),  # Fallback to 'Available'
             movie_id
         ))
+        updated = cursor.rowcount
         conn.commit()
+        if updated:
+            title_index.index.add(movie_id, title)
     except psycopg2.Error as e:
         logging.error(f"Failed to update metadata: {e}")
         abort(500, description="Failed to update metadata")
@@ -660,6 +647,81 @@ def update_metadata(movie_id):
 
     return jsonify({"message": "Metadata updated successfully"}), 200
 
+@app.route('/refresh_metadata', methods=['POST'])
+def refresh_metadata():
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        abort(400, description="ids must be a list of movie ids")
+    job_id = jobs.submit('metadata_refresh', {'ids': ids})
+    return jsonify({"message": "Metadata refresh queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+
+def write_metadata(rows):
+    with db.connection() as conn, conn.cursor() as cursor:
+        execute_values(cursor, """
+            UPDATE dvds AS d
+            SET title = v.title, genre = v.genre, rating = v.rating, cover_url = v.cover_url,
+                release_date = v.release_date, description = v.description, runtime = v.runtime
+            FROM (VALUES %s) AS v(id, title, genre, rating, cover_url, release_date, description, runtime)
+            WHERE d.id = v.id
+        """, rows, template="(%s::integer, %s, %s, %s::numeric, %s, %s::date, %s, %s::integer)",
+            page_size=len(rows))
+    title_index.index.add_many([(row[0], row[1]) for row in rows])
+
+
+def metadata_row(movie_id, details_response):
+    movie_info = movie_info_from_details(details_response)
+    try:
+        release_date = date.fromisoformat(movie_info['release_date'])
+    except (TypeError, ValueError):
+        release_date = None
+    return (movie_id, movie_info['title'], movie_info['genre'], movie_info['rating'], movie_info['cover_url'],
+            release_date, movie_info['description'], movie_info['runtime'])
+
+
+@jobs.handler('metadata_refresh')
+def metadata_refresh_job(context):
+    """Re-fetch TMDB details (bypassing the cache) for matched movies and rewrite their metadata."""
+    ids = context.params.get('ids')
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, tmdb_id FROM dvds
+            WHERE tmdb_id IS NOT NULL AND (%(ids)s::integer[] IS NULL OR id = ANY(%(ids)s))
+            ORDER BY id
+        """, {'ids': ids})
+        movies = cursor.fetchall()
+
+    updated = 0
+    failures = []
+    batch = []
+    with ThreadPoolExecutor(max_workers=METADATA_REFRESH_WORKERS) as pool:
+        futures = {pool.submit(tmdb_cache.details, tmdb_id, True): (movie_id, tmdb_id)
+                   for movie_id, tmdb_id in movies}
+        for done, future in enumerate(as_completed(futures), start=1):
+            movie_id, tmdb_id = futures[future]
+            details_response = future.result()
+            if details_response:
+                batch.append(metadata_row(movie_id, details_response))
+            else:
+                failures.append({'id': movie_id, 'tmdb_id': tmdb_id, 'error': "TMDB lookup failed"})
+            if len(batch) >= METADATA_BATCH_SIZE:
+                write_metadata(batch)
+                updated += len(batch)
+                batch = []
+
+            context.progress(done, len(futures))
+            if context.cancelled:
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+    if batch:
+        write_metadata(batch)
+        updated += len(batch)
+
+    logging.info(f"Metadata refresh updated {updated}/{len(movies)} movies, {len(failures)} failed")
+    return {'movies': len(movies), 'updated': updated, 'failed': len(failures), 'failures': failures}
+
+
 @app.route('/delete_movie/<int:movie_id>', methods=['DELETE'])
 def delete_movie(movie_id):
     conn = get_db_connection()
@@ -668,6 +730,7 @@ def delete_movie(movie_id):
     try:
         cursor.execute("DELETE FROM dvds WHERE id = %s", (movie_id,))
         conn.commit()
+        title_index.index.remove(movie_id)
     except psycopg2.Error as e:
         logging.error(f"Failed to delete movie: {e}")
         abort(500, description="Failed to delete movie from the database")
@@ -677,11 +740,48 @@ def delete_movie(movie_id):
     
     return jsonify({"message": "Movie deleted successfully"}), 200
 
+_trigram_available = None
+
+def trigram_available(cursor):
+    # pg_trgm lives in postgresql-contrib, which not every install has
+    global _trigram_available
+    if _trigram_available is None:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS available")
+        row = cursor.fetchone()
+        _trigram_available = bool(row['available'] if isinstance(row, dict) else row[0])
+    return _trigram_available
+
+
+def like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def title_search_sql(trigram):
+    """WHERE clause and relevance expression for a %(term)s/%(like)s title search.
+
+    Full-text matches use the GIN-indexed search_vector (title, genre and
+    description); substring matches use ILIKE, which the trigram index serves
+    when pg_trgm is installed, and typos are caught by trigram similarity.
+    """
+    tsquery = "websearch_to_tsquery('english', %(term)s)"
+    match = [f"search_vector @@ {tsquery}", "title ILIKE %(like)s"]
+    rank = [
+        f"ts_rank_cd(search_vector, {tsquery})",
+        "CASE WHEN lower(title) = lower(%(term)s) THEN 2 WHEN title ILIKE %(like)s THEN 1 ELSE 0 END",
+    ]
+    if trigram:
+        match.append("title %% %(term)s")
+        rank.append("similarity(title, %(term)s)")
+    return f"({' OR '.join(match)})", f"({' + '.join(rank)})"
+
+
 @app.route('/search_movies', methods=['GET'])
 def search_movies():
     title = request.args.get('title')
     sort = request.args.get('sort', 'title')  # Default sort by title
-    order = request.args.get('order', 'asc')  # Default order ascending
+    # Best matches first for relevance, otherwise ascending
+    order = request.args.get('order', 'desc' if sort == 'relevance' else 'asc')
 
     if not title:
         abort(400, description="Search term is required")
@@ -691,25 +791,49 @@ def search_movies():
 
     # Dynamic sorting based on the query parameters
     order_clause = 'ASC' if order == 'asc' else 'DESC'
-    valid_sort_columns = ['title', 'release_date', 'rating']
+    valid_sort_columns = ['title', 'release_date', 'rating', 'relevance']
     if sort not in valid_sort_columns:
         sort = 'title'
 
     try:
+        match_sql, rank_sql = title_search_sql(trigram_available(cursor))
         query = f"""
             SELECT id, title, cover_url, genre, description, media_type, rating, release_date
-            FROM dvds
-            WHERE title ILIKE %s
-            ORDER BY {sort} {order_clause}
+            FROM (
+                SELECT id, title, cover_url, genre, description, media_type, rating, release_date,
+                       {rank_sql} AS relevance
+                FROM dvds
+                WHERE {match_sql}
+            ) AS matches
+            ORDER BY {sort} {order_clause}, title ASC
         """
-        cursor.execute(query, ('%' + title + '%',))
+        cursor.execute(query, {'term': title, 'like': like_pattern(title)})
         movies = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return jsonify(movies)
+        return fast_json.response(movies)
     except psycopg2.Error as e:
         logging.error(f"Failed to search movies: {e}")
         abort(500, description="Failed to search movies in the database")
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route('/search_titles', methods=['GET'])
+def search_titles():
+    """Typo-tolerant title lookup for search-as-you-type, served from memory."""
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        abort(400, description="limit must be an integer")
+    if not query.strip():
+        return jsonify([])
+
+    try:
+        index = title_index.ensure_built()
+    except (psycopg2.Error, db.PoolTimeout) as e:
+        logging.error(f"Failed to build title index: {e}")
+        abort(503, description="Title index is not available")
+    return jsonify(index.search(query, limit))
 
 @app.route('/search_advanced', methods=['POST'])
 def search_advanced():
@@ -718,35 +842,54 @@ def search_advanced():
     genre = data.get('genre')
     rating = data.get('rating')
     release_date = data.get('release_date')
-    
-    query = "SELECT id, title, cover_url, genre, description FROM dvds WHERE TRUE"
-    params = []
-
-    if title:
-        query += " AND title ILIKE %s"
-        params.append('%' + title + '%')
-    if genre:
-        query += " AND genre ILIKE %s"
-        params.append('%' + genre + '%')
-    if rating:
-        query += " AND rating >= %s"
-        params.append(rating)
-    if release_date:
-        query += " AND release_date = %s"
-        params.append(release_date)
-    
+    sort = data.get('sort', 'relevance' if title else 'title')
+    order = data.get('order', 'desc' if sort == 'relevance' else 'asc')
+
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
+
+    conditions = ["TRUE"]
+    rank_sql = "0"
+    params = {}
+
     try:
-        cursor.execute(query, tuple(params))
+        if title:
+            match_sql, rank_sql = title_search_sql(trigram_available(cursor))
+            conditions.append(match_sql)
+            params.update(term=title, like=like_pattern(title))
+        if genre:
+            conditions.append("genre ILIKE %(genre)s")
+            params['genre'] = like_pattern(genre)
+        if rating:
+            conditions.append("rating >= %(rating)s")
+            params['rating'] = rating
+        if release_date:
+            conditions.append("release_date = %(release_date)s")
+            params['release_date'] = release_date
+
+        order_clause = 'ASC' if order == 'asc' else 'DESC'
+        if sort not in ['title', 'release_date', 'rating', 'relevance']:
+            sort = 'title'
+
+        query = f"""
+            SELECT id, title, cover_url, genre, description
+            FROM (
+                SELECT id, title, cover_url, genre, description, release_date, rating,
+                       {rank_sql} AS relevance
+                FROM dvds
+                WHERE {' AND '.join(conditions)}
+            ) AS matches
+            ORDER BY {sort} {order_clause}, title ASC
+        """
+        cursor.execute(query, params)
         movies = cursor.fetchall()
-        cursor.close()
-        conn.close()
         return jsonify(movies)
     except psycopg2.Error as e:
         logging.error(f"Failed to search movies: {e}")
         abort(500, description="Failed to perform advanced search in the database")
+    finally:
+        cursor.close()
+        conn.close()
 
 @app.route('/lend_movie/<int:movie_id>', methods=['POST'])
 def lend_movie(movie_id):
@@ -781,71 +924,193 @@ def scan_barcode():
     barcode_number = request.json.get('barcode')
     if not barcode_number:
         abort(400, description="Barcode number is required")
+    barcode_number = str(barcode_number).strip()
 
     try:
+        # Repeat scans resolve from the barcode cache without calling eBay/TMDB
+        cached = barcode_cache.lookup(barcode_number)
+        if cached is not None:
+            return scan_barcode_from_cache(barcode_number, cached)
+
         ebay_titles = search_ebay_by_barcode(barcode_number)
+        if ebay_titles is None:
+            return jsonify({"error": "eBay lookup failed", "cache_hit": False}), 502
         if not ebay_titles:
             logging.error(f"No results found on eBay for barcode {barcode_number}")
-            return jsonify({"error": "Movie not found on eBay"}), 404
-
-        # Try each title until a valid TMDB response is received
-        for title in ebay_titles:
-            cleaned_title = clean_title(title)
-            tmdb_response = search_tmdb_by_title(cleaned_title)
-            if tmdb_response:
-                # Use TMDB title; fallback to cleaned_title if TMDB returns 'N/A' or is empty
-                final_title = tmdb_response.get('title') or cleaned_title
+            barcode_cache.remember(barcode_number, None)
+            return jsonify({"error": "Movie not found on eBay", "cache_hit": False}), 404
+
+        media_type = barcode_cache.detect_media_type(ebay_titles)
+
+        match, upstream_failed = resolve_listing_titles(ebay_titles)
+        if match:
+            details_response = tmdb_cache.details(match['id'])
+            if details_response:
+                tmdb_response = movie_info_from_details(details_response)
+                # Use TMDB title; fallback to the listing's cleaned title if TMDB has none
+                final_title = tmdb_response.get('title') or match['query']
+                tmdb_response['media_type'] = media_type
                 movie_id = add_movie_to_database(tmdb_response)
+                barcode_cache.remember(barcode_number, tmdb_response['tmdb_id'], media_type)
                 return jsonify({
                     "message": "Movie added successfully",
                     "title": final_title,
-                    "media_type": tmdb_response.get('media_type', 'Unknown format'),
-                    "movie_id": movie_id
+                    "media_type": media_type or 'Unknown format',
+                    "movie_id": movie_id,
+                    "cache_hit": False
                 }), 200
-            else:
-                logging.debug(f"TMDB search failed for cleaned title: {cleaned_title}")
+            upstream_failed = True
+
+        if upstream_failed:
+            return jsonify({"error": "TMDB lookup failed", "cache_hit": False}), 502
 
         logging.error(f"TMDB search failed for all titles derived from barcode {barcode_number}")
-        return jsonify({"error": "Movie not found on TMDB for any derived titles"}), 404
+        barcode_cache.remember(barcode_number, None)
+        return jsonify({"error": "Movie not found on TMDB for any derived titles", "cache_hit": False}), 404
 
     except Exception as e:
         logging.error(f"Error scanning barcode: {e}")
         return jsonify({"error": "Failed to scan barcode"}), 500
 
 
+def resolve_listing_titles(ebay_titles):
+    """Pick the TMDB search result that best matches a set of eBay listing titles.
+
+    Listing titles are cleaned and de-duplicated, the unique queries are
+    searched concurrently, and each result is scored by how well its title
+    agrees with the listings. Outstanding searches are cancelled as soon as
+    one scores SCAN_CONFIDENT_SCORE. Returns (best_result, upstream_failed)
+    where best_result carries the TMDB 'id', 'title', 'query' and 'score';
+    upstream_failed is set when there is no match and any search failed.
+    """
+    listings, queries = listing_queries(ebay_titles)
+    if not queries:
+        return None, False
+
+    best = None
+    failures = 0
+    pool = ThreadPoolExecutor(max_workers=min(len(queries), SCAN_WORKERS))
+    try:
+        futures = {pool.submit(tmdb_cache.search, query): order for order, query in enumerate(queries)}
+        for future in as_completed(futures):
+            order = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                logging.error(f"TMDB search failed for {queries[order]}: {e}")
+                results = None
+            if results is None:
+                failures += 1
+                continue
+            best = fold_scan_results(best, listings, queries, order, results)
+            if best and best[1]['score'] >= SCAN_CONFIDENT_SCORE:
+                logging.debug(f"Confident TMDB match for listings: {best[1]}")
+                break
+    finally:
+        # Don't wait for searches that no longer matter
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if best is None:
+        # Any failed search might have held the match, so this miss isn't final
+        return None, failures > 0
+    return best[1], False
+
+
+def listing_queries(ebay_titles):
+    """Cleaned listing titles and the de-duplicated TMDB queries derived from them."""
+    listings = []
+    queries = []
+    for title in ebay_titles:
+        cleaned = clean_title(title)
+        query = tmdb_query_from_title(cleaned)
+        if cleaned:
+            listings.append(cleaned)
+        if query and query.lower() not in (q.lower() for q in queries):
+            queries.append(query)
+    return listings, queries
+
+
+def fold_scan_results(best, listings, queries, order, results):
+    """Score one query's TMDB results and return the new running (key, match) best."""
+    # fuzzywuzzy is only needed for scans; keep it off the startup path
+    from fuzzywuzzy import fuzz
+
+    for rank, result in enumerate(results[:SCAN_RESULTS_PER_QUERY]):
+        # Agreement with the listings as a whole, not just the one we searched
+        candidate_title = result.get('title') or ''
+        score = sum(fuzz.token_set_ratio(candidate_title, listing) for listing in listings) / len(listings)
+        # Earlier listings and higher-ranked TMDB results win ties
+        key = (score, -order, -rank)
+        if best is None or key > best[0]:
+            best = (key, {'id': result['id'], 'title': result.get('title'),
+                          'query': queries[order], 'score': score})
+    return best
+
+
+def scan_barcode_from_cache(barcode_number, cached):
+    if cached['tmdb_id'] is None:
+        return jsonify({"error": "Movie not found for this barcode (cached)", "cache_hit": True}), 404
+
+    if cached['movie_id'] is not None:
+        # Duplicate copy or shelf re-scan: the movie is already in the collection
+        return jsonify({
+            "message": "Movie already in collection",
+            "title": cached['title'],
+            "media_type": cached['media_type'] or 'Unknown format',
+            "movie_id": cached['movie_id'],
+            "cache_hit": True
+        }), 200
+
+    # Known barcode whose movie was since deleted; details come from the TMDB cache
+    details_response = tmdb_cache.details(cached['tmdb_id'])
+    if not details_response:
+        return jsonify({"error": "TMDB lookup failed", "cache_hit": True}), 502
+    movie_info = movie_info_from_details(details_response)
+    movie_info['media_type'] = cached['media_type']
+    movie_id = add_movie_to_database(movie_info)
+    return jsonify({
+        "message": "Movie added successfully",
+        "title": movie_info['title'],
+        "media_type": cached['media_type'] or 'Unknown format',
+        "movie_id": movie_id,
+        "cache_hit": True
+    }), 200
+
 
-def search_ebay_by_barcode(barcode_number):
-    api_endpoint = "https://svcs.ebay.com/services/search/FindingService/v1"
-    app_id = EBAY_APP_ID
-    entries_per_page = "10"  # Fetch more entries for better analysis
 
-    params = {
+def barcode_search_params(barcode_number):
+    return {
         "OPERATION-NAME": "findItemsByKeywords",
         "SERVICE-VERSION": "1.0.0",
-        "SECURITY-APPNAME": app_id,
+        "SECURITY-APPNAME": EBAY_APP_ID,
         "RESPONSE-DATA-FORMAT": "JSON",
         "keywords": barcode_number,
-        "paginationInput.entriesPerPage": entries_per_page,
+        "paginationInput.entriesPerPage": "10",  # Fetch more entries for better analysis
     }
 
+
+def titles_from_barcode_response(response_data):
+    # Parse the eBay response to collect possible titles
     titles = []
+    items = response_data.get('findItemsByKeywordsResponse', [{}])[0].get('searchResult', [{}])[0].get('item', [])
+    for item in items:
+        title = item.get('title', [])
+        if isinstance(title, list):
+            titles.extend(title)  # Extend the flat list with elements of the sublist
+        else:
+            titles.append(title)  # Append the title as a string
+    return titles
+
+
+def search_ebay_by_barcode(barcode_number):
     try:
-        response = requests.get(api_endpoint, params=params)
+        response = upstream.get(upstream.EBAY_FINDING_URL, params=barcode_search_params(barcode_number),
+                                timeout=upstream.EBAY_TIMEOUT)
         response.raise_for_status()
-        response_data = response.json()
-
-        # Parse the eBay response to collect possible titles
-        items = response_data.get('findItemsByKeywordsResponse', [{}])[0].get('searchResult', [{}])[0].get('item', [])
-        for item in items:
-            title = item.get('title', [])
-            if isinstance(title, list):
-                titles.extend(title)  # Extend the flat list with elements of the sublist
-            else:
-                titles.append(title)  # Append the title as a string
+        return titles_from_barcode_response(response.json())
     except requests.exceptions.RequestException as e:
         logging.error(f"Request to eBay API failed: {e}")
-
-    return titles
+        return None
 
 
 def extract_movie_title(titles):
@@ -854,6 +1119,8 @@ def extract_movie_title(titles):
     cleaned_titles = [clean_title(title) for title in titles]
     if not cleaned_titles:
         return None
+    from fuzzywuzzy import process
+
     best_match = process.extractOne(' '.join(cleaned_titles), cleaned_titles)
     if best_match:
         title, _ = best_match  # Ensure that best_match is unpacked correctly
@@ -872,7 +1139,7 @@ def clean_title(title):
 
 
 
-def search_tmdb_by_title(title):
+def tmdb_query_from_title(title):
     # Ensure the title is properly formatted
     if isinstance(title, list):
         title = title[0]
@@ -894,40 +1161,8 @@ def search_tmdb_by_title(title):
     title = re.sub(r'[^a-zA-Z0-9\s]', '', title).strip()
 
     # Clean up any extra spaces
-    title = re.sub(r'\s+', ' ', title).strip()
-
-    logging.info(f"Searching TMDB for title: {title}")
-
-    # Construct the search URL
-    search_url = f"https://api.themoviedb.org/3/search/movie?api_key={API_KEY}&query={title}"
-    response = requests.get(search_url)
-
-    if response.status_code != 200:
-        logging.error(f"TMDB search failed with status code {response.status_code}")
-        return None
-
-    search_response = response.json()
-
-    if not search_response.get('results'):
-        logging.error(f"TMDB search failed for title {title}")
-        return None
-
-    first_result = search_response['results'][0]
-    details_url = f"https://api.themoviedb.org/3/movie/{first_result['id']}?api_key={API_KEY}"
-    details_response = requests.get(details_url).json()
+    return re.sub(r'\s+', ' ', title).strip()
 
-    return {
-        'title': details_response.get('title', 'N/A'),
-        'genre': ', '.join(g['name'] for g in details_response.get('genres', [])),
-        'tmdb_id': details_response['id'],
-        'rating': details_response.get('vote_average', 0),
-        'cover_url': f"https://image.tmdb.org/t/p/original{details_response.get('poster_path', '')}",
-        'release_date': details_response.get('release_date', 'Unknown'),
-        'description': details_response.get('overview', 'No description available.'),
-        'runtime': details_response.get('runtime', 0),
-        'status': 'Available',
-        'media_type': None  # Set later
-    }
 
 def add_movie_to_database(movie_info):
     with get_db_connection() as conn, conn.cursor() as cursor:
@@ -947,7 +1182,9 @@ def add_movie_to_database(movie_info):
             RETURNING id;
         """, movie_info)
         conn.commit()
-        return cursor.fetchone()[0]
+        movie_id = cursor.fetchone()[0]
+    title_index.index.add(movie_id, movie_info['title'])
+    return movie_id
 
 
 @app.route('/save_settings', methods=['POST'])
@@ -1014,12 +1251,18 @@ def lent_movies():
     try:
         cursor.execute("SELECT id, title, borrower_name, lend_date FROM dvds WHERE status='Lent'")
         movies = cursor.fetchall()
-        cursor.close()
-        conn.close()
         return jsonify(movies)
     except psycopg2.Error as e:
         logging.error(f"Failed to fetch lent movies: {e}")
         abort(500, description="Failed to fetch lent movies")
+    finally:
+        cursor.close()
+        conn.close()
+
+# Report cache, valid while collection_version is unchanged
+_report_cache = {'version': None, 'report': None}
+_report_cache_lock = threading.Lock()
+
 
 @app.route('/generate_report', methods=['GET'])
 def generate_report():
@@ -1027,32 +1270,180 @@ def generate_report():
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
-        cursor.execute("""
-            SELECT genre, COUNT(*) AS count, AVG(rating) AS avg_rating
-            FROM dvds
-            GROUP BY genre
-            ORDER BY count DESC;
-        """)
-        report = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return jsonify(report)
+        version, last_modified = get_collection_version(cursor)
+        etag = f"report-{version}"
+        if not_modified(etag, last_modified):
+            response = Response(status=304)
+        else:
+            with _report_cache_lock:
+                report = _report_cache['report'] if _report_cache['version'] == version else None
+            if report is None:
+                # A movie counts once in each of its genres; movies without
+                # any genre are grouped under 'Unknown'
+                cursor.execute("""
+                    SELECT COALESCE(g.name, 'Unknown') AS genre,
+                           COUNT(*) AS count,
+                           ROUND(AVG(d.rating), 2) AS avg_rating,
+                           ROUND(AVG(d.average_price), 2) AS avg_value,
+                           COALESCE(SUM(d.average_price), 0) AS total_value
+                    FROM dvds d
+                    LEFT JOIN dvd_genres dg ON dg.dvd_id = d.id
+                    LEFT JOIN genres g ON g.id = dg.genre_id
+                    GROUP BY 1
+                    ORDER BY count DESC, genre;
+                """)
+                report = cursor.fetchall()
+                with _report_cache_lock:
+                    _report_cache['version'] = version
+                    _report_cache['report'] = report
+            response = fast_json.response(report)
     except psycopg2.Error as e:
         logging.error(f"Failed to generate report: {e}")
         abort(500, description="Failed to generate report")
+    finally:
+        cursor.close()
+        conn.close()
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
 
+def ensure_schema():
+    """Apply pending migrations once per process (a single version check when current)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            migrations.migrate()
+            _schema_ready = True
 
-# Ensuring database constraints are set correctly
-ensure_db_constraints()
+
+# Entry points call ensure_schema() before serving; this covers any other
+# WSGI server importing the app, without touching the DB at import time
+app.before_first_request(ensure_schema)
+
+def request_route():
+    # The URL rule, not the path, to keep metric series and profile names bounded
+    return request.url_rule.rule if request.url_rule else '<unmatched>'
+
+@app.before_request
+def start_request_timer():
+    if profiling.wants_profile(request_route(), request.headers.get(profiling.PROFILE_HEADER)):
+        g.profiler = profiling.start()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        metrics.observe_request(request.method, request_route(), response.status_code, elapsed)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            response.headers['X-Profile-File'] = profiling.finish(profiler, request.method, request_route(), elapsed)
+    return response
 
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
-    response.headers['Access-Control-Expose-Headers'] = 'Content-Disposition'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, If-None-Match, If-Modified-Since, X-Profile'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Disposition, ETag, Last-Modified, X-Next-Cursor, X-Profile-File'
     return response
 
+@app.after_request
+def compress_response(response):
+    # Registered last so it runs first: request metrics and profiles include the compression
+    return compression.compress_response(response, request.accept_encodings)
+
+@app.route('/tmdb_cache_stats', methods=['GET'])
+def tmdb_cache_stats():
+    return jsonify(tmdb_cache.stats())
+
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    return jsonify(db.get_pool().stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def pool_metrics():
+    stats = db.get_pool().stats()
+    lines = metrics.gauge('collectflix_db_pool_connections', 'Pooled database connections by state.',
+                          [({'state': 'in_use'}, stats['in_use']), ({'state': 'idle'}, stats['idle'])])
+    lines += metrics.gauge('collectflix_db_pool_max_connections', 'Pool size limit.', [({}, stats['max_size'])])
+    for name, key, documentation in (
+            ('checkouts', 'checkouts', 'Connections checked out of the pool.'),
+            ('waits', 'waits', 'Checkouts that had to wait for a free connection.'),
+            ('timeouts', 'timeouts', 'Checkouts that gave up waiting.'),
+            ('wait_seconds', 'total_wait_seconds', 'Time spent checking out connections.')):
+        lines += metrics.gauge(f'collectflix_db_pool_{name}_total', documentation, [({}, stats[key])], 'counter')
+    return lines
+
+def tmdb_cache_metrics():
+    samples = [({'kind': kind, 'result': result}, count)
+               for kind, counters in tmdb_cache.stats().items() if isinstance(counters, dict)
+               for result, count in counters.items() if isinstance(count, int)]
+    return metrics.gauge('collectflix_tmdb_cache_lookups_total', 'TMDB cache lookups by outcome.', samples, 'counter')
+
+metrics.register_collector(pool_metrics)
+metrics.register_collector(tmdb_cache_metrics)
+
+@app.route('/slow_queries', methods=['GET'])
+def slow_queries():
+    return jsonify({"threshold_ms": profiling.SLOW_QUERY_MS,
+                    "queries": list(reversed(profiling.recent_slow_queries))})
+
+@app.route('/upstream_stats', methods=['GET'])
+def upstream_stats():
+    return jsonify(upstream.stats())
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    status = request.args.get('status')
+    if status is not None and status not in (jobs.QUEUED, jobs.RUNNING) + jobs.FINISHED:
+        abort(400, description="Unknown job status")
+    limit = max(1, min(request.args.get('limit', 50, type=int), MAX_PAGE_SIZE))
+    return jsonify({"jobs": jobs.list_jobs(status, limit)})
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404, description="Job not found")
+    return jsonify(job)
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    status = jobs.cancel(job_id)
+    if status is None:
+        abort(404, description="Job not found")
+    if status in (jobs.SUCCEEDED, jobs.FAILED):
+        abort(409, description=f"Job already {status}")
+    # Running jobs stop at their next progress check
+    return jsonify({"job_id": job_id, "status": status, "cancel_requested": True}), 202
+
+@app.route('/jobs/<int:job_id>/result', methods=['GET'])
+def job_result(job_id):
+    row = jobs.result(job_id)
+    if row is None:
+        abort(404, description="Job not found")
+    status, result, error = row
+    if status not in jobs.FINISHED:
+        abort(409, description=f"Job is still {status}")
+    if status == jobs.FAILED:
+        return jsonify({"job_id": job_id, "status": status, "error": error}), 200
+    return jsonify({"job_id": job_id, "status": status, "result": result}), 200
+
 @app.route('/')
 def index():
     return jsonify({
@@ -1060,6 +1451,24 @@ def index():
         'endpoints': ['/export_movies', '/import_movies', '/search_ebay']
     })
 
-if __name__ == '__main__':
+def build_title_index():
+    try:
+        title_index.ensure_built()
+    except (psycopg2.Error, db.PoolTimeout) as e:
+        logging.error(f"Failed to build title index, will retry on first search: {e}")
+
+def start_background_tasks():
+    price_refresh.start_scheduler(EBAY_APP_ID)
+    jobs.start_workers()
+    threading.Thread(target=build_title_index, name="title-index-build", daemon=True).start()
+
+
+def run_server(host='0.0.0.0', port=5500):
+    ensure_schema()
+    start_background_tasks()
     from waitress import serve
-    serve(app, host='0.0.0.0', port=5500)
+    serve(app, host=host, port=port, threads=WAITRESS_THREADS, connection_limit=WAITRESS_CONNECTION_LIMIT)
+
+
+if __name__ == '__main__':
+    run_server()
@@ -0,0 +1,272 @@
+"""ASGI serving mode.
+
+Routes that wait on eBay/TMDB (single-title price refresh, add, metadata
+matches, barcode scans) run as coroutines on httpx and asyncpg, so thousands of upstream
+calls can be in flight without a thread each. Every other route is the
+Flask app, mounted unchanged behind WSGIMiddleware.
+
+    python asgi.py
+    uvicorn asgi:app --host 0.0.0.0 --port 5500
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from json import JSONDecodeError
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as collectflix
+import async_backend as backend
+import barcode_cache
+import jobs
+import metrics
+import price_refresh
+
+
+def error(message, status_code, **extra):
+    return JSONResponse({"error": message, **extra}, status_code=status_code)
+
+
+async def request_json(request):
+    try:
+        data = await request.json()
+    except JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def search_dvd(request):
+    data = await request_json(request)
+    state = request.app.state
+
+    if not data.get("title"):
+        # Whole-collection and stale refreshes are jobs, run by the shared worker pool
+        try:
+            params = price_refresh.job_params(data)
+        except ValueError as e:
+            return error(str(e), 400)
+        job_id = await asyncio.to_thread(jobs.submit, 'price_refresh', params)
+        return JSONResponse({"message": "Price refresh queued", "job_id": job_id,
+                             "status_url": f"/jobs/{job_id}"}, status_code=202)
+
+    movies = await state.pg.fetch("SELECT id, title, media_type FROM dvds WHERE title = $1", data["title"])
+    report = await backend.refresh_prices(state.http, state.pg, movies, collectflix.EBAY_APP_ID)
+    return JSONResponse({"message": "Prices updated", **report})
+
+
+async def fetch_dvd_info(state, title):
+    results = await backend.tmdb_search(state.http, state.pg, title)
+    if not results:
+        return None
+    details_response = await backend.tmdb_details(state.http, state.pg, results[0]['id'])
+    if not details_response:
+        return None
+    return collectflix.movie_info_from_details(details_response)
+
+
+async def add_movie(request):
+    data = await request_json(request)
+    title = data.get('title')
+    media_type = data.get('media_type')
+    if not title or not media_type:
+        return error("Title and media type are required.", 400)
+
+    movie_info = await fetch_dvd_info(request.app.state, title)
+    if not movie_info:
+        return error("Movie not found in TMDB.", 404)
+
+    movie_info['media_type'] = media_type
+    await backend.add_movie_to_database(request.app.state.pg, movie_info)
+    return JSONResponse({"message": "Movie added successfully"}, status_code=201)
+
+
+async def fix_metadata(request):
+    state = request.app.state
+    title = await state.pg.fetchval("SELECT title FROM dvds WHERE id = $1", request.path_params['movie_id'])
+    if title is None:
+        return error("Movie not found", 404)
+
+    results = await backend.tmdb_search(state.http, state.pg, title)
+    if not results:
+        return error("No metadata matches found on TMDB", 404)
+    return JSONResponse({"matches": [collectflix.match_from_search_result(result) for result in results]})
+
+
+async def resolve_listing_titles(state, ebay_titles):
+    """Coroutine version of app.resolve_listing_titles; same scoring and early exit."""
+    listings, queries = collectflix.listing_queries(ebay_titles)
+    if not queries:
+        return None, False
+
+    tasks = {asyncio.ensure_future(backend.tmdb_search(state.http, state.pg, query)): order
+             for order, query in enumerate(queries)}
+    pending = set(tasks)
+    best = None
+    failures = 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                order = tasks[task]
+                try:
+                    results = task.result()
+                except Exception as e:
+                    logging.error(f"TMDB search failed for {queries[order]}: {e}")
+                    results = None
+                if results is None:
+                    failures += 1
+                    continue
+                best = collectflix.fold_scan_results(best, listings, queries, order, results)
+            if best and best[1]['score'] >= collectflix.SCAN_CONFIDENT_SCORE:
+                logging.debug(f"Confident TMDB match for listings: {best[1]}")
+                break
+    finally:
+        # Don't wait for searches that no longer matter
+        for task in pending:
+            task.cancel()
+
+    if best is None:
+        return None, failures > 0
+    return best[1], False
+
+
+async def add_scanned_movie(state, details_response, media_type, cache_hit, title=None):
+    movie_info = collectflix.movie_info_from_details(details_response)
+    movie_info['media_type'] = media_type
+    movie_id = await backend.add_movie_to_database(state.pg, movie_info)
+    return JSONResponse({
+        "message": "Movie added successfully",
+        "title": title or movie_info['title'],
+        "media_type": media_type or 'Unknown format',
+        "movie_id": movie_id,
+        "cache_hit": cache_hit
+    })
+
+
+async def scan_barcode_from_cache(state, cached):
+    if cached['tmdb_id'] is None:
+        return error("Movie not found for this barcode (cached)", 404, cache_hit=True)
+
+    if cached['movie_id'] is not None:
+        # Duplicate copy or shelf re-scan: the movie is already in the collection
+        return JSONResponse({
+            "message": "Movie already in collection",
+            "title": cached['title'],
+            "media_type": cached['media_type'] or 'Unknown format',
+            "movie_id": cached['movie_id'],
+            "cache_hit": True
+        })
+
+    details_response = await backend.tmdb_details(state.http, state.pg, cached['tmdb_id'])
+    if not details_response:
+        return error("TMDB lookup failed", 502, cache_hit=True)
+    return await add_scanned_movie(state, details_response, cached['media_type'], True)
+
+
+async def scan_barcode(request):
+    data = await request_json(request)
+    if not data.get('barcode'):
+        return error("Barcode number is required", 400)
+    barcode_number = str(data['barcode']).strip()
+    state = request.app.state
+
+    try:
+        cached = await backend.barcode_lookup(state.pg, barcode_number)
+        if cached is not None:
+            return await scan_barcode_from_cache(state, cached)
+
+        ebay_titles = await backend.ebay_barcode_titles(state.http, barcode_number)
+        if ebay_titles is None:
+            return error("eBay lookup failed", 502, cache_hit=False)
+        if not ebay_titles:
+            logging.error(f"No results found on eBay for barcode {barcode_number}")
+            await backend.barcode_remember(state.pg, barcode_number, None)
+            return error("Movie not found on eBay", 404, cache_hit=False)
+
+        media_type = barcode_cache.detect_media_type(ebay_titles)
+
+        match, upstream_failed = await resolve_listing_titles(state, ebay_titles)
+        if match:
+            details_response = await backend.tmdb_details(state.http, state.pg, match['id'])
+            if details_response:
+                # Use TMDB title; fallback to the listing's cleaned title if TMDB has none
+                response = await add_scanned_movie(state, details_response, media_type, False,
+                                                   title=details_response.get('title') or match['query'])
+                await backend.barcode_remember(state.pg, barcode_number, details_response['id'], media_type)
+                return response
+            upstream_failed = True
+
+        if upstream_failed:
+            return error("TMDB lookup failed", 502, cache_hit=False)
+
+        logging.error(f"TMDB search failed for all titles derived from barcode {barcode_number}")
+        await backend.barcode_remember(state.pg, barcode_number, None)
+        return error("Movie not found on TMDB for any derived titles", 404, cache_hit=False)
+
+    except Exception as e:
+        logging.error(f"Error scanning barcode: {e}")
+        return error("Failed to scan barcode", 500)
+
+
+def route(path, endpoint, **kwargs):
+    """A Route whose requests are recorded in /metrics like the Flask routes'."""
+    async def timed(request):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_request(request.method, path, status, time.perf_counter() - started)
+
+    return Route(path, timed, **kwargs)
+
+
+@asynccontextmanager
+async def lifespan(starlette_app):
+    # Migrations and the background tasks use the blocking pool, as in WSGI mode
+    await asyncio.to_thread(collectflix.ensure_schema)
+    starlette_app.state.pg = await backend.create_pool()
+    starlette_app.state.http = backend.create_http_client()
+    collectflix.start_background_tasks()
+    try:
+        yield
+    finally:
+        await starlette_app.state.http.aclose()
+        await starlette_app.state.pg.close()
+
+
+app = Starlette(
+    routes=[
+        route('/search_ebay', search_dvd, methods=['POST']),
+        route('/add_movie', add_movie, methods=['POST']),
+        route('/fix_metadata/{movie_id:int}', fix_metadata, methods=['POST']),
+        route('/scan_barcode', scan_barcode, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(collectflix.app)),
+    ],
+    middleware=[
+        # Same policy as the Flask after_request hook, for the native routes
+        Middleware(
+            CORSMiddleware,
+            allow_origins=['*'],
+            allow_methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+            allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'If-None-Match', 'If-Modified-Since',
+                           'X-Profile'],
+            expose_headers=['Content-Disposition', 'ETag', 'Last-Modified', 'X-Next-Cursor', 'X-Profile-File'],
+        ),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=5500)
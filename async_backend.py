@@ -0,0 +1,291 @@
+"""asyncpg/httpx counterparts of the blocking TMDB, eBay and database helpers.
+
+Used by the ASGI app (asgi.py). Caching rules, TTLs, the in-memory TMDB LRU
+and its stats are shared with the threaded Flask code paths.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import date
+
+import asyncpg
+import httpx
+
+import app
+import barcode_cache
+import bulk_import
+import db
+import price_refresh
+import title_index
+import tmdb_cache
+import upstream
+
+# Upstream calls in flight per price refresh; sockets are capped separately
+# by the shared client's ASYNC_HTTP_MAX_CONNECTIONS
+PRICE_REFRESH_CONCURRENCY = int(os.getenv('ASYNC_PRICE_REFRESH_CONCURRENCY', 200))
+
+
+async def _init_connection(conn):
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def create_pool():
+    kwargs = db.connect_kwargs_from_env()
+    return await asyncpg.create_pool(
+        host=kwargs['host'],
+        port=int(kwargs['port']) if kwargs['port'] else None,
+        database=kwargs['dbname'],
+        user=kwargs['user'],
+        password=kwargs['password'],
+        min_size=int(os.getenv('ASYNC_DB_POOL_MIN', 1)),
+        max_size=int(os.getenv('ASYNC_DB_POOL_MAX', 20)),
+        init=_init_connection,
+    )
+
+
+def create_http_client():
+    max_connections = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', 500))
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                 max_keepalive_connections=max_connections))
+
+
+def _numbered(sql):
+    """psycopg2 %s placeholders as asyncpg's $1, $2, ..."""
+    parts = sql.split('%s')
+    return ''.join(part + (f"${number}" if number < len(parts) else '')
+                   for number, part in enumerate(parts, start=1))
+
+
+# --- TMDB ---------------------------------------------------------------
+
+_TMDB_LOOKUP_SQL = _numbered(tmdb_cache.LOOKUP_SQL)
+_TMDB_STORE_SQL = _numbered(tmdb_cache.STORE_SQL)
+
+
+async def _tmdb_get(http, path, **params):
+    params['api_key'] = os.getenv('TMDB_API_KEY')
+    try:
+        response = await upstream.aget(http, f"{upstream.TMDB_API_URL}{path}", params=params,
+                                       timeout=upstream.TMDB_TIMEOUT)
+    except httpx.HTTPError as e:
+        logging.error(f"Request to TMDB failed: {e}")
+        return None
+    if response.status_code != 200:
+        logging.error(f"TMDB request {path} failed with status code {response.status_code}")
+        return None
+    try:
+        return response.json()
+    except ValueError as e:
+        logging.error(f"TMDB request {path} returned invalid JSON: {e}")
+        return None
+
+
+async def _tmdb_cached(pg, kind, key, fetch):
+    value = tmdb_cache.memory_get(kind, key)
+    if value is not None:
+        return value
+
+    try:
+        row = await pg.fetchrow(_TMDB_LOOKUP_SQL, kind, key)
+    except (asyncpg.PostgresError, OSError) as e:
+        logging.warning(f"TMDB cache lookup failed, going to TMDB: {e}")
+        row = None
+    if row is not None:
+        value = tmdb_cache.persistent_hit(kind, key, row['payload'], row['age'])
+        if value is not None:
+            return value
+
+    tmdb_cache.count(kind, 'misses')
+    value = await fetch()
+    if not tmdb_cache.fetched(kind, key, value):
+        return None
+    try:
+        await pg.execute(_TMDB_STORE_SQL, kind, key, value)
+    except (asyncpg.PostgresError, OSError) as e:
+        logging.warning(f"Failed to persist TMDB {kind} cache entry: {e}")
+    return value
+
+
+async def tmdb_search(http, pg, query):
+    """TMDB movie search results for ``query`` ([] if none, None if TMDB failed)."""
+    key = tmdb_cache.normalize_query(query)
+
+    async def fetch():
+        response = await _tmdb_get(http, '/search/movie', query=key)
+        return None if response is None else response.get('results', [])
+
+    return await _tmdb_cached(pg, tmdb_cache.SEARCH, key, fetch)
+
+
+async def tmdb_details(http, pg, tmdb_id):
+    """Full TMDB movie record for ``tmdb_id`` (None if TMDB failed)."""
+    tmdb_id = int(tmdb_id)
+    return await _tmdb_cached(pg, tmdb_cache.DETAILS, str(tmdb_id),
+                              lambda: _tmdb_get(http, f"/movie/{tmdb_id}"))
+
+
+# --- eBay ---------------------------------------------------------------
+
+async def ebay_barcode_titles(http, barcode_number):
+    """Listing titles for a barcode search ([] if none, None if eBay failed)."""
+    try:
+        response = await upstream.aget(http, upstream.EBAY_FINDING_URL,
+                                       params=app.barcode_search_params(barcode_number),
+                                       timeout=upstream.EBAY_TIMEOUT)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logging.error(f"Request to eBay API failed: {e}")
+        return None
+    return app.titles_from_barcode_response(response.json())
+
+
+async def fetch_listings(http, app_id, title, media_type):
+    response = await upstream.aget(
+        http,
+        upstream.EBAY_FINDING_URL,
+        headers={
+            "Content-Type": "application/json",
+            "X-EBAY-SOA-OPERATION-NAME": "findItemsAdvanced",
+            "X-EBAY-SOA-SECURITY-APPNAME": app_id,
+            "X-EBAY-SOA-RESPONSE-DATA-FORMAT": "JSON"
+        },
+        params={
+            "keywords": f"{title} {media_type}",
+            "categoryId": price_refresh.DVD_CATEGORY_ID,
+            "paginationInput.entriesPerPage": 100
+        },
+        timeout=upstream.EBAY_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+async def write_prices(pg, rows):
+    """Apply (id, average_price, currency) rows in a single UPDATE ... FROM unnest()."""
+    if not rows:
+        return 0
+    ids, prices, currencies = zip(*rows)
+    status = await pg.execute("""
+        UPDATE dvds AS d
+        SET average_price = v.average_price, currency = v.currency, price_updated_at = NOW()
+        FROM unnest($1::integer[], $2::numeric[], $3::text[]) AS v(id, average_price, currency)
+        WHERE d.id = v.id
+    """, list(ids), list(prices), list(currencies))
+    return int(status.split()[-1])
+
+
+async def refresh_prices(http, pg, movies, app_id, concurrency=None, batch_size=None):
+    """Async refresh_prices: every lookup is a coroutine, bounded by ``concurrency``.
+
+    Same report shape as price_refresh.refresh_prices; price sets are
+    summarized and written in batches of ``batch_size``.
+    """
+    import price_stats  # pulls in numpy; loaded on first use
+
+    concurrency = concurrency or PRICE_REFRESH_CONCURRENCY
+    batch_size = batch_size or int(os.getenv('PRICE_REFRESH_BATCH_SIZE', 200))
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = []
+    pending = []
+    updated = 0
+
+    async def price_one(movie):
+        movie_id, title, media_type = movie
+        async with semaphore:
+            try:
+                response_data = await fetch_listings(http, app_id, title, media_type)
+                return movie, price_stats.parse_prices(response_data), None
+            except Exception as e:
+                logging.error(f"Failed to price {title} ({media_type}): {e}")
+                return movie, None, e
+
+    async def flush():
+        nonlocal updated
+        batch = list(pending)
+        pending.clear()
+        if not batch:
+            return
+        summaries = price_stats.summarize_many([prices for _, _, prices in batch])
+        rows = [(movie_id, round(summary['average'], 2), "USD")
+                for (movie_id, _, _), summary in zip(batch, summaries)]
+        try:
+            updated += await write_prices(pg, rows)
+        except (asyncpg.PostgresError, OSError) as e:
+            logging.error(f"Failed to write batch of {len(batch)} prices: {e}")
+            failures.extend({'id': movie_id, 'title': title, 'error': f"database write failed: {e}"}
+                            for movie_id, title, _ in batch)
+
+    tasks = [asyncio.ensure_future(price_one(tuple(movie))) for movie in movies]
+    for next_done in asyncio.as_completed(tasks):
+        (movie_id, title, _), prices, error = await next_done
+        if error is not None:
+            failures.append({'id': movie_id, 'title': title, 'error': str(error)})
+            continue
+        pending.append((movie_id, title, prices))
+        if len(pending) >= batch_size:
+            await flush()
+    await flush()
+
+    elapsed = time.monotonic() - started
+    report = {
+        'titles': len(tasks),
+        'updated': updated,
+        'failed': len(failures),
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 3),
+        'titles_per_second': round(len(tasks) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    logging.info(f"Async price refresh finished: {updated}/{len(tasks)} titles updated, "
+                 f"{len(failures)} failed in {elapsed:.1f}s ({report['titles_per_second']} titles/s)")
+    return report
+
+
+# --- Collection ---------------------------------------------------------
+
+_UPSERT_MOVIE_SQL = f"""
+    INSERT INTO dvds ({', '.join(bulk_import.COLUMNS)})
+    VALUES ({', '.join(f'${i}' for i in range(1, len(bulk_import.COLUMNS) + 1))})
+    ON CONFLICT (tmdb_id) DO UPDATE SET
+        {', '.join(f'{c} = EXCLUDED.{c}' for c in bulk_import.COLUMNS if c != 'tmdb_id')}
+    RETURNING id
+"""
+
+
+def _as_date(value):
+    # asyncpg wants date objects; TMDB sends ISO strings (or '')
+    if value is None or isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+async def add_movie_to_database(pg, movie_info):
+    row = dict(movie_info, release_date=_as_date(movie_info.get('release_date')),
+               rating=float(movie_info.get('rating') or 0))
+    movie_id = await pg.fetchval(_UPSERT_MOVIE_SQL, *(row.get(column) for column in bulk_import.COLUMNS))
+    title_index.index.add(movie_id, movie_info['title'])
+    return movie_id
+
+
+_BARCODE_LOOKUP_SQL = _numbered(barcode_cache.LOOKUP_SQL)
+_BARCODE_REMEMBER_SQL = _numbered(barcode_cache.REMEMBER_SQL)
+
+
+async def barcode_lookup(pg, barcode):
+    try:
+        row = await pg.fetchrow(_BARCODE_LOOKUP_SQL, *barcode_cache.lookup_args(barcode))
+    except (asyncpg.PostgresError, OSError) as e:
+        logging.warning(f"Barcode cache lookup failed for {barcode}: {e}")
+        return None
+    return dict(row) if row is not None else None
+
+
+async def barcode_remember(pg, barcode, tmdb_id, media_type=None):
+    try:
+        await pg.execute(_BARCODE_REMEMBER_SQL, barcode, tmdb_id, media_type)
+    except (asyncpg.PostgresError, OSError) as e:
+        logging.warning(f"Failed to cache barcode {barcode}: {e}")
@@ -0,0 +1,71 @@
+import logging
+import os
+import re
+from collections import Counter
+
+import psycopg2
+
+import db
+
+POSITIVE_TTL_SECONDS = float(os.getenv('BARCODE_CACHE_TTL_DAYS', 90)) * 86400
+NEGATIVE_TTL_SECONDS = float(os.getenv('BARCODE_NEGATIVE_TTL_HOURS', 6)) * 3600
+
+BLU_RAY_PATTERN = re.compile(r'blu[\s-]?ray|\b4k\b|\buhd\b', re.IGNORECASE)
+
+# Shared with the asyncpg backend; LOOKUP_SQL takes lookup_args(barcode) and
+# REMEMBER_SQL (barcode, tmdb_id, media_type)
+LOOKUP_SQL = """
+    SELECT b.tmdb_id, b.media_type, d.id AS movie_id, d.title
+    FROM barcode_cache b
+    LEFT JOIN dvds d ON d.tmdb_id = b.tmdb_id
+    WHERE b.barcode = %s
+      AND b.resolved_at > NOW() - make_interval(secs =>
+            CASE WHEN b.tmdb_id IS NULL THEN %s::float8 ELSE %s::float8 END)
+"""
+REMEMBER_SQL = """
+    INSERT INTO barcode_cache (barcode, tmdb_id, media_type, resolved_at)
+    VALUES (%s, %s, %s, NOW())
+    ON CONFLICT (barcode) DO UPDATE SET
+        tmdb_id = EXCLUDED.tmdb_id,
+        media_type = EXCLUDED.media_type,
+        resolved_at = EXCLUDED.resolved_at
+"""
+
+
+def detect_media_type(listing_titles):
+    """Majority vote over eBay listing titles: 'Blu-ray' or 'DVD'."""
+    votes = Counter('Blu-ray' if BLU_RAY_PATTERN.search(title) else 'DVD' for title in listing_titles)
+    return votes.most_common(1)[0][0] if votes else None
+
+
+def lookup_args(barcode):
+    return barcode, NEGATIVE_TTL_SECONDS, POSITIVE_TTL_SECONDS
+
+
+def lookup(barcode):
+    """Return the cached resolution for ``barcode`` or None on a miss.
+
+    A hit is a dict with tmdb_id (None for a cached "not found"), media_type,
+    and the matching dvds row's id/title when the movie is already in the
+    collection -- all from one indexed query.
+    """
+    try:
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(LOOKUP_SQL, lookup_args(barcode))
+            row = cursor.fetchone()
+    except (psycopg2.Error, db.PoolTimeout) as e:
+        logging.warning(f"Barcode cache lookup failed for {barcode}: {e}")
+        return None
+    if row is None:
+        return None
+    tmdb_id, media_type, movie_id, title = row
+    return {'tmdb_id': tmdb_id, 'media_type': media_type, 'movie_id': movie_id, 'title': title}
+
+
+def remember(barcode, tmdb_id, media_type=None):
+    """Cache a resolution; pass tmdb_id=None to cache a "not found"."""
+    try:
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(REMEMBER_SQL, (barcode, tmdb_id, media_type))
+    except (psycopg2.Error, db.PoolTimeout) as e:
+        logging.warning(f"Failed to cache barcode {barcode}: {e}")
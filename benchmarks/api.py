@@ -0,0 +1,183 @@
+"""API benchmark: per-endpoint latency percentiles and throughput.
+
+For each collection size the benchmark database is seeded (see seed.py),
+the app is started under waitress against local eBay/TMDB stubs (see
+stubs.py), and each scenario sends warm-up requests followed by measured
+ones from a pool of client threads. Results are JSON, keyed by size and
+scenario, and can be compared with an earlier run:
+
+    python benchmarks/api.py --sizes 1k,100k --output before.json
+    python benchmarks/api.py --sizes 1k,100k --output after.json --compare before.json
+
+Scenarios run in order, so later ones see the rows imported and scanned by
+earlier ones; ``scan_barcode_hit`` repeats the barcodes of
+``scan_barcode_miss`` and measures the barcode cache.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+import seed  # noqa: E402
+import stubs  # noqa: E402
+
+IMPORT_BATCH = 500
+IMPORT_TMDB_BASE = 20_000_000
+
+
+def cursor_after(movie_id):
+    return base64.urlsafe_b64encode(f"id:{movie_id}".encode()).decode().rstrip('=')
+
+
+def movies_page(i, rng, ctx):
+    return 'GET', f"/movies?limit=100&cursor={cursor_after(rng.randint(0, max(ctx['size'] - 100, 0)))}", None
+
+
+def search_movies(i, rng, ctx):
+    return 'GET', f"/search_movies?title={rng.choice(stubs.WORDS)}", None
+
+
+def export_movies(i, rng, ctx):
+    return 'GET', "/export_movies?format=json", None
+
+
+def import_movies(i, rng, ctx):
+    # Every request imports new movies: a fixed tmdb_id range per request number
+    first = IMPORT_TMDB_BASE + ctx['import_offset'] + i * IMPORT_BATCH
+    movies = []
+    for offset, row in enumerate(seed.rows(IMPORT_BATCH, first)):
+        movie = {column: value for column, value in zip(seed.COLUMNS, row) if value is not None}
+        movie['tmdb_id'] = first + offset
+        movies.append(movie)
+    return 'POST', "/import_movies?format=json", {'movies': movies}
+
+
+def scan_barcode(i, rng, ctx):
+    return 'POST', "/scan_barcode", {'barcode': f"{ctx['barcode_base'] + i:012d}"}
+
+
+# name, request builder, default measured requests, default concurrency (None: --concurrency)
+SCENARIOS = [
+    ('movies', movies_page, 500, None),
+    ('search_movies', search_movies, 300, None),
+    ('export_movies', export_movies, 3, 1),
+    ('import_movies', import_movies, 10, 2),
+    ('scan_barcode_miss', scan_barcode, 100, None),
+    ('scan_barcode_hit', scan_barcode, 100, None),
+]
+
+
+def run_scenario(base_url, build, count, concurrency, warmup, ctx, seed_value):
+    rng = random.Random(seed_value)
+    requests_ = [build(i, rng, ctx) for i in range(warmup + count)]
+
+    def send(request):
+        method, path, body = request
+        return harness.timed_request(base_url, method, path, body)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, requests_[:warmup]))
+        started = time.perf_counter()
+        samples = list(pool.map(send, requests_[warmup:]))
+        elapsed = time.perf_counter() - started
+    return harness.summarize(samples, elapsed, concurrency)
+
+
+def benchmark_size(size, args, stub_url):
+    count = seed.parse_size(size)
+    print(f"[{size}] seeding {count} movies...", file=sys.stderr)
+    seed_seconds = seed.seed(count, args.seed)
+    results = {'_seed_seconds': round(seed_seconds, 2)}
+
+    env = harness.server_env(stub_url, DB_NAME=os.environ['DB_NAME'])
+    with harness.Server(env, threads=args.threads) as server:
+        wanted = set(args.scenarios.split(',')) if args.scenarios else None
+        # Barcodes are new for this run but shared by the miss and hit scenarios
+        ctx = {'size': count, 'barcode_base': 10**11 + random.Random(time.time_ns()).randrange(10**10),
+               'import_offset': 0}
+        for name, build, default_count, default_concurrency in SCENARIOS:
+            if wanted and name not in wanted:
+                continue
+            measured = max(1, round(default_count * args.scale))
+            concurrency = default_concurrency or args.concurrency
+            warmup = 0 if name.startswith('scan_barcode') else min(args.warmup, measured)
+            print(f"[{size}] {name}: {measured} requests, concurrency {concurrency}", file=sys.stderr)
+            results[name] = run_scenario(server.url, build, measured, concurrency, warmup, ctx, args.seed)
+            if name == 'import_movies':
+                ctx['import_offset'] += (warmup + measured) * IMPORT_BATCH
+    return results
+
+
+def compare(current, baseline):
+    """Baseline/current ratios per size and scenario: above 1 means faster now."""
+    comparison = {}
+    for size, scenarios in current.items():
+        for name, result in scenarios.items():
+            before = baseline.get(size, {}).get(name)
+            if not isinstance(result, dict) or not isinstance(before, dict):
+                continue
+            ratios = {}
+            for key in ('p50_ms', 'p90_ms', 'p99_ms'):
+                if before.get(key) and result.get(key):
+                    ratios[key.replace('_ms', '_speedup')] = round(before[key] / result[key], 2)
+            if before.get('throughput_rps') and result.get('throughput_rps'):
+                ratios['throughput_ratio'] = round(result['throughput_rps'] / before['throughput_rps'], 2)
+            comparison.setdefault(size, {})[name] = ratios
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1k,100k', help="comma-separated collection sizes (default 1k,100k)")
+    parser.add_argument('--scenarios', help="comma-separated subset of: " + ', '.join(s[0] for s in SCENARIOS))
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply each scenario's request count")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads (default 8)")
+    parser.add_argument('--threads', type=int, default=8, help="waitress threads (default 8)")
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per scenario (default 10)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help=f"benchmark database (default {seed.DEFAULT_DB})")
+    parser.add_argument('--output', help="also write the results to this file")
+    parser.add_argument('--compare', help="results file from an earlier run to compare against")
+    harness.add_client_arguments(parser)
+    stubs.add_latency_arguments(parser)
+    args = parser.parse_args()
+    harness.ACCEPT_ENCODING = args.accept_encoding
+
+    database = seed.use_bench_database(args.database)
+    stub_server = stubs.start(ebay_latency_ms=args.ebay_latency_ms, tmdb_latency_ms=args.tmdb_latency_ms,
+                              jitter=args.jitter)
+    try:
+        results = {size: benchmark_size(size, args, stub_server.base_url) for size in args.sizes.split(',')}
+    finally:
+        stub_server.shutdown()
+
+    output = {
+        'revision': harness.git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'database': database, 'concurrency': args.concurrency, 'threads': args.threads,
+            'scale': args.scale, 'warmup': args.warmup, 'seed': args.seed, 'accept_encoding': args.accept_encoding,
+            'ebay_latency_ms': args.ebay_latency_ms, 'tmdb_latency_ms': args.tmdb_latency_ms,
+            'jitter': args.jitter, 'upstream_calls': dict(stub_server.counts),
+        },
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare) as baseline:
+            output['comparison'] = compare(results, json.load(baseline)['results'])
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Shared pieces of the API benchmarks: the server under test, the HTTP
+client and latency summaries."""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_SNIPPET = """
+import logging
+import app
+# Under load waitress warns on every queued request; the results show the queueing anyway
+logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+app.ensure_schema()
+app.start_background_tasks()
+from waitress import serve
+serve(app.app, host='127.0.0.1', port={port}, threads={threads}, connection_limit={connection_limit}, _quiet=True)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def server_env(stub_url, **overrides):
+    """Environment for an app server that talks to the stubs and runs nothing in the background."""
+    env = dict(os.environ)
+    env.update({
+        'EBAY_FINDING_URL': f"{stub_url}/ebay",
+        'TMDB_API_URL': f"{stub_url}/tmdb",
+        'EBAY_APP_ID': env.get('EBAY_APP_ID') or 'benchmark',
+        'TMDB_API_KEY': env.get('TMDB_API_KEY') or 'benchmark',
+        # Measure the app, not the client-side rate limiter
+        'EBAY_RATE_LIMIT': '0',
+        'TMDB_RATE_LIMIT': '0',
+        'PRICE_REFRESH_INTERVAL_MINUTES': '0',
+        'JOB_WORKERS': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    env.update({key: str(value) for key, value in overrides.items()})
+    return env
+
+
+class Server:
+    """The app under waitress in a subprocess, ready once ``/movies`` answers."""
+
+    def __init__(self, env, threads=4, connection_limit=100, tree=ROOT, timeout=120):
+        self.env = env
+        self.threads = threads
+        self.connection_limit = connection_limit
+        self.tree = tree
+        self.timeout = timeout
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', SERVER_SNIPPET.format(port=self.port, threads=self.threads,
+                                                         connection_limit=self.connection_limit)],
+            cwd=self.tree, env=self.env, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with {self.process.returncode}")
+            try:
+                requests.get(f"{self.url}/movies?limit=1", timeout=5).raise_for_status()
+                return self
+            except requests.RequestException:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f"server did not answer within {self.timeout}s")
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        return False
+
+
+_local = threading.local()
+
+
+ACCEPT_ENCODING = None  # None keeps requests' default, "gzip, deflate"
+
+
+def session():
+    """One keep-alive session per client thread."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+        if ACCEPT_ENCODING is not None:
+            _local.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    return _local.session
+
+
+def add_client_arguments(parser):
+    parser.add_argument('--accept-encoding', help="Accept-Encoding sent by the client, "
+                                                  "e.g. 'identity' or 'gzip, br' (default 'gzip, deflate')")
+
+
+def send(base_url, method, path, body=None, headers=None, timeout=120):
+    """Send one request and read the whole body as sent, without decompressing it.
+
+    Returns (seconds, response or None, bytes on the wire); only the
+    response's status and headers are meant to be used.
+    """
+    started = time.perf_counter()
+    try:
+        response = session().request(method, f"{base_url}{path}", json=body, headers=headers, timeout=timeout,
+                                     stream=True)
+        size = sum(len(chunk) for chunk in response.raw.stream(65536, decode_content=False))
+        return time.perf_counter() - started, response, size
+    except requests.RequestException:
+        return time.perf_counter() - started, None, 0
+
+
+def timed_request(base_url, method, path, body=None, timeout=120):
+    """Like send(), but returns (seconds, status or None, bytes)."""
+    seconds, response, size = send(base_url, method, path, body, timeout=timeout)
+    return seconds, response.status_code if response is not None else None, size
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, elapsed, concurrency):
+    """Latency percentiles, throughput and errors for [(seconds, status, bytes)] samples."""
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    errors = sum(1 for _, status, _ in samples if status is None or status >= 400)
+    statuses = {}
+    for _, status, _ in samples:
+        key = str(status) if status is not None else 'error'
+        statuses[key] = statuses.get(key, 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'requests': len(samples),
+        'concurrency': concurrency,
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'statuses': statuses,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p90_ms': ms(percentile(latencies, 0.90)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'mean_ms': ms(sum(latencies) / len(latencies) if latencies else None),
+        # Bytes as sent, i.e. compressed when the response was
+        'mean_bytes': round(sum(size for _, _, size in samples) / len(samples)) if samples else 0,
+    }
@@ -0,0 +1,305 @@
+"""Load test: a room of people scanning, browsing and searching at once.
+
+Each virtual user is a thread that plays one persona in a loop, pausing
+between actions the way a person would:
+
+    scanner   POST /scan_barcode, mostly new barcodes, some re-scans
+    browser   opens the grid (GET /movies, /lent_movies, revalidated with
+              If-None-Match) and scrolls a few pages with X-Next-Cursor
+    searcher  GET /search_movies with one or two words, sometimes refined
+
+The number of users steps up through --users; each stage runs for
+--stage-seconds after a short warm-up. For each stage the report gives
+throughput, latency percentiles and error rates overall and per endpoint,
+plus connection pool waits. The saturation point is the first stage where
+errors or p99 latency cross their limits, or where throughput stops
+growing with the number of users. Repeat for several waitress thread
+counts to size WAITRESS_THREADS and DB_POOL_MAX:
+
+    python benchmarks/loadtest.py --threads 4,8,16 --users 10,20,40,80,160
+
+The app runs under waitress against the eBay/TMDB stubs (stubs.py) and the
+benchmark database (seed.py). The load generator shares the machine, so
+keep an eye on client CPU at high user counts.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+import seed  # noqa: E402
+import stubs  # noqa: E402
+
+DEFAULT_MIX = 'scanner=3,browser=5,searcher=2'
+RESCAN_SHARE = 0.2
+
+
+class Workload:
+    """State shared by all virtual users of a run."""
+
+    def __init__(self, base_url, think_scale):
+        self.base_url = base_url
+        self.think_scale = think_scale
+        self.barcodes = itertools.count(10**11 + random.randrange(10**10))
+        self.scanned = []
+        self.samples = []
+        self.measuring = threading.Event()
+        self.stop = threading.Event()
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        started = time.monotonic()
+        seconds, response, size = harness.send(self.base_url, method, path, body, headers)
+        if self.measuring.is_set() and not self.stop.is_set():
+            status = response.status_code if response is not None else None
+            # list.append is atomic; the summary runs after the stage has stopped
+            self.samples.append((endpoint, started, seconds, status, size))
+        return response
+
+    def think(self, rng, low, high):
+        self.stop.wait(rng.uniform(low, high) * self.think_scale)
+
+
+def scanner(work, rng, state):
+    if work.scanned and rng.random() < RESCAN_SHARE:
+        barcode = rng.choice(work.scanned)
+    else:
+        barcode = f"{next(work.barcodes):012d}"
+        work.scanned.append(barcode)
+    work.request('scan_barcode', 'POST', '/scan_barcode', {'barcode': barcode})
+    work.think(rng, 3, 8)
+
+
+def browser(work, rng, state):
+    # Reopening the app revalidates the grid; the ETag changes as scanners add movies
+    headers = {'If-None-Match': state['etag']} if state.get('etag') else None
+    response = work.request('movies', 'GET', '/movies', headers=headers)
+    if response is not None and response.headers.get('ETag'):
+        state['etag'] = response.headers['ETag']
+    work.request('lent_movies', 'GET', '/lent_movies')
+    work.think(rng, 1, 4)
+    next_cursor = response.headers.get('X-Next-Cursor') if response is not None else None
+    for _ in range(rng.randint(0, 5)):
+        if not next_cursor or work.stop.is_set():
+            break
+        page = work.request('movies_page', 'GET', f"/movies?cursor={next_cursor}")
+        next_cursor = page.headers.get('X-Next-Cursor') if page is not None else None
+        work.think(rng, 0.5, 3)
+    work.think(rng, 2, 6)
+
+
+def searcher(work, rng, state):
+    words = [rng.choice(stubs.WORDS)]
+    for _ in range(rng.randint(1, 2)):
+        term = ' '.join(words)
+        work.request('search_movies', 'GET', f"/search_movies?title={term}&sort=relevance&order=desc")
+        work.think(rng, 2, 6)
+        words.append(rng.choice(stubs.WORDS))
+
+
+PERSONAS = {'scanner': scanner, 'browser': browser, 'searcher': searcher}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in PERSONAS:
+            raise SystemExit(f"unknown persona {name!r}; choose from {', '.join(PERSONAS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def allocate(users, mix):
+    """Split ``users`` between personas in proportion to ``mix`` (largest remainder)."""
+    total = sum(mix.values())
+    shares = {name: users * weight / total for name, weight in mix.items()}
+    counts = {name: int(share) for name, share in shares.items()}
+    by_remainder = sorted(shares, key=lambda name: shares[name] - counts[name], reverse=True)
+    for name in by_remainder[:users - sum(counts.values())]:
+        counts[name] += 1
+    return counts
+
+
+def virtual_user(work, persona, seed_value):
+    rng = random.Random(seed_value)
+    # Users arrive spread over the first second rather than all at once
+    work.stop.wait(rng.random())
+    state = {}
+    while not work.stop.is_set():
+        persona(work, rng, state)
+
+
+def pool_stats(base_url):
+    try:
+        return harness.session().get(f"{base_url}/pool_stats", timeout=10).json()
+    except (ValueError, requests.RequestException):
+        return {}
+
+
+def run_stage(base_url, users, mix, args, stage_seed):
+    work = Workload(base_url, args.think_scale)
+    counts = allocate(users, mix)
+    threads = []
+    for number, name in enumerate(name for name, count in counts.items() for _ in range(count)):
+        thread = threading.Thread(target=virtual_user, args=(work, PERSONAS[name], stage_seed * 100_003 + number),
+                                  name=f"{name}-{number}", daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    work.stop.wait(args.warmup_seconds)
+    pool_before = pool_stats(base_url)
+    work.measuring.set()
+    started = time.monotonic()
+    work.stop.wait(args.stage_seconds)
+    work.stop.set()
+    elapsed = time.monotonic() - started
+    for thread in threads:
+        thread.join()
+    pool_after = pool_stats(base_url)
+
+    # Only requests that started and finished inside the measured window
+    window = [sample for sample in work.samples if sample[1] >= started and sample[1] + sample[2] <= started + elapsed]
+    result = {'users': users, 'personas': counts}
+    result.update(harness.summarize([sample[2:] for sample in window], elapsed, users))
+    result.pop('concurrency')
+    endpoints = {}
+    for sample in window:
+        endpoints.setdefault(sample[0], []).append(sample[2:])
+    result['endpoints'] = {}
+    for name, samples in sorted(endpoints.items()):
+        summary = harness.summarize(samples, elapsed, users)
+        summary.pop('concurrency')
+        result['endpoints'][name] = summary
+    result['pool'] = {key: round(pool_after.get(key, 0) - pool_before.get(key, 0), 4)
+                      for key in ('checkouts', 'waits', 'timeouts', 'total_wait_seconds')}
+    result['pool']['max_size'] = pool_after.get('max_size')
+    return result
+
+
+def saturation(stages, slo_p99_ms, max_error_rate, min_scaling):
+    """First stage that breaks a limit, and the largest user count before it."""
+    previous = None
+    for stage in stages:
+        reason = None
+        if stage['error_rate'] > max_error_rate:
+            reason = f"error rate {stage['error_rate']:.1%} above {max_error_rate:.1%}"
+        elif stage['p99_ms'] is not None and stage['p99_ms'] > slo_p99_ms:
+            reason = f"p99 {stage['p99_ms']:.0f} ms above {slo_p99_ms:.0f} ms"
+        elif previous and previous['throughput_rps'] and stage['users'] > previous['users']:
+            # With think time, throughput should grow about as fast as the number of users
+            user_growth = stage['users'] / previous['users'] - 1
+            throughput_growth = (stage['throughput_rps'] or 0) / previous['throughput_rps'] - 1
+            scaling = throughput_growth / user_growth
+            if scaling < min_scaling:
+                reason = f"throughput grew {throughput_growth:.0%} for {user_growth:.0%} more users"
+        if reason:
+            return {
+                'saturated_at_users': stage['users'],
+                'reason': reason,
+                'max_healthy_users': previous['users'] if previous else None,
+                'peak_throughput_rps': max(s['throughput_rps'] or 0 for s in stages),
+            }
+        previous = stage
+    return {
+        'saturated_at_users': None,
+        'reason': "not saturated; try more users",
+        'max_healthy_users': previous['users'] if previous else None,
+        'peak_throughput_rps': max((s['throughput_rps'] or 0 for s in stages), default=0),
+    }
+
+
+def print_stage(threads, stage):
+    print(f"threads={threads:<3} users={stage['users']:<4} {stage['throughput_rps'] or 0:8.1f} req/s  "
+          f"p50 {stage['p50_ms'] or 0:7.1f}  p99 {stage['p99_ms'] or 0:8.1f} ms  "
+          f"errors {stage['error_rate']:6.1%}  pool waits {stage['pool'].get('waits', 0):.0f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', default='5,10,20,40,80', help="concurrent users per stage (default 5,10,20,40,80)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"persona weights (default {DEFAULT_MIX})")
+    parser.add_argument('--threads', default='4', help="waitress thread counts to compare (default 4)")
+    parser.add_argument('--connection-limit', type=int, default=100, help="waitress connection limit (default 100)")
+    parser.add_argument('--pool-max', type=int, help="DB_POOL_MAX for the server (default: the app's)")
+    parser.add_argument('--stage-seconds', type=float, default=30, help="measured time per stage (default 30)")
+    parser.add_argument('--warmup-seconds', type=float, default=5, help="unmeasured ramp-up per stage (default 5)")
+    parser.add_argument('--think-scale', type=float, default=1.0,
+                        help="multiply the pauses between actions (0 sends back to back)")
+    parser.add_argument('--slo-p99-ms', type=float, default=2000, help="p99 latency limit (default 2000)")
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="error rate limit (default 0.01)")
+    parser.add_argument('--min-scaling', type=float, default=0.5,
+                        help="saturated when throughput grows by less than this fraction of the user growth")
+    parser.add_argument('--size', default='10k', help="collection size to seed (default 10k)")
+    parser.add_argument('--no-seed', action='store_true', help="reuse the benchmark database as it is")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help=f"benchmark database (default {seed.DEFAULT_DB})")
+    parser.add_argument('--output', help="also write the results to this file")
+    harness.add_client_arguments(parser)
+    stubs.add_latency_arguments(parser)
+    args = parser.parse_args()
+    harness.ACCEPT_ENCODING = args.accept_encoding
+
+    users = [int(value) for value in args.users.split(',')]
+    thread_counts = [int(value) for value in args.threads.split(',')]
+    mix = parse_mix(args.mix)
+
+    database = seed.use_bench_database(args.database)
+    if not args.no_seed:
+        print(f"Seeding {args.size} movies...", file=sys.stderr)
+        seed.seed(seed.parse_size(args.size), args.seed)
+    stub_server = stubs.start(ebay_latency_ms=args.ebay_latency_ms, tmdb_latency_ms=args.tmdb_latency_ms,
+                              jitter=args.jitter)
+    overrides = {'DB_NAME': database}
+    if args.pool_max:
+        overrides['DB_POOL_MAX'] = args.pool_max
+
+    results = {}
+    try:
+        for threads in thread_counts:
+            env = harness.server_env(stub_server.base_url, **overrides)
+            stages = []
+            with harness.Server(env, threads=threads, connection_limit=args.connection_limit) as server:
+                for number, count in enumerate(users):
+                    stage = run_stage(server.url, count, mix, args, args.seed + number)
+                    print_stage(threads, stage)
+                    stages.append(stage)
+            results[str(threads)] = {
+                'saturation': saturation(stages, args.slo_p99_ms, args.max_error_rate, args.min_scaling),
+                'stages': stages,
+            }
+            print(f"threads={threads}: {results[str(threads)]['saturation']}", file=sys.stderr)
+    finally:
+        stub_server.shutdown()
+
+    output = {
+        'revision': harness.git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'database': database, 'size': None if args.no_seed else args.size, 'mix': mix,
+            'connection_limit': args.connection_limit, 'pool_max': args.pool_max,
+            'stage_seconds': args.stage_seconds, 'warmup_seconds': args.warmup_seconds,
+            'think_scale': args.think_scale, 'accept_encoding': args.accept_encoding,
+            'slo_p99_ms': args.slo_p99_ms, 'max_error_rate': args.max_error_rate, 'min_scaling': args.min_scaling,
+            'ebay_latency_ms': args.ebay_latency_ms, 'tmdb_latency_ms': args.tmdb_latency_ms,
+            'jitter': args.jitter, 'upstream_calls': dict(stub_server.counts),
+        },
+        'results': results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Fill a benchmark database with a deterministic synthetic collection.
+
+The database (BENCH_DB_NAME, default ``collectflix_bench``) is created if
+needed, migrated, emptied and loaded with COPY; the same size and seed
+always produce the same rows. Connection settings are the app's DB_*
+variables / .env.
+
+    python benchmarks/seed.py 100k
+    python benchmarks/seed.py 1m --seed 7
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stubs import GENRES, WORDS, description_for  # noqa: E402
+
+DEFAULT_DB = 'collectflix_bench'
+COPY_BATCH = 50_000
+MEDIA_TYPES = ['DVD', 'Blu-ray', '4K UHD', 'VHS']
+BORROWERS = ['Alex', 'Sam', 'Jordan', 'Robin', 'Casey']
+COLUMNS = ('title', 'genre', 'tmdb_id', 'rating', 'cover_url', 'release_date', 'description', 'runtime',
+           'status', 'media_type', 'average_price', 'currency', 'borrower_name', 'lend_date')
+
+
+def parse_size(text):
+    """'1k' -> 1000, '1m' -> 1000000, '2500' -> 2500."""
+    text = text.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def _autocommit_connection(dbname):
+    conn = psycopg2.connect(host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'), user=os.getenv('DB_USER'),
+                            password=os.getenv('DB_PASS'), dbname=dbname)
+    conn.autocommit = True
+    return conn
+
+
+def use_bench_database(name=None):
+    """Point DB_NAME at the benchmark database, creating it if needed; returns its name."""
+    load_dotenv(os.path.join(ROOT, '.env'))
+    name = name or os.getenv('BENCH_DB_NAME', DEFAULT_DB)
+    admin = _autocommit_connection('postgres')
+    with admin.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE DATABASE "{name}"')
+    admin.close()
+    os.environ['DB_NAME'] = name
+    return name
+
+
+def rows(count, seed):
+    rng = random.Random(seed)
+    for number in range(count):
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+        if rng.random() < 0.3:
+            title = f"{title} {rng.randint(2, 5)}"
+        genres = ', '.join(name for _, name in rng.sample(GENRES, rng.randint(1, 3)))
+        lent = rng.random() < 0.05
+        priced = rng.random() < 0.8
+        yield (
+            title,
+            genres,
+            1_000_000 + number,
+            round(rng.uniform(2, 9.8), 1),
+            f"https://image.tmdb.org/t/p/original/{rng.getrandbits(40):x}.jpg",
+            f"{rng.randint(1950, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            description_for(seed * 1_000_003 + number),
+            rng.randint(75, 200),
+            'Lent' if lent else 'Available',
+            rng.choice(MEDIA_TYPES),
+            f"{rng.uniform(2, 60):.2f}" if priced else None,
+            'USD' if priced else None,
+            rng.choice(BORROWERS) if lent else None,
+            f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" if lent else None,
+        )
+
+
+def seed(count, seed_value=1):
+    """Replace the collection with ``count`` generated movies; returns seconds taken."""
+    import db
+    import migrations
+
+    started = time.perf_counter()
+    migrations.migrate()
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("TRUNCATE dvds, tmdb_cache, barcode_cache, jobs RESTART IDENTITY CASCADE")
+        batch = io.StringIO()
+        writer = csv.writer(batch)
+        for number, row in enumerate(rows(count, seed_value), start=1):
+            writer.writerow('\\N' if value is None else value for value in row)
+            if number % COPY_BATCH == 0 or number == count:
+                batch.seek(0)
+                cursor.copy_expert(f"COPY dvds ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                                   batch)
+                batch = io.StringIO()
+                writer = csv.writer(batch)
+    # VACUUM cannot run in a transaction, so not on a pooled connection
+    conn = _autocommit_connection(os.environ['DB_NAME'])
+    with conn.cursor() as cursor:
+        cursor.execute("VACUUM ANALYZE dvds")
+        cursor.execute("ANALYZE dvd_genres")
+    conn.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('size', help="number of movies, e.g. 1k, 100k, 1m")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help=f"database to (re)create the collection in (default {DEFAULT_DB})")
+    args = parser.parse_args()
+
+    name = use_bench_database(args.database)
+    count = parse_size(args.size)
+    elapsed = seed(count, args.seed)
+    print(f"Seeded {count} movies into {name} in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
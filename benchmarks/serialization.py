@@ -0,0 +1,165 @@
+"""JSON encoding and compression benchmark for the large responses.
+
+Builds payloads shaped like /movies, /search_movies, /export_movies and
+/generate_report from deterministic rows with the types psycopg2 returns
+(Decimal prices and ratings, date columns), then reports for each:
+
+  * CPU time per response for Flask's jsonify encoder (the old path), the
+    stdlib fast_json encoder and orjson, and the encoded size;
+  * the size and CPU cost of gzip and brotli at the app's settings, i.e.
+    the bytes a compressed response saves and what it costs to produce.
+
+No database or server is needed:
+
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --export-rows 100000 --output serialization.json
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import harness  # noqa: E402
+import seed  # noqa: E402
+
+LIST_COLUMNS = ('id', 'title', 'cover_url', 'genre', 'description', 'media_type', 'rating', 'release_date',
+                'runtime', 'status', 'borrower_name', 'lend_date', 'average_price', 'currency')
+SEARCH_COLUMNS = ('id', 'title', 'cover_url', 'genre', 'description', 'media_type', 'rating', 'release_date')
+
+
+def typed_rows(count, seed_value):
+    """seed.rows() as psycopg2 would return them from dvds."""
+    for number, row in enumerate(seed.rows(count, seed_value), start=1):
+        movie = dict(zip(seed.COLUMNS, row))
+        movie['id'] = number
+        movie['rating'] = Decimal(str(movie['rating']))
+        movie['release_date'] = datetime.date.fromisoformat(movie['release_date'])
+        if movie['average_price'] is not None:
+            movie['average_price'] = Decimal(movie['average_price'])
+        if movie['lend_date'] is not None:
+            movie['lend_date'] = datetime.date.fromisoformat(movie['lend_date'])
+        # The TIMESTAMP column export sends
+        movie['added_date'] = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=number * 37)
+        yield movie
+
+
+def payloads(rows, search_rows):
+    # /generate_report aggregates by genre
+    genres = {}
+    for movie in rows:
+        stats = genres.setdefault(movie['genre'].split(', ')[0], [0, Decimal(0)])
+        stats[0] += 1
+        stats[1] += movie['average_price'] or 0
+    report = [{'genre': genre, 'count': count, 'avg_rating': Decimal('6.40'),
+               'avg_value': round(total / count, 2), 'total_value': total}
+              for genre, (count, total) in sorted(genres.items())]
+    return {
+        'movies': [{column: movie[column] for column in LIST_COLUMNS} for movie in rows[:100]],
+        'search_movies': [{column: movie[column] for column in SEARCH_COLUMNS} for movie in rows[:search_rows]],
+        'export_movies': rows,
+        'generate_report': report,
+    }
+
+
+def cpu_ms(function, repeat):
+    """Median CPU milliseconds per call."""
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        function()
+        samples.append((time.process_time() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def encoders():
+    import flask
+
+    import app
+    import fast_json
+
+    def jsonify_dumps(obj):
+        # The app's encoder, with jsonify's sorted keys and ASCII escapes
+        with app.app.app_context():
+            return flask.jsonify(obj).get_data()
+
+    found = {'jsonify': jsonify_dumps, 'stdlib': fast_json._stdlib_dumps}
+    if fast_json.orjson is not None:
+        found['orjson'] = fast_json._orjson_dumps
+        found['orjson_iso_dates'] = lambda obj: fast_json.orjson.dumps(obj, default=fast_json._default)
+    return found
+
+
+def compressors():
+    import compression
+
+    found = {'gzip': lambda data: compression.compress(data, 'gzip')}
+    if compression.brotli is not None:
+        found['br'] = lambda data: compression.compress(data, 'br')
+    settings = {'gzip_level': compression.GZIP_LEVEL, 'brotli_quality': compression.BROTLI_QUALITY}
+    return found, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--export-rows', type=int, default=10_000, help="rows in the export payload (default 10000)")
+    parser.add_argument('--search-rows', type=int, default=1_000, help="rows in a search result (default 1000)")
+    parser.add_argument('--repeat', type=int, default=7, help="timed calls per measurement (default 7)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="also write the results to this file")
+    args = parser.parse_args()
+
+    rows = list(typed_rows(args.export_rows, args.seed))
+    encode_with = encoders()
+    compress_with, settings = compressors()
+
+    results = {}
+    for name, payload in payloads(rows, args.search_rows).items():
+        result = {'rows': len(payload), 'encode': {}, 'compress': {}}
+        for encoder, dumps in encode_with.items():
+            body = dumps(payload)
+            result['encode'][encoder] = {'cpu_ms': cpu_ms(lambda: dumps(payload), args.repeat), 'bytes': len(body)}
+        baseline = result['encode']['jsonify']['cpu_ms']
+        for encoder in result['encode'].values():
+            encoder['speedup'] = round(baseline / encoder['cpu_ms'], 2) if encoder['cpu_ms'] else None
+
+        # Compress what the app now sends
+        body = (encode_with.get('orjson') or encode_with['stdlib'])(payload)
+        result['compress']['identity'] = {'bytes': len(body), 'cpu_ms': 0.0}
+        for encoding, compress in compress_with.items():
+            compressed = compress(body)
+            result['compress'][encoding] = {
+                'bytes': len(compressed),
+                'saved_bytes': len(body) - len(compressed),
+                'ratio': round(len(body) / len(compressed), 2),
+                'cpu_ms': cpu_ms(lambda: compress(body), args.repeat),
+            }
+        results[name] = result
+        summary = ', '.join(f"{encoder} {values['cpu_ms']:.2f} ms" for encoder, values in result['encode'].items())
+        sizes = ', '.join(f"{encoding} {values['bytes']:,} B" for encoding, values in result['compress'].items())
+        print(f"{name:>16}: {summary} | {sizes}", file=sys.stderr)
+
+    import fast_json
+    output = {
+        'revision': harness.git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'export_rows': args.export_rows, 'search_rows': args.search_rows, 'repeat': args.repeat,
+                   'seed': args.seed, 'backend': fast_json.BACKEND, **settings},
+        'results': results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Cold-start benchmark: app import time and time to first response.
+
+Each sample runs in a fresh interpreter so nothing is cached in-process.
+The server sample starts waitress on the app and polls until the first
+request succeeds, so it includes schema checks and first-request setup.
+
+    python benchmarks/startup.py                  # current tree
+    python benchmarks/startup.py --compare HEAD~1 # current tree vs. a revision
+
+Uses the database settings from the environment / .env, like the app.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+"""
+
+SERVER_SNIPPET = """
+import app
+from waitress import serve
+serve(app.app, host='127.0.0.1', port={port}, _quiet=True)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(tree):
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=tree, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_response(tree, path, timeout=60):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-c', SERVER_SNIPPET.format(port=port)], cwd=tree,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"server in {tree} exited with {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read()
+                return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"no response from {url} within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(samples):
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'min_ms': round(min(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+        'samples': len(samples),
+    }
+
+
+def benchmark(tree, runs, path):
+    return {
+        'import': summarize([measure_import(tree) for _ in range(runs)]),
+        'first_response': summarize([measure_first_response(tree, path) for _ in range(runs)]),
+    }
+
+
+def export_revision(revision, target):
+    archive = subprocess.run(['git', 'archive', '--format=tar', revision], cwd=ROOT, check=True,
+                             capture_output=True).stdout
+    archive_path = os.path.join(target, 'tree.tar')
+    with open(archive_path, 'wb') as f:
+        f.write(archive)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(target)
+    os.remove(archive_path)
+    # .env is untracked; share the working tree's settings
+    if os.path.exists(os.path.join(ROOT, '.env')):
+        with open(os.path.join(ROOT, '.env')) as src, open(os.path.join(target, '.env'), 'w') as dst:
+            dst.write(src.read())
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="samples per measurement (default 5)")
+    parser.add_argument('--path', default='/movies?limit=1', help="request used for time to first response")
+    parser.add_argument('--compare', metavar='REV', help="also benchmark this git revision as the baseline")
+    args = parser.parse_args()
+
+    results = {}
+    if args.compare:
+        with tempfile.TemporaryDirectory() as tmp:
+            results['baseline'] = {'revision': args.compare,
+                                   **benchmark(export_revision(args.compare, tmp), args.runs, args.path)}
+    results['current'] = benchmark(ROOT, args.runs, args.path)
+
+    if args.compare:
+        results['speedup'] = {
+            metric: round(results['baseline'][metric]['median_ms'] / results['current'][metric]['median_ms'], 2)
+            for metric in ('import', 'first_response')
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
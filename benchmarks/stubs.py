@@ -0,0 +1,202 @@
+"""Local stand-ins for the eBay Finding and TMDB APIs.
+
+Responses are deterministic functions of the request (a barcode always
+lists the same movie, a title always has the same prices and TMDB id), so
+runs are repeatable; each response is delayed by the configured latency.
+Point the app at them with EBAY_FINDING_URL=<base>/ebay and
+TMDB_API_URL=<base>/tmdb.
+
+    python benchmarks/stubs.py --port 8765 --ebay-latency-ms 150 --tmdb-latency-ms 60
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = (
+    "shadow river night city last star dark king game house blood secret lost iron summer "
+    "winter storm ghost road fire heart dream glass silent wild black golden broken empire "
+    "machine garden ocean mountain crown hunter stranger island midnight echo signal north"
+).split()
+GENRES = [
+    (28, "Action"), (12, "Adventure"), (35, "Comedy"), (80, "Crime"), (18, "Drama"),
+    (27, "Horror"), (878, "Science Fiction"), (53, "Thriller"), (10749, "Romance"), (16, "Animation"),
+]
+FORMATS = ["DVD", "Blu-ray", "4K UHD"]
+
+# Stub TMDB ids start here so they never collide with seeded rows
+TMDB_ID_BASE = 50_000_000
+
+
+def stable_int(*parts):
+    return int.from_bytes(hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=8).digest(), 'big')
+
+
+def title_for(seed):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+
+
+def normalize(query):
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def tmdb_id_for(title):
+    return TMDB_ID_BASE + stable_int('tmdb', normalize(title)) % 10_000_000
+
+
+def description_for(seed):
+    rng = random.Random(seed)
+    sentences = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 16))).capitalize() + '.'
+                 for _ in range(rng.randint(2, 4))]
+    return ' '.join(sentences)
+
+
+def listing_prices(keywords):
+    rng = random.Random(stable_int('prices', keywords))
+    base = rng.uniform(3, 40)
+    prices = [round(rng.gauss(base, base * 0.15), 2) for _ in range(rng.randint(5, 60))]
+    # A few junk listings, like real search results
+    prices += [round(base * rng.uniform(5, 20), 2) for _ in range(rng.randint(0, 3))]
+    return [max(price, 0.99) for price in prices]
+
+
+def ebay_response(params):
+    keywords = params.get('keywords', [''])[0]
+    if params.get('OPERATION-NAME', [''])[0] == 'findItemsByKeywords':
+        # Barcode lookup: listing titles for one movie, the way sellers write them
+        seed = stable_int('barcode', keywords)
+        title = title_for(seed)
+        year = 1970 + seed % 55
+        media = FORMATS[seed % len(FORMATS)]
+        listings = [f"{title} ({year}) {media}", f"{title} {media} Region 1 NEW SEALED",
+                    f"{title.upper()} - {media} - Widescreen", f"{title} [{media}] {year} Like New"]
+        return {"findItemsByKeywordsResponse": [{"searchResult": [{"item": [{"title": [t]} for t in listings]}]}]}
+
+    items = [{"sellingStatus": [{"convertedCurrentPrice": [{"@currencyId": "USD", "__value__": f"{price:.2f}"}]}]}
+             for price in listing_prices(keywords)]
+    return {"findItemsAdvancedResponse": [{"searchResult": [{"item": items}]}]}
+
+
+def tmdb_search_response(params):
+    query = params.get('query', [''])[0]
+    if not query.strip():
+        return {"results": []}
+    title = ' '.join(word.capitalize() for word in normalize(query).split())
+    return {"results": [{
+        "id": tmdb_id_for(title),
+        "title": title,
+        "overview": description_for(stable_int('overview', title)),
+        "release_date": f"{1970 + stable_int('year', title) % 55}-06-01",
+        "poster_path": f"/{stable_int('poster', title) % 10**8}.jpg",
+        "vote_average": round(4 + stable_int('rating', title) % 55 / 10, 1),
+        "genre_ids": [GENRES[stable_int('genre', title) % len(GENRES)][0]],
+    }]}
+
+
+def tmdb_details_response(tmdb_id):
+    rng = random.Random(stable_int('details', tmdb_id))
+    genres = rng.sample(GENRES, rng.randint(1, 3))
+    return {
+        "id": tmdb_id,
+        "title": title_for(tmdb_id),
+        "genres": [{"id": genre_id, "name": name} for genre_id, name in genres],
+        "vote_average": round(rng.uniform(4, 9.5), 1),
+        "release_date": f"{rng.randint(1970, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "overview": description_for(tmdb_id),
+        "runtime": rng.randint(80, 180),
+        "poster_path": f"/{tmdb_id}.jpg",
+    }
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, ebay_latency, tmdb_latency, jitter):
+        super().__init__(address, StubHandler)
+        self.latency = {'ebay': ebay_latency, 'tmdb': tmdb_latency}
+        self.jitter = jitter
+        self.counts = {'ebay': 0, 'tmdb': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self, service):
+        with self._lock:
+            self.counts[service] += 1
+        latency = self.latency[service]
+        if latency > 0:
+            time.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        if path == '/ebay':
+            self.server.delay('ebay')
+            self.send_json(ebay_response(params))
+        elif path == '/tmdb/search/movie':
+            self.server.delay('tmdb')
+            self.send_json(tmdb_search_response(params))
+        elif re.fullmatch(r'/tmdb/movie/\d+', path):
+            self.server.delay('tmdb')
+            self.send_json(tmdb_details_response(int(path.rsplit('/', 1)[1])))
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start(port=0, ebay_latency_ms=150, tmdb_latency_ms=60, jitter=0.2, host='127.0.0.1'):
+    """Serve the stubs from a background thread; returns the server (see base_url)."""
+    server = StubServer((host, port), ebay_latency_ms / 1000, tmdb_latency_ms / 1000, jitter)
+    threading.Thread(target=server.serve_forever, name='upstream-stubs', daemon=True).start()
+    return server
+
+
+def add_latency_arguments(parser):
+    parser.add_argument('--ebay-latency-ms', type=float, default=150, help="eBay response delay (default 150)")
+    parser.add_argument('--tmdb-latency-ms', type=float, default=60, help="TMDB response delay (default 60)")
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help="delays vary uniformly by this fraction (default 0.2)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), args.ebay_latency_ms / 1000, args.tmdb_latency_ms / 1000, args.jitter)
+    print(f"eBay stub at {server.base_url}/ebay, TMDB stub at {server.base_url}/tmdb")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
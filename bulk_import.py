@@ -0,0 +1,249 @@
+import codecs
+import csv
+import logging
+import math
+import xml.etree.ElementTree as ET
+from datetime import date
+from io import BytesIO, StringIO
+
+from dateutil import parser as date_parser
+
+COLUMNS = ('title', 'genre', 'tmdb_id', 'rating', 'cover_url', 'release_date',
+           'description', 'runtime', 'status', 'media_type')
+
+# Values exports write for missing data (XML stringifies None, TMDB uses 'Unknown')
+NULL_MARKERS = {'', 'none', 'null', 'unknown', 'n/a'}
+
+# Rows validated and COPYed per round trip
+BATCH_SIZE = 5000
+
+# Cap on per-row rejection details kept in the report
+MAX_REPORTED_REJECTIONS = 1000
+
+COPY_NULL = '\\N'
+
+# Column limits of dvds, so a bad row is rejected instead of failing the COPY
+INT_RANGE = (-2**31, 2**31 - 1)
+TEXT_LENGTHS = {'title': 255, 'genre': 255, 'status': 50, 'media_type': 50}
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in NULL_MARKERS)
+
+
+def _text(value, field, default=None, null_markers=True):
+    if value is None or (null_markers and _is_null(value)):
+        return default
+    text = str(value).strip()
+    limit = TEXT_LENGTHS.get(field)
+    if limit is not None and len(text) > limit:
+        raise RejectedRow(f"{field} is longer than {limit} characters")
+    return text
+
+
+def _int(value, field, default=None):
+    if _is_null(value):
+        return default
+    try:
+        number = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        raise RejectedRow(f"{field} must be a whole number, got {value!r}")
+    if not INT_RANGE[0] <= number <= INT_RANGE[1]:
+        raise RejectedRow(f"{field} is out of range, got {value!r}")
+    return number
+
+
+def _float(value, field, default=None):
+    if _is_null(value):
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RejectedRow(f"{field} must be a number, got {value!r}")
+
+
+def _date(value):
+    if _is_null(value):
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        # ISO dates are the common case and far cheaper than dateutil
+        return date.fromisoformat(str(value))
+    except ValueError:
+        pass
+    try:
+        return date_parser.parse(str(value)).date()
+    except (ValueError, OverflowError):
+        raise RejectedRow(f"release_date is not a date: {value!r}")
+
+
+def coerce_movie(movie):
+    """Validate one imported record and return it as a tuple in COLUMNS order."""
+    if not isinstance(movie, dict):
+        raise RejectedRow("record is not an object")
+    # "Unknown" and "N/A" are real film titles; only blank means missing
+    title = _text(movie.get('title'), 'title', null_markers=False)
+    if not title:
+        raise RejectedRow("title is required")
+    tmdb_id = _int(movie.get('tmdb_id'), 'tmdb_id')
+    if tmdb_id is None:
+        raise RejectedRow("tmdb_id is required")
+    rating = _float(movie.get('rating'), 'rating', 0.0)
+    if not 0 <= rating <= 10:
+        raise RejectedRow(f"rating must be between 0 and 10, got {rating}")
+
+    return (
+        title,
+        _text(movie.get('genre'), 'genre', 'Unknown'),
+        tmdb_id,
+        rating,
+        _text(movie.get('cover_url'), 'cover_url', ''),
+        _date(movie.get('release_date')),
+        _text(movie.get('description'), 'description', 'No description available.'),
+        _int(movie.get('runtime'), 'runtime', 0),
+        _text(movie.get('status'), 'status', 'Available'),
+        _text(movie.get('media_type'), 'media_type', 'DVD'),
+    )
+
+
+def iter_csv_movies(stream, encoding='utf-8-sig'):
+    """Yield CSV records while decoding the upload incrementally."""
+    # utf-8-sig also strips the BOM spreadsheet exports like to prepend
+    yield from csv.DictReader(codecs.getreader(encoding)(stream))
+
+
+def iter_xml_movies(stream):
+    """Yield <Movie> records one at a time, discarding each element once read."""
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        # Same records as root.findall('Movie'): direct children of the root only
+        if depth == 1:
+            if elem.tag == 'Movie':
+                yield {child.tag: child.text for child in elem}
+            elem.clear()
+            root.remove(elem)
+
+
+class BulkImporter:
+    """Loads movies into dvds through a COPY-fed staging table.
+
+    Records are validated and COPYed in batches; finish() merges the staging
+    table into dvds with one set-based upsert. Everything happens in the
+    caller's transaction, so nothing is visible until they commit.
+    """
+
+    def __init__(self, conn, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.received = 0
+        self.staged = 0
+        self.rejected = 0
+        self.rejections = []
+        self.merged = []
+        self._buffer = []
+
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE dvds_import (
+                    row_no INTEGER,
+                    title TEXT,
+                    genre TEXT,
+                    tmdb_id INTEGER,
+                    rating NUMERIC,
+                    cover_url TEXT,
+                    release_date DATE,
+                    description TEXT,
+                    runtime INTEGER,
+                    status TEXT,
+                    media_type TEXT
+                ) ON COMMIT DROP;
+            """)
+
+    def reject(self, row_no, movie, reason):
+        self.rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            tmdb_id = movie.get('tmdb_id') if isinstance(movie, dict) else None
+            if isinstance(tmdb_id, float) and not math.isfinite(tmdb_id):
+                tmdb_id = str(tmdb_id)  # Infinity/NaN would make the report invalid JSON
+            self.rejections.append({
+                'row': row_no,
+                'title': movie.get('title') if isinstance(movie, dict) else None,
+                'tmdb_id': tmdb_id,
+                'error': reason,
+            })
+
+    def add(self, movie):
+        self.received += 1
+        row_no = self.received
+        try:
+            self._buffer.append((row_no,) + coerce_movie(movie))
+        except RejectedRow as e:
+            logging.warning(f"Rejecting import row {row_no}: {e}")
+            self.reject(row_no, movie, str(e))
+            return
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, movies):
+        for movie in movies:
+            self.add(movie)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data = StringIO()
+        writer = csv.writer(data)
+        for row in self._buffer:
+            writer.writerow(COPY_NULL if value is None else value for value in row)
+        # Send UTF-8 bytes explicitly rather than relying on the client encoding
+        payload = BytesIO(data.getvalue().encode('utf-8'))
+        with self.conn.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY dvds_import (row_no, {', '.join(COLUMNS)}) FROM STDIN "
+                f"WITH (FORMAT csv, NULL '{COPY_NULL}', ENCODING 'UTF8')",
+                payload)
+        self.staged += len(self._buffer)
+        self._buffer = []
+
+    def finish(self):
+        """Merge everything staged into dvds; returns the import report."""
+        self.flush()
+        columns = ', '.join(COLUMNS)
+        updates = ',\n                    '.join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c != 'tmdb_id')
+        with self.conn.cursor() as cursor:
+            # Later rows win when a file repeats a tmdb_id, as with row-by-row upserts
+            cursor.execute(f"""
+                INSERT INTO dvds ({columns})
+                SELECT {columns}
+                FROM (
+                    SELECT DISTINCT ON (tmdb_id) *
+                    FROM dvds_import
+                    ORDER BY tmdb_id, row_no DESC
+                ) AS latest
+                ORDER BY row_no
+                ON CONFLICT (tmdb_id) DO UPDATE SET
+                    {updates}
+                RETURNING id, title;
+            """)
+            imported = cursor.rowcount
+            # (id, title) of every inserted/updated row, for in-memory indexes
+            self.merged = cursor.fetchall()
+        return {
+            'received': self.received,
+            'imported': imported,
+            'duplicates': self.staged - imported,
+            'rejected': self.rejected,
+            'rejections': self.rejections,
+        }
@@ -0,0 +1,414 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out before the timeout."""
+
+
+# Called as listener(name, sql, params, seconds, failed) after every statement
+_statement_listeners = []
+
+# After FROM/JOIN a name followed by "(" is a function call (EXTRACT(EPOCH
+# FROM NOW() ...)), not a table; after INTO/COPY it opens a column list
+_STATEMENT_TABLE = re.compile(r'\b(?:into|update|table|copy)\s+(?:only\s+)?([a-z_][\w.]*)'
+                              r'|\b(?:from|join)\s+(?:only\s+)?([a-z_][\w.]*)(?![\w.]|\s*\()', re.IGNORECASE)
+
+
+def add_statement_listener(listener):
+    _statement_listeners.append(listener)
+
+
+def statement_name(sql):
+    """A low-cardinality name for ``sql``: its verb and first table, e.g. ``select dvds``."""
+    if isinstance(sql, bytes):
+        # execute_values() sends one mogrified bytes statement; the head is enough
+        sql = sql[:400].decode('utf-8', 'replace')
+    else:
+        sql = str(sql)[:400]
+    words = sql.split(None, 1)
+    if not words:
+        return 'empty'
+    verb = words[0].lower()
+    table = None
+    for match in _STATEMENT_TABLE.finditer(sql):
+        # Outside parentheses is the statement's own table; FROM inside them
+        # may be EXTRACT(... FROM column) or a subquery
+        if sql.count('(', 0, match.start()) == sql.count(')', 0, match.start()):
+            table = match
+            break
+        table = table or match
+    return f"{verb} {(table.group(1) or table.group(2)).lower()}" if table else verb
+
+
+class TimedCursorMixin:
+    """Reports the duration of every execute()/executemany()/copy_expert() to the listeners."""
+
+    def _timed(self, params, method, sql, *args):
+        if not _statement_listeners:
+            return method(sql, *args)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = method(sql, *args)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            name = statement_name(sql)
+            for listener in _statement_listeners:
+                try:
+                    listener(name, sql, params, elapsed, failed)
+                except Exception as e:
+                    logging.warning(f"Statement listener failed: {e}")
+
+    def execute(self, sql, vars=None):
+        return self._timed(vars, super().execute, sql, vars)
+
+    def executemany(self, sql, vars_list):
+        return self._timed(vars_list, super().executemany, sql, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(None, super().copy_expert, sql, file, size)
+
+
+_timed_cursor_classes = {}
+
+
+def timed_cursor_class(cursor_factory):
+    cls = _timed_cursor_classes.get(cursor_factory)
+    if cls is None:
+        cls = _timed_cursor_classes[cursor_factory] = type(
+            f"Timed{cursor_factory.__name__}", (TimedCursorMixin, cursor_factory), {})
+    return cls
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, whatever their cursor_factory, are timed."""
+
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = timed_cursor_class(kwargs.get('cursor_factory') or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+class PooledConnection:
+    """Wraps a psycopg2 connection checked out of a ConnectionPool.
+
+    Behaves like the raw connection, except close() (and leaving a ``with``
+    block) hands the connection back to the pool instead of closing it.
+    """
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Same semantics as `with psycopg2_conn:` plus returning it to the pool
+        try:
+            if self._conn is not None and not self._conn.closed:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    @property
+    def released(self):
+        return self._conn is None
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._release(conn, self._created_at)
+
+    def __del__(self):
+        # Safety net for handlers that never close their connection. This can
+        # run in the middle of any code on this thread, including code that
+        # holds the pool lock, so only queue the connection; the pool returns
+        # it on its next checkout.
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._leaked.append((conn, self._created_at))
+
+
+class ConnectionPool:
+    """Thread-safe, bounded pool of psycopg2 connections.
+
+    Idle connections are health-checked before reuse once they have been idle
+    longer than ``health_check_interval`` and are recycled after
+    ``max_lifetime`` seconds. Checkouts block for up to ``timeout`` seconds
+    when every connection is in use.
+    """
+
+    def __init__(self, connect_kwargs, min_size=1, max_size=10, timeout=5.0,
+                 max_lifetime=1800.0, health_check_interval=30.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.connect_kwargs = connect_kwargs
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()  # (conn, created_at, returned_at)
+        self._leaked = deque()  # (conn, created_at), appended without the lock by __del__
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._leaks = 0
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=TimedConnection, **self.connect_kwargs)
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._discarded += 1
+
+    def _expired(self, created_at, now):
+        return self.max_lifetime and now - created_at > self.max_lifetime
+
+    def _healthy(self, conn, returned_at, now):
+        if conn.closed:
+            return False
+        if now - returned_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reclaim_leaked(self):
+        """Release connections whose wrapper was garbage collected unclosed."""
+        while self._leaked:
+            try:
+                conn, created_at = self._leaked.popleft()
+            except IndexError:
+                return
+            logging.warning("A pooled database connection was garbage collected without being closed")
+            with self._lock:
+                self._leaks += 1
+            self._release(conn, created_at)
+
+    def fill(self):
+        """Open connections until the pool holds at least ``min_size``."""
+        while True:
+            with self._lock:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._lock:
+                    self._size -= 1
+                    self._available.notify()
+                raise
+            with self._lock:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+                self._available.notify()
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            self._reclaim_leaked()
+            candidate = None
+            create = False
+            with self._lock:
+                if self._closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+                while not self._idle and self._size >= self.max_size and not self._leaked:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No database connection available within {timeout:.1f}s "
+                            f"({self._in_use}/{self.max_size} in use)")
+                    waited = True
+                    # __del__ can't notify, so look for leaked connections now and then
+                    self._available.wait(min(remaining, 1.0))
+                if not self._idle and self._size >= self.max_size:
+                    continue
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+                self._in_use += 1
+
+            now = time.monotonic()
+            if create:
+                try:
+                    conn = self._connect()
+                except psycopg2.Error:
+                    with self._lock:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._available.notify()
+                    raise
+                created_at = now
+            else:
+                conn, created_at, returned_at = candidate
+                if self._expired(created_at, now) or not self._healthy(conn, returned_at, now):
+                    with self._lock:
+                        self._size -= 1
+                        self._in_use -= 1
+                    self._discard(conn)
+                    continue
+
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+            return PooledConnection(self, conn, created_at)
+
+    def _release(self, conn, created_at):
+        now = time.monotonic()
+        reusable = not conn.closed and not self._expired(created_at, now)
+        if reusable:
+            try:
+                # Never hand out a connection with a transaction still open
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                reusable = False
+
+        with self._lock:
+            self._in_use -= 1
+            if reusable and not self._closed:
+                self._idle.append((conn, created_at, now))
+            else:
+                self._size -= 1
+            self._available.notify()
+
+        if not reusable or self._closed:
+            self._discard(conn)
+
+    def closeall(self):
+        self._reclaim_leaked()
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._available.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        self._reclaim_leaked()
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'min_size': self.min_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait_seconds': round(self._wait_time, 6),
+                'avg_wait_seconds': round(self._wait_time / self._checkouts, 6) if self._checkouts else 0.0,
+                'max_wait_seconds': round(self._max_wait, 6),
+                'connections_created': self._created,
+                'connections_discarded': self._discarded,
+                'connections_leaked': self._leaks,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connect_kwargs_from_env():
+    return {
+        'host': os.getenv('DB_HOST'),
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASS'),
+        'port': os.getenv('DB_PORT'),
+    }
+
+
+def get_pool():
+    """Return the process-wide pool, creating it from DB_* settings on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect_kwargs_from_env(),
+                    min_size=int(os.getenv('DB_POOL_MIN', 1)),
+                    max_size=int(os.getenv('DB_POOL_MAX', 10)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+                    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+                    health_check_interval=float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30)),
+                )
+                try:
+                    _pool.fill()
+                except psycopg2.Error as e:
+                    logging.warning(f"Could not pre-open database connections: {e}")
+    return _pool
+
+
+@contextmanager
+def connection():
+    """Check out a pooled connection for code running outside a request."""
+    conn = get_pool().getconn()
+    try:
+        yield conn
+        if not conn.released and not conn.closed:
+            conn.commit()
+    except Exception:
+        if not conn.released and not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
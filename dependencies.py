@@ -0,0 +1,23 @@
+import importlib.util
+import subprocess
+import sys
+
+# import name -> pip package
+REQUIRED = {
+    'flask': 'flask',
+    'flask_cors': 'flask-cors',
+    'psycopg2': 'psycopg2-binary',
+    'numpy': 'numpy',
+    'fuzzywuzzy': 'fuzzywuzzy',
+    'Levenshtein': 'python-Levenshtein',
+    'dotenv': 'python-dotenv',
+    'requests': 'requests',
+    'waitress': 'waitress'
+}
+
+
+def check_and_install_packages():
+    for lib, pkg in REQUIRED.items():
+        if not importlib.util.find_spec(lib):
+            print(f"🚨 Oh shit, a package is missing, installing {pkg}...")
+            subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
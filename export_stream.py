@@ -0,0 +1,70 @@
+import csv
+from io import StringIO
+from xml.sax.saxutils import escape
+
+import fast_json
+
+# Rows encoded per yielded chunk; keeps writes large without buffering the export
+ROWS_PER_CHUNK = 500
+
+
+def _chunked(rows, size=ROWS_PER_CHUNK):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_csv(rows):
+    output = StringIO()
+    writer = None
+    for chunk in _chunked(rows):
+        if writer is None:
+            writer = csv.DictWriter(output, fieldnames=chunk[0].keys())
+            writer.writeheader()
+        writer.writerows(chunk)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+
+
+def stream_json(rows):
+    yield b'['
+    first = True
+    for chunk in _chunked(rows):
+        # One encoder call per chunk; strip the list's brackets
+        body = fast_json.dumps(chunk)[1:-1]
+        yield body if first else b',' + body
+        first = False
+    yield b']'
+
+
+def stream_ndjson(rows):
+    for chunk in _chunked(rows):
+        yield b''.join(fast_json.dumps(row) + b'\n' for row in chunk)
+
+
+def stream_xml(rows):
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<Movies>'
+    for chunk in _chunked(rows):
+        parts = []
+        for movie in chunk:
+            parts.append('<Movie>')
+            for key, value in movie.items():
+                parts.append(f'<{key}>{escape(str(value))}</{key}>')
+            parts.append('</Movie>')
+        yield ''.join(parts)
+    yield '</Movies>'
+
+
+# format -> (encoder, mimetype, download filename)
+FORMATS = {
+    'json': (stream_json, 'application/json', 'movies.json'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson', 'movies.ndjson'),
+    'csv': (stream_csv, 'text/csv', 'movies.csv'),
+    'xml': (stream_xml, 'application/xml', 'movies.xml'),
+}
@@ -0,0 +1,73 @@
+"""JSON encoding for the large list endpoints and exports.
+
+Uses orjson when it is installed (JSON_ENCODER=auto, the default), or the
+stdlib C encoder (JSON_ENCODER=stdlib). Either way the output matches what
+jsonify sends: NUMERIC columns as strings and dates as HTTP dates. With
+JSON_DATE_FORMAT=iso, dates are sent as ISO 8601 instead, which orjson
+writes without calling back into Python.
+"""
+import datetime
+import json
+import logging
+import os
+from decimal import Decimal
+from functools import lru_cache
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto').lower()
+JSON_DATE_FORMAT = os.getenv('JSON_DATE_FORMAT', 'http').lower()
+ISO_DATES = JSON_DATE_FORMAT == 'iso'
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _datetime_http(value):
+    # Same text as werkzeug's http_date() (naive means UTC), without email.utils
+    if value.tzinfo is not None and value.tzinfo is not datetime.timezone.utc:
+        value = value.astimezone(datetime.timezone.utc)
+    return (f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+@lru_cache(maxsize=65536)
+def _date_http(value):
+    # Midnight UTC, like http_date(); a collection has far fewer distinct dates than rows
+    return f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} 00:00:00 GMT"
+
+
+def _default(o):
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, datetime.datetime):
+        return o.isoformat() if ISO_DATES else _datetime_http(o)
+    if isinstance(o, datetime.date):
+        return o.isoformat() if ISO_DATES else _date_http(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=_default, option=0 if ISO_DATES else orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+if JSON_ENCODER in ('auto', 'orjson') and orjson is not None:
+    BACKEND, dumps = 'orjson', _orjson_dumps
+else:
+    if JSON_ENCODER == 'orjson':
+        logging.warning("JSON_ENCODER=orjson but orjson is not installed; using the stdlib encoder")
+    BACKEND, dumps = 'stdlib', _stdlib_dumps
+
+
+def response(obj, status=200):
+    """A jsonify()-style response encoded with dumps()."""
+    return Response(dumps(obj), status=status, mimetype='application/json')
@@ -169,8 +169,23 @@ function App() {
         throw new Error(`Error: ${response.statusText}`);
       }
 
-      const data = await response.json();
-      addNotification(`Updated eBay prices`);
+      // The refresh runs as a background job; poll it until it finishes
+      const { status_url: statusUrl } = await response.json();
+      let job;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const statusResponse = await fetch(`${config.apiUrl}${statusUrl}`);
+        if (!statusResponse.ok) {
+          throw new Error(`Error: ${statusResponse.statusText}`);
+        }
+        job = await statusResponse.json();
+      } while (job.status === 'queued' || job.status === 'running');
+
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+      addNotification(job.status === 'cancelled' ? 'eBay price update cancelled' : 'Updated eBay prices');
+      reloadMovies();
     } catch (error) {
       addNotification(`eBay price update failed: ${error.message}`, 'error');
     } finally {
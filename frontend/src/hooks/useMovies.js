@@ -9,7 +9,8 @@ export function useMovies(baseApiUrl) {
 
   const fetchMovies = () => {
     setLoading(true);
-    let apiUrl = `${baseApiUrl}/movies?cache=${Date.now()}`;
+    // The API answers unchanged collections with 304 Not Modified, so let the browser revalidate
+    let apiUrl = `${baseApiUrl}/movies`;
     if (searchTerm) {
       apiUrl = `${baseApiUrl}/search_movies?title=${encodeURIComponent(searchTerm)}&sort=relevance&order=desc`;
     }
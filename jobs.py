@@ -0,0 +1,415 @@
+"""Postgres-backed queue for long-running operations.
+
+Requests submit a job (a row in ``jobs``) and get its id back immediately;
+a pool of worker threads claims queued rows with FOR UPDATE SKIP LOCKED, so
+several API processes can share one queue. Handlers report progress and
+poll for cancellation through the JobContext they are given.
+"""
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from psycopg2.extras import Json, RealDictCursor
+
+import db
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Seconds between progress writes (and cancellation checks) per job
+PROGRESS_INTERVAL = float(os.getenv('JOB_PROGRESS_INTERVAL', 1))
+POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 2))
+HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', 15))
+# A running job whose worker hasn't heartbeated for this long is presumed lost
+STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', 120))
+MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# Uploads waiting for a worker; must be shared if workers run on other hosts
+SPOOL_DIR = os.getenv('JOB_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'collectflix-jobs'))
+# Spool files no queued or running job refers to are deleted once this old
+# (younger ones may belong to a job that is still being submitted)
+SPOOL_GRACE_SECONDS = float(os.getenv('JOB_SPOOL_GRACE_SECONDS', 3600))
+SPOOL_SWEEP_SECONDS = float(os.getenv('JOB_SPOOL_SWEEP_SECONDS', 3600))
+
+HANDLERS = {}
+
+_wakeup = threading.Event()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def handler(kind):
+    """Register ``fn(context)`` as the handler for jobs of ``kind``; its return value is the result."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+class JobContext:
+    def __init__(self, job_id, params):
+        self.job_id = job_id
+        self.params = params or {}
+        self.done = 0
+        self.total = None
+        self._cancel_requested = False
+        self._last_write = 0.0
+
+    def progress(self, done, total=None):
+        """Record progress; written through at most every PROGRESS_INTERVAL seconds."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        if time.monotonic() - self._last_write >= PROGRESS_INTERVAL or done == self.total:
+            self._write_progress()
+
+    @property
+    def cancelled(self):
+        """True once cancellation was requested (checked against the DB at most every interval)."""
+        if not self._cancel_requested and time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self._write_progress()
+        return self._cancel_requested
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def _write_progress(self):
+        self._last_write = time.monotonic()
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE jobs
+                SET progress_done = %s, progress_total = %s, progress_at = NOW(), heartbeat_at = NOW()
+                WHERE id = %s
+                RETURNING cancel_requested
+            """, (self.done, self.total, self.job_id))
+            row = cursor.fetchone()
+        self._cancel_requested = bool(row and row[0])
+
+
+def submit(kind, params=None):
+    """Queue a job and return its id."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("INSERT INTO jobs (kind, params) VALUES (%s, %s) RETURNING id",
+                       (kind, Json(params or {})))
+        job_id = cursor.fetchone()[0]
+    logging.info(f"Queued {kind} job {job_id}")
+    _wakeup.set()
+    return job_id
+
+
+def spool_path(suffix=''):
+    """A fresh path in SPOOL_DIR for data a job will read later."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+
+def _in_spool(path):
+    return os.path.dirname(os.path.realpath(path)) == os.path.realpath(SPOOL_DIR)
+
+
+def remove_spooled(params):
+    """Delete the spool file a job's params point to, if any."""
+    path = (params or {}).get('path')
+    if not path or not _in_spool(path):
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Failed to remove spool file {path}: {e}")
+
+
+def sweep_spool():
+    """Delete spool files that no queued or running job will read; returns how many."""
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - SPOOL_GRACE_SECONDS
+    candidates = []
+    for name in names:
+        try:
+            if os.path.getmtime(os.path.join(SPOOL_DIR, name)) < cutoff:
+                candidates.append(name)
+        except OSError:
+            continue
+    if not candidates:
+        return 0
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT params->>'path' FROM jobs
+            WHERE status IN (%s, %s) AND params->>'path' IS NOT NULL
+        """, (QUEUED, RUNNING))
+        in_use = {os.path.basename(row[0]) for row in cursor.fetchall()}
+    removed = 0
+    for name in candidates:
+        if name in in_use:
+            continue
+        try:
+            os.remove(os.path.join(SPOOL_DIR, name))
+            removed += 1
+        except OSError as e:
+            logging.warning(f"Failed to remove orphaned spool file {name}: {e}")
+    if removed:
+        logging.info(f"Removed {removed} orphaned spool files")
+    return removed
+
+
+_JOB_COLUMNS = """
+    id, kind, status, params, progress_done, progress_total, error, cancel_requested, attempts,
+    created_at, started_at, finished_at,
+    EXTRACT(EPOCH FROM COALESCE(finished_at, NOW()) - started_at)::float AS elapsed,
+    EXTRACT(EPOCH FROM progress_at - started_at)::float AS progress_elapsed
+"""
+
+
+def _describe(row):
+    done, total = row['progress_done'], row['progress_total']
+    eta = None
+    # ETA from the average rate so far
+    if row['status'] == RUNNING and total and done and row['progress_elapsed']:
+        eta = round(row['progress_elapsed'] / done * (total - done) - (row['elapsed'] - row['progress_elapsed']), 1)
+        eta = max(eta, 0.0)
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'params': row['params'],
+        'progress': {
+            'done': done,
+            'total': total,
+            'percent': round(100.0 * done / total, 1) if total else None,
+        },
+        'eta_seconds': eta,
+        'elapsed_seconds': round(row['elapsed'], 1) if row['elapsed'] is not None else None,
+        'cancel_requested': row['cancel_requested'],
+        'attempts': row['attempts'],
+        'error': row['error'],
+        'created_at': row['created_at'].isoformat(),
+        'started_at': row['started_at'].isoformat() if row['started_at'] else None,
+        'finished_at': row['finished_at'].isoformat() if row['finished_at'] else None,
+    }
+
+
+def get(job_id):
+    """Status, progress and ETA of a job, or None if it doesn't exist."""
+    with db.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+    return _describe(row) if row else None
+
+
+def list_jobs(status=None, limit=50):
+    """Most recent jobs first, optionally filtered by status."""
+    with db.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(f"""
+            SELECT {_JOB_COLUMNS} FROM jobs
+            WHERE %(status)s::text IS NULL OR status = %(status)s
+            ORDER BY id DESC
+            LIMIT %(limit)s
+        """, {'status': status, 'limit': limit})
+        return [_describe(row) for row in cursor.fetchall()]
+
+
+def result(job_id):
+    """(status, result, error) of a job, or None if it doesn't exist."""
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT status, result, error FROM jobs WHERE id = %s", (job_id,))
+        return cursor.fetchone()
+
+
+def cancel(job_id):
+    """Cancel a queued job outright, or ask a running one to stop.
+
+    Returns the job's status afterwards, or None if it doesn't exist.
+    """
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs
+            SET cancel_requested = TRUE,
+                status = CASE WHEN status = %s THEN %s ELSE status END,
+                finished_at = CASE WHEN status = %s THEN NOW() ELSE finished_at END
+            WHERE id = %s AND status IN (%s, %s)
+            RETURNING status, params
+        """, (QUEUED, CANCELLED, QUEUED, job_id, QUEUED, RUNNING))
+        row = cursor.fetchone()
+        if row is None:
+            # Already finished (or missing): nothing to cancel
+            cursor.execute("SELECT status, NULL FROM jobs WHERE id = %s", (job_id,))
+            row = cursor.fetchone()
+    if row and row[0] == CANCELLED and row[1] is not None:
+        # Cancelled before a worker claimed it, so no handler will clean up
+        remove_spooled(row[1])
+    return row[0] if row else None
+
+
+def claim(worker):
+    """Take the oldest queued job for ``worker``; returns (id, kind, params) or None."""
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs
+            SET status = %s, worker = %s, attempts = attempts + 1,
+                started_at = NOW(), heartbeat_at = NOW()
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = %s
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, kind, params
+        """, (RUNNING, worker, QUEUED))
+        return cursor.fetchone()
+
+
+def _finish(job_id, status, result=None, error=None, done=None):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs
+            SET status = %s, result = %s, error = %s, finished_at = NOW(),
+                progress_done = COALESCE(%s, progress_done), progress_at = NOW()
+            WHERE id = %s
+        """, (status, Json(result) if result is not None else None, error, done, job_id))
+
+
+def run(job_id, kind, params):
+    context = JobContext(job_id, params)
+    started = time.monotonic()
+    try:
+        outcome = HANDLERS[kind](context)
+    except JobCancelled:
+        logging.info(f"{kind} job {job_id} cancelled after {context.done} items")
+        _finish(job_id, CANCELLED, done=context.done)
+        return
+    except Exception as e:
+        logging.exception(f"{kind} job {job_id} failed: {e}")
+        _finish(job_id, FAILED, error=str(e), done=context.done)
+        return
+    # Handlers that stop early on cancellation return a partial result
+    status = CANCELLED if context.cancelled else SUCCEEDED
+    _finish(job_id, status, result=outcome, done=context.done)
+    logging.info(f"{kind} job {job_id} {status} in {time.monotonic() - started:.1f}s")
+
+
+def requeue_abandoned():
+    """Re-queue running jobs whose worker stopped heartbeating (fail them after MAX_ATTEMPTS)."""
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs
+            SET status = CASE WHEN attempts < %s AND NOT cancel_requested THEN %s ELSE %s END,
+                error = CASE WHEN attempts < %s AND NOT cancel_requested THEN error
+                             ELSE 'Worker stopped while the job was running' END,
+                finished_at = CASE WHEN attempts < %s AND NOT cancel_requested THEN NULL ELSE NOW() END,
+                worker = NULL
+            WHERE status = %s AND heartbeat_at < NOW() - make_interval(secs => %s)
+            RETURNING id, status, params
+        """, (MAX_ATTEMPTS, QUEUED, FAILED, MAX_ATTEMPTS, MAX_ATTEMPTS, RUNNING, STALE_SECONDS))
+        rows = cursor.fetchall()
+    for job_id, status, params in rows:
+        logging.warning(f"Job {job_id} was abandoned by its worker; now {status}")
+        if status == FAILED:
+            remove_spooled(params)
+    if any(status == QUEUED for _, status, _ in rows):
+        _wakeup.set()
+
+
+class WorkerPool:
+    """``count`` threads running queued jobs, plus one heartbeating the jobs they hold."""
+
+    def __init__(self, count):
+        self.count = count
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.count):
+            thread = threading.Thread(target=self._work, args=(f"{self.name}:{number}",),
+                                      name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logging.info(f"Started {self.count} job workers")
+
+    def stop(self):
+        self._stop_event.set()
+        _wakeup.set()
+
+    def _work(self, worker):
+        while not self._stop_event.is_set():
+            try:
+                job = claim(worker)
+            except Exception as e:
+                logging.error(f"Failed to claim a job: {e}")
+                job = None
+            if job is None:
+                _wakeup.wait(POLL_SECONDS)
+                _wakeup.clear()
+                continue
+
+            job_id, kind, params = job
+            with self._lock:
+                self.running[job_id] = kind
+            try:
+                if kind not in HANDLERS:
+                    _finish(job_id, FAILED, error=f"No handler for job kind {kind}")
+                else:
+                    run(job_id, kind, params)
+            except Exception as e:
+                logging.error(f"Failed to record the outcome of job {job_id}: {e}")
+            finally:
+                with self._lock:
+                    self.running.pop(job_id, None)
+
+    def _heartbeat(self):
+        last_sweep = time.monotonic()
+        while not self._stop_event.wait(HEARTBEAT_SECONDS):
+            with self._lock:
+                held = list(self.running)
+            try:
+                if held:
+                    with db.connection() as conn, conn.cursor() as cursor:
+                        cursor.execute("UPDATE jobs SET heartbeat_at = NOW() WHERE id = ANY(%s)", (held,))
+                requeue_abandoned()
+                if time.monotonic() - last_sweep >= SPOOL_SWEEP_SECONDS:
+                    last_sweep = time.monotonic()
+                    sweep_spool()
+            except Exception as e:
+                logging.error(f"Job heartbeat failed: {e}")
+
+
+_pool = None
+
+
+def start_workers():
+    """Start the worker pool for this process unless JOB_WORKERS is 0."""
+    global _pool
+    count = int(os.getenv('JOB_WORKERS', 2))
+    if count <= 0:
+        return None
+    if _pool is None:
+        try:
+            requeue_abandoned()
+            sweep_spool()
+        except Exception as e:
+            logging.error(f"Failed to recover abandoned jobs: {e}")
+        _pool = WorkerPool(count)
+        _pool.start()
+    return _pool
@@ -116,7 +116,7 @@ def start_servers():
         flask_cmd = [
             'python',
             '-c',
-            'from app import ensure_db_constraints; ensure_db_constraints(); import app; app.app.run(host="0.0.0.0", port=5500, debug=False, threaded=True)'
+            'import dependencies; dependencies.check_and_install_packages(); import app; app.run_server()'
         ]
         server_processes['flask'] = subprocess.Popen(
             flask_cmd,
@@ -0,0 +1,139 @@
+"""In-process metrics, served in the Prometheus text format at /metrics.
+
+Recording is a bisect and a few additions under a per-metric lock, cheap
+enough to leave on for every request and statement. Values that already
+live elsewhere (pool and cache counters) are read at scrape time by
+collectors instead of being recorded twice.
+"""
+import threading
+from bisect import bisect_left
+
+# Request and upstream latencies (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Database statements are mostly sub-millisecond
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            values = [(key, list(series)) for key, series in self._values.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def gauge(name, documentation, samples, kind='gauge'):
+    """Text for a metric read at scrape time; ``samples`` is [(labels dict, value)]."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return lines
+
+
+http_requests = Counter(
+    'collectflix_http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status'))
+http_duration = Histogram(
+    'collectflix_http_request_duration_seconds', 'Time to produce a response, by route.', ('method', 'route'))
+db_duration = Histogram(
+    'collectflix_db_statement_duration_seconds', 'Database statement execution time.', ('statement',),
+    buckets=DB_BUCKETS)
+db_errors = Counter(
+    'collectflix_db_statement_errors_total', 'Database statements that raised.', ('statement',))
+upstream_requests = Counter(
+    'collectflix_upstream_requests_total', 'eBay/TMDB requests by host and outcome.', ('host', 'status'))
+upstream_duration = Histogram(
+    'collectflix_upstream_request_duration_seconds', 'eBay/TMDB request latency.', ('host',))
+upstream_retries = Counter(
+    'collectflix_upstream_retries_total', 'eBay/TMDB requests that were retried.', ('host',))
+upstream_throttle = Counter(
+    'collectflix_upstream_throttle_seconds_total', 'Time spent waiting on the per-host rate limiter.', ('host',))
+
+_metrics = [http_requests, http_duration, db_duration, db_errors,
+            upstream_requests, upstream_duration, upstream_retries, upstream_throttle]
+_collectors = []
+
+
+def observe_request(method, route, status, seconds):
+    http_requests.inc(method, route, status)
+    http_duration.observe(seconds, method, route)
+
+
+def observe_statement(name, sql, params, seconds, failed):
+    # db statement listener signature; only the name is used as a label
+    db_duration.observe(seconds, name)
+    if failed:
+        db_errors.inc(name)
+
+
+def register_collector(collect):
+    """Add ``collect()``, returning exposition lines, to every scrape."""
+    _collectors.append(collect)
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return '\n'.join(lines) + '\n'
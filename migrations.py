@@ -0,0 +1,434 @@
+import logging
+import time
+from collections import namedtuple
+
+import psycopg2
+from psycopg2 import errors
+
+import db
+
+# Serializes concurrent runners (launcher + API, several workers)
+MIGRATION_LOCK_KEY = 7_411_020
+
+Migration = namedtuple('Migration', 'version name sql optional', defaults=(False,))
+
+# Statements are written to be safe on databases that were set up by the old
+# ensure_db_constraints(), which already has some or all of these objects.
+MIGRATIONS = [
+    Migration(1, 'base dvds table', """
+        CREATE TABLE IF NOT EXISTS dvds (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            genre VARCHAR(255),
+            tmdb_id INTEGER,
+            rating NUMERIC(3, 1),
+            cover_url TEXT,
+            release_date DATE,
+            description TEXT,
+            runtime INTEGER,
+            media_type VARCHAR(50),
+            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS average_price DECIMAL(10, 2);
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS total_collection_price DECIMAL(15, 2);
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS currency VARCHAR(10);
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS borrower_name VARCHAR(255);
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS lend_date DATE;
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS status VARCHAR(50) DEFAULT 'Available';
+
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = 'dvds'::regclass AND conname = 'tmdb_id_unique'
+            ) THEN
+                ALTER TABLE dvds ADD CONSTRAINT tmdb_id_unique UNIQUE (tmdb_id);
+            END IF;
+        END;
+        $$;
+    """),
+
+    Migration(2, 'price staleness', """
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS price_updated_at TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS dvds_price_updated_at_idx ON dvds (price_updated_at NULLS FIRST);
+    """),
+
+    # Persistent TMDB response cache shared by every lookup path
+    Migration(3, 'tmdb cache', """
+        CREATE TABLE IF NOT EXISTS tmdb_cache (
+            kind VARCHAR(16) NOT NULL,
+            cache_key TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (kind, cache_key)
+        );
+    """),
+
+    # Barcode -> tmdb_id resolutions; tmdb_id NULL caches a "not found"
+    Migration(4, 'barcode cache', """
+        CREATE TABLE IF NOT EXISTS barcode_cache (
+            barcode VARCHAR(64) PRIMARY KEY,
+            tmdb_id INTEGER,
+            media_type VARCHAR(50),
+            resolved_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """),
+
+    # Single-row collection version, bumped by any write to dvds.
+    # Drives ETag/Last-Modified on /movies and the report cache.
+    Migration(5, 'collection version', """
+        CREATE TABLE IF NOT EXISTS collection_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        INSERT INTO collection_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION bump_collection_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE collection_version SET version = version + 1, updated_at = NOW();
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS dvds_bump_collection_version ON dvds;
+        CREATE TRIGGER dvds_bump_collection_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON dvds
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_collection_version();
+    """),
+
+    # Full-text search vector over title, genre and description
+    Migration(6, 'search vector', """
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(genre, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'C')
+        ) STORED;
+        CREATE INDEX IF NOT EXISTS dvds_search_vector_idx ON dvds USING GIN (search_vector);
+    """),
+
+    # Trigram indexes for substring (ILIKE) and typo-tolerant matching. The
+    # extension isn't always installed; search falls back without it, the
+    # migration is recorded as skipped, and `--retry-skipped` tries it again.
+    Migration(7, 'trigram indexes', """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS dvds_title_trgm_idx ON dvds USING GIN (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS dvds_genre_trgm_idx ON dvds USING GIN (genre gin_trgm_ops);
+    """, optional=True),
+
+    # Collection value/count per (media_type, status), kept current by
+    # statement-level triggers that apply each write's net delta
+    Migration(8, 'collection totals', """
+        CREATE TABLE IF NOT EXISTS collection_totals (
+            media_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            movie_count BIGINT NOT NULL DEFAULT 0,
+            priced_count BIGINT NOT NULL DEFAULT 0,
+            total_value NUMERIC(15, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (media_type, status)
+        );
+
+        CREATE OR REPLACE FUNCTION apply_collection_totals() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                DELETE FROM collection_totals;
+                RETURN NULL;
+            END IF;
+
+            -- Transition tables only exist for their own event, so each
+            -- branch reads just the ones its trigger defines
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO collection_totals AS t (media_type, status, movie_count, priced_count, total_value)
+                SELECT COALESCE(media_type, 'Unknown'), COALESCE(status, 'Unknown'),
+                       COUNT(*), COUNT(average_price), COALESCE(SUM(average_price), 0)
+                FROM new_rows GROUP BY 1, 2
+                ON CONFLICT (media_type, status) DO UPDATE SET
+                    movie_count = t.movie_count + EXCLUDED.movie_count,
+                    priced_count = t.priced_count + EXCLUDED.priced_count,
+                    total_value = t.total_value + EXCLUDED.total_value;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO collection_totals AS t (media_type, status, movie_count, priced_count, total_value)
+                SELECT COALESCE(media_type, 'Unknown'), COALESCE(status, 'Unknown'),
+                       -COUNT(*), -COUNT(average_price), -COALESCE(SUM(average_price), 0)
+                FROM old_rows GROUP BY 1, 2
+                ON CONFLICT (media_type, status) DO UPDATE SET
+                    movie_count = t.movie_count + EXCLUDED.movie_count,
+                    priced_count = t.priced_count + EXCLUDED.priced_count,
+                    total_value = t.total_value + EXCLUDED.total_value;
+            ELSE
+                -- Updates that don't touch price, media type or status net out to nothing
+                INSERT INTO collection_totals AS t (media_type, status, movie_count, priced_count, total_value)
+                SELECT media_type, status, SUM(movie_count), SUM(priced_count), SUM(total_value)
+                FROM (
+                    SELECT COALESCE(media_type, 'Unknown') AS media_type, COALESCE(status, 'Unknown') AS status,
+                           1 AS movie_count, (average_price IS NOT NULL)::int AS priced_count,
+                           COALESCE(average_price, 0) AS total_value
+                    FROM new_rows
+                    UNION ALL
+                    SELECT COALESCE(media_type, 'Unknown'), COALESCE(status, 'Unknown'),
+                           -1, -(average_price IS NOT NULL)::int, -COALESCE(average_price, 0)
+                    FROM old_rows
+                ) AS delta
+                GROUP BY 1, 2
+                HAVING SUM(movie_count) <> 0 OR SUM(priced_count) <> 0 OR SUM(total_value) <> 0
+                ON CONFLICT (media_type, status) DO UPDATE SET
+                    movie_count = t.movie_count + EXCLUDED.movie_count,
+                    priced_count = t.priced_count + EXCLUDED.priced_count,
+                    total_value = t.total_value + EXCLUDED.total_value;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS dvds_totals_insert ON dvds;
+        CREATE TRIGGER dvds_totals_insert AFTER INSERT ON dvds
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_collection_totals();
+        DROP TRIGGER IF EXISTS dvds_totals_update ON dvds;
+        CREATE TRIGGER dvds_totals_update AFTER UPDATE ON dvds
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_collection_totals();
+        DROP TRIGGER IF EXISTS dvds_totals_delete ON dvds;
+        CREATE TRIGGER dvds_totals_delete AFTER DELETE ON dvds
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_collection_totals();
+        DROP TRIGGER IF EXISTS dvds_totals_truncate ON dvds;
+        CREATE TRIGGER dvds_totals_truncate AFTER TRUNCATE ON dvds
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_collection_totals();
+
+        -- Rebuild from scratch; the triggers keep it current from here on
+        LOCK TABLE dvds IN SHARE MODE;
+        DELETE FROM collection_totals;
+        INSERT INTO collection_totals (media_type, status, movie_count, priced_count, total_value)
+        SELECT COALESCE(media_type, 'Unknown'), COALESCE(status, 'Unknown'),
+               COUNT(*), COUNT(average_price), COALESCE(SUM(average_price), 0)
+        FROM dvds GROUP BY 1, 2;
+    """),
+
+    # Normalized genres; dvds.genre stays the display string and the join
+    # table is kept in sync from it by triggers
+    Migration(9, 'normalized genres', """
+        CREATE TABLE IF NOT EXISTS genres (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS dvd_genres (
+            dvd_id INTEGER NOT NULL REFERENCES dvds(id) ON DELETE CASCADE,
+            genre_id INTEGER NOT NULL REFERENCES genres(id) ON DELETE CASCADE,
+            PRIMARY KEY (dvd_id, genre_id)
+        );
+        CREATE INDEX IF NOT EXISTS dvd_genres_genre_id_idx ON dvd_genres (genre_id, dvd_id);
+
+        CREATE OR REPLACE FUNCTION split_genres(genre TEXT) RETURNS SETOF TEXT AS $$
+            SELECT DISTINCT btrim(name)
+            FROM regexp_split_to_table(COALESCE(genre, ''), ',') AS name
+            WHERE btrim(name) <> '';
+        $$ LANGUAGE sql IMMUTABLE;
+
+        CREATE OR REPLACE FUNCTION sync_dvd_genres() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                DELETE FROM dvd_genres dg
+                USING new_rows n JOIN old_rows o ON o.id = n.id
+                WHERE dg.dvd_id = n.id AND n.genre IS DISTINCT FROM o.genre;
+
+                INSERT INTO genres (name)
+                SELECT DISTINCT s.name
+                FROM new_rows n JOIN old_rows o ON o.id = n.id
+                CROSS JOIN LATERAL split_genres(n.genre) AS s(name)
+                WHERE n.genre IS DISTINCT FROM o.genre
+                ON CONFLICT (name) DO NOTHING;
+
+                INSERT INTO dvd_genres (dvd_id, genre_id)
+                SELECT n.id, g.id
+                FROM new_rows n JOIN old_rows o ON o.id = n.id
+                CROSS JOIN LATERAL split_genres(n.genre) AS s(name)
+                JOIN genres g ON g.name = s.name
+                WHERE n.genre IS DISTINCT FROM o.genre
+                ON CONFLICT DO NOTHING;
+            ELSE
+                INSERT INTO genres (name)
+                SELECT DISTINCT s.name
+                FROM new_rows n CROSS JOIN LATERAL split_genres(n.genre) AS s(name)
+                ON CONFLICT (name) DO NOTHING;
+
+                INSERT INTO dvd_genres (dvd_id, genre_id)
+                SELECT n.id, g.id
+                FROM new_rows n CROSS JOIN LATERAL split_genres(n.genre) AS s(name)
+                JOIN genres g ON g.name = s.name
+                ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS dvds_genres_insert ON dvds;
+        CREATE TRIGGER dvds_genres_insert AFTER INSERT ON dvds
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION sync_dvd_genres();
+        DROP TRIGGER IF EXISTS dvds_genres_update ON dvds;
+        CREATE TRIGGER dvds_genres_update AFTER UPDATE ON dvds
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION sync_dvd_genres();
+
+        LOCK TABLE dvds IN SHARE MODE;
+        INSERT INTO genres (name)
+        SELECT DISTINCT s.name FROM dvds d CROSS JOIN LATERAL split_genres(d.genre) AS s(name)
+        ON CONFLICT (name) DO NOTHING;
+        INSERT INTO dvd_genres (dvd_id, genre_id)
+        SELECT d.id, g.id
+        FROM dvds d CROSS JOIN LATERAL split_genres(d.genre) AS s(name)
+        JOIN genres g ON g.name = s.name
+        ON CONFLICT DO NOTHING;
+    """),
+
+    # Exact-title lookups (single-title price refresh), the default title
+    # sort, and the rating/release date filters of /search_advanced
+    Migration(10, 'hot query indexes', """
+        CREATE INDEX IF NOT EXISTS dvds_title_idx ON dvds (title);
+        CREATE INDEX IF NOT EXISTS dvds_rating_idx ON dvds (rating);
+        CREATE INDEX IF NOT EXISTS dvds_release_date_idx ON dvds (release_date);
+    """),
+
+    # Long operations run as jobs (see jobs.py); workers claim the oldest
+    # queued row and heartbeat the ones they are running
+    Migration(11, 'job queue', """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued'
+                CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+            params JSONB NOT NULL DEFAULT '{}',
+            result JSONB,
+            error TEXT,
+            progress_done BIGINT NOT NULL DEFAULT 0,
+            progress_total BIGINT,
+            progress_at TIMESTAMPTZ,
+            cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMPTZ,
+            heartbeat_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (id) WHERE status = 'queued';
+        CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs (heartbeat_at) WHERE status = 'running';
+    """),
+
+    # Tables created before added_date existed never got it from migration 1.
+    # Rows already there keep NULL (their date is unknown); the default is
+    # set separately so only new rows are stamped.
+    Migration(12, 'added date', """
+        ALTER TABLE dvds ADD COLUMN IF NOT EXISTS added_date TIMESTAMP;
+        ALTER TABLE dvds ALTER COLUMN added_date SET DEFAULT CURRENT_TIMESTAMP;
+    """),
+]
+
+LATEST_VERSION = max(migration.version for migration in MIGRATIONS)
+
+
+def applied_versions(cursor):
+    """{version: skipped} recorded in schema_migrations, or None if the table doesn't exist yet."""
+    try:
+        cursor.execute("SELECT version, skipped FROM schema_migrations")
+    except errors.UndefinedTable:
+        cursor.connection.rollback()
+        return None
+    except errors.UndefinedColumn:
+        # Recorded before optional migrations could be skipped
+        cursor.connection.rollback()
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cursor.execute("ALTER TABLE schema_migrations ADD COLUMN IF NOT EXISTS skipped BOOLEAN NOT NULL DEFAULT FALSE")
+        cursor.connection.commit()
+        cursor.execute("SELECT version, skipped FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+def _skip(conn, migration, error):
+    logging.warning(f"Skipping optional migration {migration.version} ({migration.name}): {error}")
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        # Recorded so later starts don't retry it; applied_at is the last attempt
+        cursor.execute("""
+            INSERT INTO schema_migrations (version, name, skipped) VALUES (%s, %s, TRUE)
+            ON CONFLICT (version) DO UPDATE SET applied_at = NOW()
+            WHERE schema_migrations.skipped
+        """, (migration.version, migration.name))
+    conn.commit()
+
+
+def _apply(conn, migration):
+    started = time.monotonic()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        # Another runner may have applied it while we waited for the lock
+        cursor.execute("SELECT skipped FROM schema_migrations WHERE version = %s", (migration.version,))
+        row = cursor.fetchone()
+        if row and not row[0]:
+            conn.rollback()
+            return False
+        try:
+            cursor.execute(migration.sql)
+        except psycopg2.Error as e:
+            conn.rollback()
+            if migration.optional:
+                _skip(conn, migration, e)
+                return False
+            raise
+        cursor.execute("""
+            INSERT INTO schema_migrations (version, name) VALUES (%s, %s)
+            ON CONFLICT (version) DO UPDATE SET skipped = FALSE, applied_at = NOW()
+        """, (migration.version, migration.name))
+    conn.commit()
+    logging.info(f"Applied migration {migration.version} ({migration.name}) "
+                 f"in {time.monotonic() - started:.2f}s")
+    return True
+
+
+def migrate(retry_skipped=False):
+    """Bring the schema up to date; returns the versions applied by this call.
+
+    When nothing is pending this is a single query against schema_migrations.
+    Each migration runs in its own transaction under an advisory lock.
+    Optional migrations that failed are recorded as skipped and only tried
+    again with ``retry_skipped``.
+    """
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            applied = applied_versions(cursor)
+            if applied is None:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        skipped BOOLEAN NOT NULL DEFAULT FALSE
+                    );
+                """)
+                conn.commit()
+                applied = {}
+        conn.commit()
+
+        pending = [m for m in sorted(MIGRATIONS, key=lambda m: m.version)
+                   if m.version not in applied or (retry_skipped and applied[m.version])]
+        if not pending:
+            return []
+        return [m.version for m in pending if _apply(conn, m)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument('--retry-skipped', action='store_true',
+                        help="also retry optional migrations that failed before (e.g. after installing pg_trgm)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    applied = migrate(retry_skipped=args.retry_skipped)
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
@@ -0,0 +1,252 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import requests
+from psycopg2.extras import execute_values
+
+import db
+import upstream
+
+DVD_CATEGORY_ID = "617"
+
+# Held by whichever process is running the scheduled refresh
+SCHEDULED_REFRESH_LOCK_KEY = 7_411_021
+
+
+def fetch_listings(app_id, title, media_type, timeout):
+    headers = {
+        "Content-Type": "application/json",
+        "X-EBAY-SOA-OPERATION-NAME": "findItemsAdvanced",
+        "X-EBAY-SOA-SECURITY-APPNAME": app_id,
+        "X-EBAY-SOA-RESPONSE-DATA-FORMAT": "JSON"
+    }
+    params = {
+        # Combine title and media type for more accurate search results
+        "keywords": f"{title} {media_type}",
+        "categoryId": DVD_CATEGORY_ID,
+        "paginationInput.entriesPerPage": 100
+    }
+    response = upstream.get(upstream.EBAY_FINDING_URL, headers=headers, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def write_prices(rows):
+    """Apply (id, average_price, currency) rows in a single multi-row UPDATE."""
+    if not rows:
+        return 0
+    with db.connection() as conn, conn.cursor() as cursor:
+        execute_values(cursor, """
+            UPDATE dvds AS d
+            SET average_price = v.average_price, currency = v.currency, price_updated_at = NOW()
+            FROM (VALUES %s) AS v(id, average_price, currency)
+            WHERE d.id = v.id
+        """, rows, template="(%s::integer, %s::numeric, %s)", page_size=len(rows))
+        return cursor.rowcount
+
+
+def refresh_prices(movies, app_id, workers=None, batch_size=None, timeout=None,
+                   progress=None, should_cancel=None):
+    """Re-price ``movies`` ((id, title, media_type) rows) from eBay concurrently.
+
+    Lookups fan out over a bounded thread pool on the shared upstream
+    session (so they are rate limited and retried there); each
+    batch of ``batch_size`` price sets is summarized in one vectorized call
+    and written back in one transaction.
+    ``progress(done, total)`` is called as titles complete; once
+    ``should_cancel()`` is true, lookups not yet started are dropped and
+    what has been priced so far is still written.
+    Returns a report with throughput and the titles that failed.
+    """
+    import price_stats  # pulls in numpy; loaded on first use
+
+    workers = workers or int(os.getenv('PRICE_REFRESH_WORKERS', 8))
+    batch_size = batch_size or int(os.getenv('PRICE_REFRESH_BATCH_SIZE', 200))
+    timeout = timeout or upstream.EBAY_TIMEOUT
+
+    started = time.monotonic()
+    failures = []
+    pending = []
+    updated = 0
+
+    def flush():
+        nonlocal updated
+        batch = list(pending)
+        pending.clear()
+        if not batch:
+            return
+        summaries = price_stats.summarize_many([prices for _, _, prices in batch])
+        rows = []
+        for (movie_id, title, _), summary in zip(batch, summaries):
+            logging.debug(f"Priced {title}: ${summary['average']:.2f} USD "
+                          f"(median ${summary['median']:.2f}, n={summary['sample_size']}, "
+                          f"{summary['outliers']} outliers)")
+            rows.append((movie_id, round(summary['average'], 2), "USD"))
+        try:
+            updated += write_prices(rows)
+        except Exception as e:
+            logging.error(f"Failed to write batch of {len(batch)} prices: {e}")
+            failures.extend({'id': movie_id, 'title': title, 'error': f"database write failed: {e}"}
+                            for movie_id, title, _ in batch)
+
+    def price_one(movie):
+        movie_id, title, media_type = movie
+        response_data = fetch_listings(app_id, title, media_type, timeout)
+        return price_stats.parse_prices(response_data)
+
+    cancelled = False
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(price_one, movie): movie for movie in movies}
+        for done, future in enumerate(as_completed(futures), start=1):
+            movie_id, title, media_type = futures[future]
+            try:
+                prices = future.result()
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Request to eBay API failed for {title} ({media_type}): {e}")
+                failures.append({'id': movie_id, 'title': title, 'error': str(e)})
+            except Exception as e:
+                logging.error(f"Failed to price {title} ({media_type}): {e}")
+                failures.append({'id': movie_id, 'title': title, 'error': str(e)})
+            else:
+                pending.append((movie_id, title, prices))
+                if len(pending) >= batch_size:
+                    flush()
+
+            if progress:
+                progress(done, len(futures))
+            if should_cancel and should_cancel():
+                # Lookups already in flight finish; queued ones never start
+                cancelled = True
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+        flush()
+
+    elapsed = time.monotonic() - started
+    report = {
+        'titles': len(futures),
+        'updated': updated,
+        'failed': len(failures),
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 3),
+        'titles_per_second': round(len(futures) / elapsed, 2) if elapsed > 0 else 0.0,
+        'cancelled': cancelled,
+    }
+    logging.info(f"Price refresh finished: {updated}/{len(futures)} titles updated, "
+                 f"{len(failures)} failed in {elapsed:.1f}s ({report['titles_per_second']} titles/s)")
+    return report
+
+
+REFRESH_MODES = ('all', 'stale')
+
+
+def job_params(data):
+    """The price_refresh job parameters in a request body; ValueError if any is invalid."""
+    params = {key: data[key] for key in ('mode', 'max_age_hours', 'limit') if data.get(key) is not None}
+    if params.get('mode', 'all') not in REFRESH_MODES:
+        raise ValueError(f"mode must be one of {', '.join(REFRESH_MODES)}")
+    max_age_hours = params.get('max_age_hours')
+    if max_age_hours is not None and (isinstance(max_age_hours, bool) or not isinstance(max_age_hours, (int, float))
+                                      or not 0 < max_age_hours < float('inf')):
+        raise ValueError("max_age_hours must be a positive number")
+    limit = params.get('limit')
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 1):
+        raise ValueError("limit must be a positive integer")
+    return params
+
+
+def select_stale_titles(max_age_hours, limit):
+    """Titles never priced or priced more than ``max_age_hours`` ago, oldest first."""
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, title, media_type
+            FROM dvds
+            WHERE price_updated_at IS NULL
+               OR price_updated_at < NOW() - make_interval(secs => %s)
+            ORDER BY price_updated_at ASC NULLS FIRST
+            LIMIT %s
+        """, (max_age_hours * 3600, limit))
+        return cursor.fetchall()
+
+
+def refresh_stale_prices(app_id, max_age_hours=None, limit=None, **hooks):
+    """Re-price only titles whose price is older than ``max_age_hours``, capped at ``limit``.
+
+    ``hooks`` (progress, should_cancel) are passed on to refresh_prices.
+    """
+    max_age_hours = max_age_hours if max_age_hours is not None else float(os.getenv('PRICE_MAX_AGE_HOURS', 24))
+    limit = limit or int(os.getenv('PRICE_REFRESH_LIMIT', 500))
+    movies = select_stale_titles(max_age_hours, limit)
+    report = refresh_prices(movies, app_id, **hooks)
+    report['max_age_hours'] = max_age_hours
+    report['limit'] = limit
+    return report
+
+
+@contextmanager
+def scheduled_refresh_lock():
+    """Try to take the cluster-wide scheduled-refresh lock; yields whether it was taken.
+
+    A session-level advisory lock, so it is held for the whole run (and
+    dropped by the server if this process dies mid-run).
+    """
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (SCHEDULED_REFRESH_LOCK_KEY,))
+            acquired = cursor.fetchone()[0]
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                # Pooled connections outlive the run, so release explicitly
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEDULED_REFRESH_LOCK_KEY,))
+                conn.commit()
+
+
+class RefreshScheduler(threading.Thread):
+    """Background thread that runs a stale-price refresh every ``interval`` seconds."""
+
+    def __init__(self, app_id, interval, max_age_hours=None, limit=None):
+        super().__init__(name='price-refresh-scheduler', daemon=True)
+        self.app_id = app_id
+        self.interval = interval
+        self.max_age_hours = max_age_hours
+        self.limit = limit
+        self.last_report = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        logging.info(f"Price refresh scheduler started (every {self.interval / 60:.0f} min)")
+        while not self._stop_event.wait(self.interval):
+            try:
+                # Every API process runs a scheduler; only one of them refreshes at a time
+                with scheduled_refresh_lock() as acquired:
+                    if not acquired:
+                        logging.info("Scheduled price refresh skipped: another process is running it")
+                        continue
+                    self.last_report = refresh_stale_prices(self.app_id, self.max_age_hours, self.limit)
+            except Exception as e:
+                logging.error(f"Scheduled price refresh failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_scheduler = None
+
+
+def start_scheduler(app_id):
+    """Start the background refresh unless it is disabled or eBay isn't configured."""
+    global _scheduler
+    interval_minutes = float(os.getenv('PRICE_REFRESH_INTERVAL_MINUTES', 60))
+    if interval_minutes <= 0 or not app_id:
+        return None
+    if _scheduler is None or not _scheduler.is_alive():
+        _scheduler = RefreshScheduler(app_id, interval_minutes * 60)
+        _scheduler.start()
+    return _scheduler
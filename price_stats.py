@@ -0,0 +1,104 @@
+import numpy as np
+
+# Tukey fences: prices outside [Q1 - k*IQR, Q3 + k*IQR] are outliers
+IQR_FENCE = 1.5
+
+# Fraction cut from each end for the trimmed mean
+TRIM_FRACTION = 0.1
+
+EMPTY = {
+    'average': 0.0,
+    'median': 0.0,
+    'trimmed_mean': 0.0,
+    'sample_size': 0,
+    'outliers': 0,
+}
+
+
+def _item_price(item):
+    try:
+        return float(item["sellingStatus"][0]["convertedCurrentPrice"][0]["__value__"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return np.nan
+
+
+def parse_prices(response_data):
+    """Converted prices from a findItemsAdvanced response as a float array."""
+    search_result = response_data["findItemsAdvancedResponse"][0].get("searchResult", [{}])[0]
+    items = search_result.get("item", [])
+    prices = np.fromiter((_item_price(item) for item in items), dtype=np.float64, count=len(items))
+    # Listings without a usable price are dropped rather than failing the title
+    return prices[~np.isnan(prices)]
+
+
+def _sorted_quantiles(rows, counts, quantiles):
+    # np.percentile's default linear interpolation, read straight off rows
+    # that are already sorted (much cheaper than nanpercentile on padding)
+    row_index = np.arange(len(rows))[:, None]
+    positions = (counts[:, None] - 1) * np.asarray(quantiles)[None, :]
+    below = np.floor(positions).astype(int)
+    above = np.minimum(below + 1, counts[:, None] - 1)
+    fraction = positions - below
+    low = rows[row_index, below]
+    return low + (rows[row_index, above] - low) * fraction
+
+
+def summarize_many(price_sets):
+    """Statistics for many titles' price arrays at once.
+
+    The sets are packed into one NaN-padded matrix so quartiles, the outlier
+    mask and every aggregate are computed row-wise in single NumPy calls.
+    Returns one dict per set, in order; empty sets get EMPTY.
+    """
+    price_sets = [np.asarray(prices, dtype=np.float64) for prices in price_sets]
+    if not price_sets:
+        return []
+    sizes = np.array([len(prices) for prices in price_sets])
+    width = sizes.max()
+    if width == 0:
+        return [dict(EMPTY) for _ in price_sets]
+
+    matrix = np.full((len(price_sets), width), np.nan)
+    matrix[np.arange(width) < sizes[:, None]] = np.concatenate(price_sets)
+    matrix.sort(axis=1)  # NaN padding sorts to the end of each row
+
+    has_prices = sizes > 0
+    rows = matrix[has_prices]
+    counts = sizes[has_prices]
+
+    q1, median, q3 = _sorted_quantiles(rows, counts, [0.25, 0.5, 0.75]).T
+    iqr = q3 - q1
+    lower = (q1 - IQR_FENCE * iqr)[:, None]
+    upper = (q3 + IQR_FENCE * iqr)[:, None]
+
+    # NaN padding fails both comparisons, so it never counts as an inlier
+    inliers = (rows >= lower) & (rows <= upper)
+    inlier_counts = inliers.sum(axis=1)
+    filled = np.where(np.isnan(rows), 0.0, rows)
+    inlier_means = np.where(inliers, filled, 0.0).sum(axis=1) / np.maximum(inlier_counts, 1)
+    means = filled.sum(axis=1) / counts
+    # Fall back to the plain mean if every price was an outlier
+    average = np.where(inlier_counts > 0, inlier_means, means)
+
+    # Rows are sorted, so the trimmed mean is a slice of the running sum
+    trim = np.floor(counts * TRIM_FRACTION).astype(int)
+    cumulative = np.concatenate([np.zeros((len(rows), 1)), filled.cumsum(axis=1)], axis=1)
+    row_index = np.arange(len(rows))
+    trimmed_sum = cumulative[row_index, counts - trim] - cumulative[row_index, trim]
+    trimmed_mean = trimmed_sum / (counts - 2 * trim)
+
+    results = [dict(EMPTY) for _ in price_sets]
+    for position, set_index in enumerate(np.flatnonzero(has_prices)):
+        results[set_index] = {
+            'average': float(average[position]),
+            'median': float(median[position]),
+            'trimmed_mean': float(trimmed_mean[position]),
+            'sample_size': int(counts[position]),
+            'outliers': int(counts[position] - inlier_counts[position]),
+        }
+    return results
+
+
+def summarize(prices):
+    """Statistics for a single title's prices; see summarize_many."""
+    return summarize_many([prices])[0]
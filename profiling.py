@@ -0,0 +1,134 @@
+"""Opt-in request profiling and slow-query logging.
+
+A request is profiled with cProfile when PROFILE_REQUESTS covers its route,
+or when it carries ``X-Profile: <PROFILE_TOKEN>``. The profile (pstats
+format, for ``python -m pstats`` or snakeviz) is written to PROFILE_DIR
+and its file name returned in the ``X-Profile-File`` response header.
+cProfile follows the request thread only: time spent in helper thread
+pools shows up as waiting on their futures.
+
+Statements slower than SLOW_QUERY_MS are logged with their SQL, the shape
+of their parameters (types and sizes, never values) and their duration.
+"""
+import cProfile
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+SLOW_QUERY_MAX_SQL = 2000
+
+slow_query_logger = logging.getLogger('collectflix.slow_query')
+
+
+def _profiled_routes():
+    # '1'/'all' profiles everything; otherwise a comma-separated list of URL rules
+    value = os.getenv('PROFILE_REQUESTS', '').strip()
+    if value.lower() in ('', '0', 'false', 'no'):
+        return frozenset()
+    if value.lower() in ('1', 'true', 'yes', 'all'):
+        return None
+    return frozenset(route.strip() for route in value.split(',') if route.strip())
+
+
+PROFILED_ROUTES = _profiled_routes()
+
+
+def wants_profile(route, header_value):
+    if PROFILE_TOKEN and header_value == PROFILE_TOKEN:
+        return True
+    return PROFILED_ROUTES is None or route in PROFILED_ROUTES
+
+
+def start():
+    """Start profiling the current thread; None if another profiler is already active."""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+_prune_lock = threading.Lock()
+
+
+def _prune():
+    with _prune_lock:
+        files = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith('.prof')),
+                       key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def finish(profiler, method, route, seconds):
+    """Stop ``profiler`` and save it; returns the file name."""
+    profiler.disable()
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{method.lower()}-{slug}-{seconds * 1000:.0f}ms-{threading.get_ident()}.prof"
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    _prune()
+    logging.info(f"Saved profile of {method} {route} ({seconds * 1000:.0f} ms) to {name}")
+    return name
+
+
+def parameter_shape(params):
+    """Types and sizes of statement parameters, e.g. ``(str, int, list[3])``."""
+    if params is None or isinstance(params, str):
+        return params
+    if isinstance(params, dict):
+        return '{' + ', '.join(f"{key}: {_value_shape(value)}" for key, value in params.items()) + '}'
+    if isinstance(params, (list, tuple)):
+        if len(params) > 10 and all(isinstance(row, (list, tuple, dict)) for row in params[:10]):
+            # executemany()-style batches
+            return f"{len(params)} x {parameter_shape(params[0])}"
+        return '(' + ', '.join(_value_shape(value) for value in params) + ')'
+    return _value_shape(params)
+
+
+def _value_shape(value):
+    if isinstance(value, (list, tuple, set)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (str, bytes)) and len(value) > 100:
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+recent_slow_queries = deque(maxlen=100)
+
+
+def log_slow_statement(name, sql, params, seconds, failed):
+    """db statement listener: record statements over SLOW_QUERY_MS."""
+    if SLOW_QUERY_MS <= 0 or seconds * 1000 < SLOW_QUERY_MS:
+        return
+    if isinstance(sql, bytes):
+        # execute_values() inlines the rows into the statement; keep them out of the log
+        params = f"{len(sql)} bytes inlined"
+        head, values, _ = sql[:SLOW_QUERY_MAX_SQL].partition(b'VALUES')
+        sql = (head + values).decode('utf-8', 'replace') + (' ...' if values else '')
+    sql = ' '.join(str(sql).split())
+    if len(sql) > SLOW_QUERY_MAX_SQL:
+        sql = sql[:SLOW_QUERY_MAX_SQL] + '...'
+    entry = {
+        'statement': name,
+        'duration_ms': round(seconds * 1000, 1),
+        'failed': failed,
+        'parameters': parameter_shape(params),
+        'sql': sql,
+        'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    recent_slow_queries.append(entry)
+    slow_query_logger.warning(f"Slow statement {name} took {entry['duration_ms']} ms "
+                              f"(params {entry['parameters']}): {sql}")
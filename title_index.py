@@ -0,0 +1,207 @@
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+import db
+
+GRAM_SIZE = 3
+
+# Query grams shared by more than this fraction of titles (" th", "the", ...)
+# are too common to narrow anything down, so they don't generate candidates.
+# Small collections never hit the cutoff; scoring all of them is cheap anyway.
+COMMON_GRAM_RATIO = 0.01
+
+# Once this many titles share a gram with the query, rarer grams have already
+# found the plausible matches; later grams only add to their counts
+CANDIDATE_POOL = 1024
+
+# Candidates (by trigram overlap) verified with edit distance per query
+MAX_CANDIDATES = 64
+
+MIN_SCORE = 0.45
+
+
+def normalize(title):
+    # Fold accents so "Amelie" finds "Amélie"
+    folded = unicodedata.normalize('NFKD', str(title).lower()).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', ' ', folded).strip()
+
+
+def grams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + GRAM_SIZE] for i in range(len(padded) - GRAM_SIZE + 1)}
+
+
+def word_starts(normalized):
+    return (0,) + tuple(i + 1 for i, char in enumerate(normalized) if char == ' ')
+
+
+def score(query, title, starts):
+    """Similarity in [0, 1]: whole-title edit distance, or best-aligned window for partial queries."""
+    import Levenshtein  # loaded on first search rather than at startup
+
+    whole = Levenshtein.ratio(query, title)
+    length = len(query)
+    if length >= len(title):
+        return whole
+    # Typing a fragment ("matr") should still rank the title it belongs to
+    best = max(Levenshtein.ratio(query, title[start:start + length]) for start in starts)
+    return max(whole, best * 0.95)
+
+
+class TitleIndex:
+    """In-memory trigram index over collection titles with edit-distance ranking.
+
+    Candidates come from trigram postings (rarest grams first); only the best
+    overlapping titles are scored with Levenshtein, so lookups stay sub-ms for
+    tens of thousands of titles.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._titles = {}                 # id -> (title, normalized, grams, word starts)
+        self._postings = defaultdict(set)  # gram -> ids
+        self._built = False
+        self._building = False
+        self._pending = []
+
+    @property
+    def built(self):
+        return self._built
+
+    def __len__(self):
+        return len(self._titles)
+
+    def _add(self, movie_id, title):
+        self._remove(movie_id)
+        normalized = normalize(title)
+        title_grams = grams(normalized)
+        self._titles[movie_id] = (title, normalized, title_grams, word_starts(normalized))
+        for gram in title_grams:
+            self._postings[gram].add(movie_id)
+
+    def _remove(self, movie_id):
+        entry = self._titles.pop(movie_id, None)
+        if entry is None:
+            return
+        for gram in entry[2]:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(movie_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def _apply(self, movie_id, title):
+        # title None means the movie was deleted
+        if self._building:
+            self._pending.append((movie_id, title))
+        elif not self._built:
+            return
+        elif title is None:
+            self._remove(movie_id)
+        else:
+            self._add(movie_id, title)
+
+    def add(self, movie_id, title):
+        with self._lock:
+            self._apply(movie_id, title)
+
+    def add_many(self, rows):
+        with self._lock:
+            for movie_id, title in rows:
+                self._apply(movie_id, title)
+
+    def remove(self, movie_id):
+        with self._lock:
+            self._apply(movie_id, None)
+
+    def build(self, load_rows):
+        """Replace the index with ``load_rows()`` ((id, title) pairs).
+
+        Updates that arrive while the rows are loading are replayed on top,
+        so a write racing the startup build isn't lost.
+        """
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._pending = []
+        started = time.monotonic()
+        try:
+            rows = load_rows()
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._pending = []
+            raise
+        with self._lock:
+            self._titles = {}
+            self._postings = defaultdict(set)
+            for movie_id, title in rows:
+                self._add(movie_id, title)
+            for movie_id, title in self._pending:
+                if title is None:
+                    self._remove(movie_id)
+                else:
+                    self._add(movie_id, title)
+            self._pending = []
+            self._building = False
+            self._built = True
+        logging.info(f"Title index built: {len(self._titles)} titles in {time.monotonic() - started:.2f}s")
+
+    def search(self, query, limit=20):
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        query_grams = grams(normalized)
+
+        with self._lock:
+            total = len(self._titles)
+            if not total:
+                return []
+            common = max(MAX_CANDIDATES, int(total * COMMON_GRAM_RATIO))
+            postings = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+            postings = [p for p in postings if p]
+            selective = [p for p in postings if len(p) <= common] or postings[:1]
+
+            overlap = Counter()
+            for posting in selective:
+                if len(overlap) < CANDIDATE_POOL:
+                    overlap.update(posting)
+                else:
+                    overlap.update(posting & overlap.keys())
+
+            if len(overlap) > MAX_CANDIDATES:
+                candidates = heapq.nlargest(MAX_CANDIDATES, overlap, key=overlap.__getitem__)
+            else:
+                candidates = list(overlap)
+
+            scored = []
+            for movie_id in candidates:
+                title, title_normalized, _, starts = self._titles[movie_id]
+                similarity = score(normalized, title_normalized, starts)
+                if similarity >= MIN_SCORE:
+                    scored.append((similarity, movie_id, title))
+
+        scored.sort(key=lambda item: (-item[0], len(item[2]), item[2]))
+        return [{'id': movie_id, 'title': title, 'score': round(similarity, 4)}
+                for similarity, movie_id, title in scored[:limit]]
+
+
+index = TitleIndex()
+
+
+def load_titles():
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT id, title FROM dvds")
+        return cursor.fetchall()
+
+
+def ensure_built():
+    if not index.built:
+        index.build(load_titles)
+    return index
@@ -0,0 +1,200 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+import requests
+from psycopg2.extras import Json
+
+import db
+import upstream
+
+SEARCH = 'search'
+DETAILS = 'details'
+
+TTLS = {
+    SEARCH: float(os.getenv('TMDB_SEARCH_TTL_HOURS', 24)) * 3600,
+    DETAILS: float(os.getenv('TMDB_DETAILS_TTL_HOURS', 168)) * 3600,
+}
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU with per-entry expiry."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_memory = LRUCache(int(os.getenv('TMDB_CACHE_SIZE', 2048)))
+_stats_lock = threading.Lock()
+_stats = {kind: {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'errors': 0} for kind in TTLS}
+
+
+# The persistent tier, shared with the asyncpg backend: (kind, cache_key)
+# -> payload, age in seconds; and (kind, cache_key, payload) to store
+LOOKUP_SQL = """
+    SELECT payload, EXTRACT(EPOCH FROM NOW() - fetched_at)::float AS age
+    FROM tmdb_cache
+    WHERE kind = %s AND cache_key = %s
+"""
+STORE_SQL = """
+    INSERT INTO tmdb_cache (kind, cache_key, payload, fetched_at)
+    VALUES (%s, %s, %s, NOW())
+    ON CONFLICT (kind, cache_key) DO UPDATE SET
+        payload = EXCLUDED.payload,
+        fetched_at = EXCLUDED.fetched_at
+"""
+
+
+def count(kind, counter):
+    with _stats_lock:
+        _stats[kind][counter] += 1
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', str(query)).strip().lower()
+
+
+def memory_get(kind, key):
+    """The in-memory entry for ``key`` (counted as a memory hit), or None."""
+    value = _memory.get((kind, key))
+    if value is not None:
+        count(kind, 'memory_hits')
+    return value
+
+
+def memory_put(kind, key, value, ttl=None):
+    _memory.set((kind, key), value, TTLS[kind] if ttl is None else ttl)
+
+
+def persistent_hit(kind, key, payload, age):
+    """Accept a LOOKUP_SQL row: returns the payload if it is still fresh
+    (keeping it in memory for the rest of its TTL), else None."""
+    if age >= TTLS[kind]:
+        return None
+    count(kind, 'persistent_hits')
+    memory_put(kind, key, payload, TTLS[kind] - age)
+    return payload
+
+
+def fetched(kind, key, value):
+    """Record a fetch from TMDB and keep the result in memory; False if it failed."""
+    if value is None:
+        # Upstream failures are not cached
+        count(kind, 'errors')
+        return False
+    memory_put(kind, key, value)
+    return True
+
+
+def _load_persistent(kind, key):
+    try:
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(LOOKUP_SQL, (kind, key))
+            row = cursor.fetchone()
+    except (psycopg2.Error, db.PoolTimeout) as e:
+        logging.warning(f"TMDB cache lookup failed, going to TMDB: {e}")
+        return None
+    return persistent_hit(kind, key, row[0], row[1]) if row else None
+
+
+def _store_persistent(kind, key, payload):
+    try:
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(STORE_SQL, (kind, key, Json(payload)))
+    except (psycopg2.Error, db.PoolTimeout) as e:
+        logging.warning(f"Failed to persist TMDB {kind} cache entry: {e}")
+
+
+def _cached(kind, key, fetch, refresh=False):
+    if not refresh:
+        value = memory_get(kind, key)
+        if value is None:
+            value = _load_persistent(kind, key)
+        if value is not None:
+            return value
+
+    count(kind, 'misses')
+    value = fetch()
+    if not fetched(kind, key, value):
+        return None
+    _store_persistent(kind, key, value)
+    return value
+
+
+def _get(path, **params):
+    params['api_key'] = os.getenv('TMDB_API_KEY')
+    try:
+        response = upstream.get(f"{upstream.TMDB_API_URL}{path}", params=params, timeout=upstream.TMDB_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request to TMDB failed: {e}")
+        return None
+    if response.status_code != 200:
+        logging.error(f"TMDB request {path} failed with status code {response.status_code}")
+        return None
+    try:
+        return response.json()
+    except ValueError as e:
+        # An HTML error page or a truncated body
+        logging.error(f"TMDB request {path} returned invalid JSON: {e}")
+        return None
+
+
+def search(query):
+    """TMDB movie search results for ``query`` ([] if none, None if TMDB failed)."""
+    key = normalize_query(query)
+
+    def fetch():
+        response = _get('/search/movie', query=key)
+        return None if response is None else response.get('results', [])
+
+    return _cached(SEARCH, key, fetch)
+
+
+def details(tmdb_id, refresh=False):
+    """Full TMDB movie record for ``tmdb_id`` (None if TMDB failed).
+
+    ``refresh`` skips the cached copy and re-fetches (and re-caches) it.
+    """
+    return _cached(DETAILS, str(int(tmdb_id)), lambda: _get(f"/movie/{int(tmdb_id)}"), refresh)
+
+
+def stats():
+    with _stats_lock:
+        snapshot = {kind: dict(counters) for kind, counters in _stats.items()}
+    for counters in snapshot.values():
+        lookups = counters['memory_hits'] + counters['persistent_hits'] + counters['misses']
+        counters['hit_ratio'] = round((lookups - counters['misses']) / lookups, 4) if lookups else 0.0
+    snapshot['memory_entries'] = len(_memory)
+    return snapshot
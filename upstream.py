@@ -0,0 +1,254 @@
+"""Shared client for every eBay and TMDB call.
+
+Blocking callers go through get(), coroutines through aget() with their
+httpx client; both apply the same timeouts, retry transient failures with
+jittered exponential backoff, wait on a per-host token bucket so bulk jobs
+stay under the upstream rate limits, and record per-host counters.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+EBAY_FINDING_URL = os.getenv('EBAY_FINDING_URL', "https://svcs.ebay.com/services/search/FindingService/v1")
+TMDB_API_URL = os.getenv('TMDB_API_URL', "https://api.themoviedb.org/3")
+
+CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+EBAY_TIMEOUT = (CONNECT_TIMEOUT, float(os.getenv('EBAY_READ_TIMEOUT', 10)))
+TMDB_TIMEOUT = (CONNECT_TIMEOUT, float(os.getenv('TMDB_READ_TIMEOUT', 10)))
+
+RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', 0.25))
+BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', 4))
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 32))
+
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+
+class TokenBucket:
+    """Thread-safe token bucket; reserve() books a token and says how long to wait for it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative: later callers queue behind earlier reservations
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+def _bucket(rate_variable, default_rate, url):
+    rate = float(os.getenv(rate_variable, default_rate))
+    if rate <= 0:
+        return None
+    burst = float(os.getenv(rate_variable.replace('_RATE_LIMIT', '_BURST'), rate))
+    return host_of(url), TokenBucket(rate, max(burst, 1))
+
+
+# Requests per second per host (0 disables the limit)
+_buckets = dict(bucket for bucket in (
+    _bucket('EBAY_RATE_LIMIT', 20, EBAY_FINDING_URL),
+    _bucket('TMDB_RATE_LIMIT', 40, TMDB_API_URL),
+) if bucket)
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+        self.statuses = {}
+
+    def snapshot(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': round(self.errors / self.requests, 4) if self.requests else 0.0,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'throttle_wait_seconds': round(self.throttle_seconds, 3),
+            'avg_latency_ms': round(1000 * self.latency_seconds / self.requests, 1) if self.requests else None,
+            'max_latency_ms': round(1000 * self.max_latency_seconds, 1),
+            'statuses': dict(self.statuses),
+        }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(host, latency, status=None, error=False, retry=False):
+    with _stats_lock:
+        stats = _stats.setdefault(host, HostStats())
+        stats.requests += 1
+        stats.latency_seconds += latency
+        stats.max_latency_seconds = max(stats.max_latency_seconds, latency)
+        if status is not None:
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        if error:
+            stats.errors += 1
+        if retry:
+            stats.retries += 1
+    metrics.upstream_requests.inc(host, str(status) if status is not None else 'error')
+    metrics.upstream_duration.observe(latency, host)
+    if retry:
+        metrics.upstream_retries.inc(host)
+
+
+def _throttle_delay(host):
+    bucket = _buckets.get(host)
+    delay = bucket.reserve() if bucket else 0.0
+    if delay > 0:
+        with _stats_lock:
+            stats = _stats.setdefault(host, HostStats())
+            stats.throttled += 1
+            stats.throttle_seconds += delay
+        metrics.upstream_throttle.inc(host, amount=delay)
+    return delay
+
+
+def _retry_after(headers):
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt, headers=None):
+    # Full jitter, but honour a (bounded) Retry-After from 429/503 responses
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    retry_after = _retry_after(headers) if headers is not None else None
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """The process-wide keep-alive session (created on first use)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                new_session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                new_session.mount("https://", adapter)
+                new_session.mount("http://", adapter)
+                _session = new_session
+    return _session
+
+
+def get(url, params=None, headers=None, timeout=None, retries=None):
+    """GET ``url`` through the shared session, rate limiter and retry policy.
+
+    Returns the last response (which may still be a 429/5xx once retries
+    run out); raises requests.RequestException if no response was received.
+    """
+    host = host_of(url)
+    retries = RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        time.sleep(_throttle_delay(host))
+        last_attempt = attempt == retries
+        started = time.monotonic()
+        try:
+            response = session().get(url, params=params, headers=headers, timeout=timeout or (CONNECT_TIMEOUT, 10))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            _record(host, time.monotonic() - started, error=True, retry=not last_attempt)
+            if last_attempt:
+                raise
+            delay = _backoff(attempt)
+            logging.warning(f"Request to {host} failed ({e}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+
+        retry = response.status_code in RETRY_STATUSES and not last_attempt
+        _record(host, time.monotonic() - started, response.status_code,
+                error=response.status_code >= 400, retry=retry)
+        if not retry:
+            return response
+        delay = _backoff(attempt, response.headers)
+        logging.warning(f"{host} answered {response.status_code}; retrying in {delay:.2f}s")
+        response.close()
+        time.sleep(delay)
+
+
+def _httpx_timeout(timeout):
+    import httpx
+
+    connect, read = timeout
+    return httpx.Timeout(read, connect=connect)
+
+
+async def aget(http, url, params=None, headers=None, timeout=None, retries=None):
+    """Coroutine get() on an httpx.AsyncClient; raises httpx.TransportError if no response was received."""
+    import httpx
+
+    host = host_of(url)
+    retries = RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        delay = _throttle_delay(host)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        last_attempt = attempt == retries
+        started = time.monotonic()
+        try:
+            response = await http.get(url, params=params, headers=headers,
+                                      timeout=_httpx_timeout(timeout or (CONNECT_TIMEOUT, 10)))
+        except httpx.TransportError as e:
+            _record(host, time.monotonic() - started, error=True, retry=not last_attempt)
+            if last_attempt:
+                raise
+            delay = _backoff(attempt)
+            logging.warning(f"Request to {host} failed ({e!r}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        retry = response.status_code in RETRY_STATUSES and not last_attempt
+        _record(host, time.monotonic() - started, response.status_code,
+                error=response.status_code >= 400, retry=retry)
+        if not retry:
+            return response
+        delay = _backoff(attempt, response.headers)
+        logging.warning(f"{host} answered {response.status_code}; retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+def stats():
+    with _stats_lock:
+        hosts = {host: host_stats.snapshot() for host, host_stats in _stats.items()}
+    limits = {host: {'rate_per_second': bucket.rate, 'burst': bucket.burst} for host, bucket in _buckets.items()}
+    return {'hosts': hosts, 'rate_limits': limits}